@@ -6,18 +6,26 @@ Bachelor's thesis by Gerrit Freiwald and Robin Wu
 # so that doctest does not get stuck with API
 if __name__ == "__main__":
     from datetime import datetime
-    from threading import Thread
-    from time import sleep, time
-    from flask import Flask, request
+    from time import time, perf_counter
+    from flask import Flask, request, g, jsonify, Response
     from flask_cors import CORS
     from MapMatcher import NetworkOfRoutes
+    from Caches import CandidateCache
+    from Metrics import REGISTRY
+    from RequestProfiler import RequestProfiler
+    from MemoryReport import container_memory_report
+    from TraceRecorder import TraceRecorder
+    from AdmissionControl import AdmissionController, Rejected
+    from RequestParsing import parse_map_match_request, parse_connections_request, connections_to_dict, \
+        parse_journeys_request, parse_shapes_request, shape_to_dict, shape_etag, etag_matches, \
+        parse_stop_search_request, stops_to_dict, parse_nearby_stops_request, nearby_stops_to_dict, parse_chat_poll
+    from Raptor import Raptor
     from ChatMessages import Chat, ChatMessage
     from GTFSContainer import GTFSContainer
     from ParseConfig import get_config, get_city_config, get_credentials
-    from schedule import every, run_pending
+    from BackgroundScheduler import SCHEDULER, seconds_until
     from ControlGTFSFiles import try_to_fetch_gtfs
     from FetchRealtimeUpdates import GTFSrtGetter
-    from Utilities import convert_utc_to_local_time
 
     # get config info
     config = get_config()
@@ -27,17 +35,23 @@ if __name__ == "__main__":
     city_config = get_city_config(CITY, gtfs_rt=use_gtfs_rt)
     timezone = city_config["timezone"]
 
-    # fetch gtfs rt updates
+    # close edges of gps points are cached across requests
+    candidate_cache = CandidateCache(
+        max_size=config["CANDIDATE_CACHE_SIZE"], quantized=config["CANDIDATE_CACHE_QUANTIZED"],
+        grid_size=config["CANDIDATE_CACHE_GRID_SIZE"], time_bucket=config["CANDIDATE_CACHE_TIME_BUCKET"])
+
+    # profiles single map matching requests
+    profiler = RequestProfiler(
+        config["PROFILE_DIRECTORY"], sample_rate=config["PROFILE_SAMPLE_RATE"],
+        max_profiles=config["PROFILE_MAX_FILES"])
+
+    # records sampled requests for offline replay
+    trace_recorder = TraceRecorder(
+        config["TRACE_DIRECTORY"], sample_rate=config["TRACE_SAMPLE_RATE"],
+        max_bytes=config["TRACE_MAX_MEGABYTES"] * 1024 ** 2, max_files=config["TRACE_MAX_FILES"])
+
+    # gtfs rt updates, fetched as soon as the GTFS container is loaded
     updates = {}
-    if use_gtfs_rt:
-        if "RT-API-key" in city_config:
-            api_key_name = city_config["RT-API-key"]
-            creds = get_credentials([api_key_name])[api_key_name]
-        else:
-            creds = None
-        gtfs_rt = GTFSrtGetter(CITY, city_config["GTFS-RT-feed"], creds, debug_print=DEBUG)
-        # update the gtfs rt dictionary periodically
-        gtfs_rt.fetch_trip_updates_every_n_minutes(city_config["RT-UPDATE-PERIOD"])(updates)
 
     # get GTFS path
     gtfs_path = "../" + city_config["path-to-GTFS"] + "/gtfs-out/"
@@ -54,21 +68,113 @@ if __name__ == "__main__":
     # process GTFS files
     gtfs_container = GTFSContainer(
         path_gtfs=gtfs_path, path_saved_dictionaries=saved_dictionaries_path,
-        update_dicts=config["UPDATE_DICTS"], rt_dict=updates, verbose=DEBUG)
+        update_dicts=config["UPDATE_DICTS"], rt_dict=updates, verbose=DEBUG,
+        shape_cache_size=config["SHAPE_CACHE_SIZE"], connections_cache_size=config["CONNECTIONS_CACHE_SIZE"])
+
+    # fetch gtfs rt updates
+    gtfs_rt = None
+    if use_gtfs_rt:
+        if "RT-API-key" in city_config:
+            api_key_name = city_config["RT-API-key"]
+            creds = get_credentials([api_key_name])[api_key_name]
+        else:
+            creds = None
+        # cached close edges depend on the realtime data
+        # the scheduled times of the container convert the predicted times of the feed to delays
+        gtfs_rt = GTFSrtGetter(CITY, city_config["GTFS-RT-feed"], creds, debug_print=DEBUG,
+                               on_update=candidate_cache.invalidate, gtfs_container=gtfs_container,
+                               timezone=timezone)
+        # update the gtfs rt dictionary periodically
+        gtfs_rt.fetch_trip_updates_every_n_minutes(city_config["RT-UPDATE-PERIOD"])(updates)
 
-    network = NetworkOfRoutes(
-        gtfs_container, print_time=DEBUG,
-        prefer_last_trip=config["PREFER_LAST_TRIP"],
-        baseline=config["BASELINE"],
-        baseline_hmm=config["BASELINE_HMM"],
-        time_after=config["TIME_AFTER"], slack=config["SLACK"],
-        earliness=config["EARLINESS"], delay=config["DELAY"],
-        timezone=timezone)
+    network = NetworkOfRoutes.from_config(
+        gtfs_container, config, timezone, candidate_cache=candidate_cache, print_time=DEBUG)
+
+    # timetable of /journeys
+    raptor = Raptor(gtfs_container, timezone, config["JOURNEYS_TRANSFER_SECONDS"]) if config["JOURNEYS"] else None
 
     # start API
     app = Flask(__name__)
     CORS(app)
 
+    # metrics, exposed by /metrics
+    request_seconds = REGISTRY.histogram(
+        "api_request_seconds", "Runtime of the requests of each endpoint in seconds", "endpoint")
+    requests_total = REGISTRY.counter("api_requests_total", "Number of requests of each endpoint", "endpoint")
+    json_seconds = REGISTRY.histogram(
+        "api_json_seconds", "Runtime of parsing requests and serializing answers in seconds", "step")
+    REGISTRY.gauge("candidate_cache_hit_rate", "Hit rate of the candidate cache",
+                   function=lambda: candidate_cache.hit_rate)
+    REGISTRY.gauge("candidate_cache_size", "Number of gps points in the candidate cache",
+                   function=lambda: len(candidate_cache))
+    REGISTRY.gauge("candidate_cache_invalidations", "Number of times the candidate cache was cleared",
+                   function=lambda: candidate_cache.invalidations)
+    REGISTRY.gauge("connections_cache_hit_rate", "Hit rate of the departures cached for /connections",
+                   # no value while the GTFS container is rebuilt
+                   function=lambda: gtfs_container.connections_cache.hit_rate
+                   if gtfs_container is not None else float("nan"))
+    REGISTRY.gauge("trace_dropped_requests", "Number of requests that were not recorded, because the queue was full",
+                   function=lambda: trace_recorder.dropped)
+
+    # endpoints that are not recorded
+    untraced_endpoints = {"/metrics", "/debug/memory"}
+
+    # limits the concurrent requests per endpoint, /map-match goes first, sheds requests under overload
+    admission = None
+    if config["ADMISSION_CONTROL"]:
+        admission = AdmissionController(
+            max_concurrent=config["ADMISSION_MAX_CONCURRENT"], limits=config["ADMISSION_LIMITS"],
+            queue_size=config["ADMISSION_QUEUE_SIZE"], max_wait_ms=config["ADMISSION_MAX_WAIT_MS"])
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = perf_counter()
+        g.record_trace = trace_recorder.should_record()
+
+        if admission is not None and request.url_rule:
+            try:
+                g.admission_ticket = admission.admit(request.url_rule.rule)
+            except Rejected as e:
+                response = jsonify({})
+                response.status_code = e.status
+                response.headers["Retry-After"] = str(e.retry_after)
+                return response
+
+    @app.teardown_request
+    def release_admission_ticket(_):
+        # also runs if the handler raised an exception
+        if "admission_ticket" in g:
+            g.admission_ticket.release()
+
+    @app.after_request
+    def record_request_time(response):
+        if "request_start" in g:
+            # use the route instead of the path, so that unknown paths do not create new labels
+            endpoint = request.url_rule.rule if request.url_rule else "unknown"
+            duration = perf_counter() - g.request_start
+            request_seconds.observe(duration, endpoint)
+            requests_total.inc(label=endpoint)
+            if g.record_trace and endpoint not in untraced_endpoints:
+                trace_recorder.record(endpoint, request.get_json(silent=True), response.status_code, duration,
+                                      g.get("answer"))
+        return response
+
+    def parse_json():
+        """
+        request.json, the runtime is recorded in json_seconds
+        """
+        with json_seconds.time("parse"):
+            return request.json
+
+    def to_json(dct: dict, status: int = 200, headers: dict = None):
+        """
+        Serializes an answer, the runtime is recorded in json_seconds
+        """
+        # summarized by the trace recorder
+        g.answer = dct
+        with json_seconds.time("serialize"):
+            return jsonify(dct), status, headers or {}
+
     # set flag whether the api is on or not
     IS_API_ON = True
 
@@ -77,7 +183,8 @@ if __name__ == "__main__":
     last_user_id = 0
 
     # provide the chat
-    chat = Chat(gtfs_container, debug=DEBUG)
+    chat = Chat(gtfs_container, debug=DEBUG, max_messages=config["CHAT_MAX_MESSAGES"],
+                max_message_length=config["CHAT_MAX_MESSAGE_LENGTH"])
     chat.remove_inactive_trips_every_hour()
 
     def shut_down_api_and_fetch_new_gtfs():
@@ -86,6 +193,7 @@ if __name__ == "__main__":
         """
         global IS_API_ON
         global gtfs_container
+        global raptor
 
         t = time()
         print("shutting down GTFS container", flush=True)
@@ -102,18 +210,26 @@ if __name__ == "__main__":
             path_gtfs=gtfs_path,
             path_saved_dictionaries=saved_dictionaries_path,
             update_dicts=True, rt_dict=updates,
-            verbose=DEBUG
+            verbose=DEBUG, shape_cache_size=config["SHAPE_CACHE_SIZE"],
+            connections_cache_size=config["CONNECTIONS_CACHE_SIZE"]
         )
+        # the network and the chat still reference the old container
+        # the candidate cache is cleared, as soon as the network uses the new container
+        network.tt = gtfs_container
+        chat.gtfs_container = gtfs_container
+        if gtfs_rt is not None:
+            gtfs_rt.gtfs_container = gtfs_container
+        if config["JOURNEYS"]:
+            raptor = Raptor(gtfs_container, timezone, config["JOURNEYS_TRANSFER_SECONDS"])
         IS_API_ON = True
 
         print(f"GTFS container is now online again.\n"
               f"Time needed: {round(time() - t, 2)}s", flush=True)
 
-    def scheduler_thread():
+    def schedule_gtfs_updates():
         """
-        This function can be run in a thread parallel to the API.
-        It will run 'shut_down_api_and_fetch_new_GTFS' according to the time and the time interval
-            given in config.yml.
+        Runs 'shut_down_api_and_fetch_new_GTFS' as a job of the background scheduler
+            every UPDATE_FREQUENCY days at UPDATE_TIME, given in config.yml.
         """
         # how many days until the next update
         update_frequency = config["UPDATE_FREQUENCY"]
@@ -124,19 +240,18 @@ if __name__ == "__main__":
         print(f"Will fetch new GTFS files every {update_frequency} days "
               f"at {update_time}. Time now: {datetime.now()}", flush=True)
 
-        every(update_frequency).days.at(update_time).do(shut_down_api_and_fetch_new_gtfs)
+        def next_update() -> float:
+            return seconds_until(update_time, days=update_frequency)
 
-        while True:
-            run_pending()
-            sleep(1 * 60)  # check schedule every minute
+        SCHEDULER.add_job("gtfs_update", shut_down_api_and_fetch_new_gtfs, next_update, first_delay=next_update())
 
     def run_app():
         """
         Runs the API.
 
-        If config["UPDATE_GTFS"], run a thread next to the API that repeatedly checks if it is time
-            to fetch new GTFS files and rebuild them.
+        If config["UPDATE_GTFS"], the background scheduler fetches new GTFS files and rebuilds them regularly.
             During that time, the API will not be able to return anything, as the GTFS container is down.
+        Stops the background jobs when the API stops.
         """
         global IS_API_ON
 
@@ -145,14 +260,12 @@ if __name__ == "__main__":
         print("Server is now online. You can now connect with the frontend.", flush=True)
 
         if config["UPDATE_GTFS"]:
-            # start API in a thread in order to be able to check if it is GTFS fetching time
-            IS_API_ON = True
-
-            Thread(target=scheduler_thread).start()
-            app.run(host='0.0.0.0', port=config["SERVER_PORT"])
-        else:
-            IS_API_ON = True
+            schedule_gtfs_updates()
+        IS_API_ON = True
+        try:
             app.run(host='0.0.0.0', port=config["SERVER_PORT"])
+        finally:
+            SCHEDULER.shutdown()
 
     def manage_user_ids(user_id: int, saved_start_server_timestamp: float) -> int:
         """
@@ -176,39 +289,37 @@ if __name__ == "__main__":
         It performs a dynamic map-matching und returns the matched trip with
         further information.
         """
-        print("Polyline Request start", flush=True)
         if not IS_API_ON:
             print("API is offline", flush=True)
             return {}, 503
 
-        req = request.json
+        req = parse_json()
         if DEBUG:
             print("", flush=True)
             print("incoming ", flush=True)
             print(req, flush=True)
             print("", flush=True)
 
-        trip_id = req["trip_id"]
-        coordinates = req["coordinates"]
-
-        if not coordinates:
+        parsed = parse_map_match_request(req, config["MATCH_MAX_DEADLINE_MS"])
+        if parsed is None or not parsed[0]:
             return {}, 400
+        route, trip_id, deadline_ms = parsed
 
-        route = []
-        for coord in coordinates:
-            coord = coord.split(',')
-            # lat, lon, time, convert from milliseconds to seconds unix time
-            route.append([float(coord[0]), float(coord[1]), int(coord[2]) // 1000])
-
-        most_likely_dict = network.find_route_name(route, dist=0.1, trip_id=trip_id)
+        if profiler.should_profile(config["PROFILE_ON_HEADER"] and "X-Profile" in request.headers):
+            most_likely_dict, profile_id = profiler.profile(
+                network.find_route_name, route, dist=0.1, trip_id=trip_id, deadline_ms=deadline_ms, request_input=req)
+            if profile_id:
+                most_likely_dict["profile_id"] = profile_id
+        else:
+            most_likely_dict = network.find_route_name(route, dist=0.1, trip_id=trip_id, deadline_ms=deadline_ms)
 
         if DEBUG:
             print("", flush=True)
             print("answer ", flush=True)
             print(most_likely_dict, flush=True)
+            print(f"candidate cache: {candidate_cache.stats()}", flush=True)
             print("", flush=True)
-        print("Polyline Request end", flush=True)
-        return most_likely_dict, 200
+        return to_json(most_likely_dict)
 
     @app.route('/connections', methods=['GET', 'POST'])
     def get_connections():
@@ -216,17 +327,17 @@ if __name__ == "__main__":
         Sends information to the frontend in order to display the connections at the next stop.
         connections: public transit vehicles that pass by the next stop in the next time period.
         """
-        print("Connections Request start", flush=True)
         if not IS_API_ON:
             print("API is offline", flush=True)
             return {}, 503
 
-        req = request.json
-        if not req or req['next_stop_name'] == 'next stop':
+        req = parse_json()
+        parsed = parse_connections_request(req, timezone)
+        if parsed is None:
             return {}, 400
 
-        if req['next_stop_name'] == "" or req['user_time'] == "":
-            return {"length": 0}, 200
+        if parsed == "":
+            return to_json({"length": 0})
 
         if DEBUG:
             print("", flush=True)
@@ -234,46 +345,119 @@ if __name__ == "__main__":
             print(req, flush=True)
             print("", flush=True)
 
-        trip_id = req['trip_id']
-
-        next_stop_name = req['next_stop_name']
-        user_time = int(req['user_time']) // 1000
-        user_time_datetime = convert_utc_to_local_time(user_time, timezone_name=timezone)
+        next_stop_name, user_time_datetime, trip_id = parsed
+        # the stop name of the frontend may differ slightly from the feed, e.g. in umlauts or the city
+        resolved_stop_name = network.tt.stop_search.resolve(next_stop_name)
+        if resolved_stop_name is None:
+            print(f"unknown stop name {next_stop_name}", flush=True)
+            return to_json({"length": 0})
+        next_stop_name = resolved_stop_name
 
-        print("fetching transfer possibilities...", flush=True)
         possibilities = network.tt.find_transfer_possibilities(next_stop_name, user_time_datetime, trip_id)
-        print(f"transfer possibilities for {next_stop_name} at "
-              f"{user_time_datetime.strftime('%Y/%m/%d - %H:%M')}:")
-        for possibility in possibilities:
-            print(possibility)
-
-        idx, connections = 0, {}
-        for possibility in possibilities:
-            # Linename: Linedirection: next Times
-            # skip if the destination is the same as next stop (terminal station)
-            if possibility[1] == next_stop_name:
-                continue
-            connections[str(idx)] = possibility
-            idx += 1
-
-        connections['length'] = len(connections)
-        print("Connections Request end", flush=True)
-        return connections, 200
+        if DEBUG:
+            print(f"transfer possibilities for {next_stop_name} at "
+                  f"{user_time_datetime.strftime('%Y/%m/%d - %H:%M')}:", flush=True)
+            for possibility in possibilities:
+                print(possibility, flush=True)
+
+        return to_json(connections_to_dict(possibilities, next_stop_name))
+
+    @app.route('/journeys', methods=['GET', 'POST'])
+    def get_journeys():
+        """
+        Public transit routing between stop names (RAPTOR), next to the direct departures of /connections.
+        With to_stop_name: the earliest arrival journeys with at most max_transfers transfers.
+        Without: the stops that are reachable within max_minutes with at most max_transfers transfers.
+        """
+        if not config["JOURNEYS"]:
+            return to_json({"error": "journeys are disabled"}, status=404)
+        if not IS_API_ON:
+            print("API is offline", flush=True)
+            return {}, 503
+
+        req = parse_json()
+        parsed = parse_journeys_request(req, timezone, max_transfers=config["JOURNEYS_MAX_TRANSFERS"])
+        if parsed is None:
+            return {}, 400
+        from_stop_name, to_stop_name, user_time_datetime, max_transfers, max_minutes = parsed
+
+        if DEBUG:
+            print("", flush=True)
+            print("incoming ", flush=True)
+            print(req, flush=True)
+            print("", flush=True)
+
+        # stop names that differ slightly from the feed, unknown stop names have no journeys
+        from_stop_name = gtfs_container.stop_search.resolve(from_stop_name) or from_stop_name
+        if to_stop_name is not None:
+            to_stop_name = gtfs_container.stop_search.resolve(to_stop_name) or to_stop_name
+
+        if to_stop_name is None:
+            stops = raptor.reachable_stops(from_stop_name, user_time_datetime, max_minutes, max_transfers)
+            return to_json({"stops": stops, "length": len(stops)})
+
+        journeys = raptor.earliest_arrival(from_stop_name, to_stop_name, user_time_datetime, max_transfers)
+        return to_json({"journeys": journeys, "length": len(journeys)})
+
+    @app.route('/search-stops', methods=['GET', 'POST'])
+    def search_stops():
+        """
+        Autocomplete of the stop names with the positions of the stops, filled up with fuzzy matches for typos.
+        Normalizes umlauts, punctuation, abbreviations and city prefixes, e.g. GET /search-stops?query=freiburg%20hbf
+        """
+        if not IS_API_ON:
+            print("API is offline", flush=True)
+            return {}, 503
+
+        req = request.args if request.method == "GET" and "query" in request.args else parse_json()
+        parsed = parse_stop_search_request(req)
+        if parsed is None:
+            return {}, 400
+        query, limit = parsed
+
+        return to_json(stops_to_dict(gtfs_container.search_stops(query, limit)))
+
+    @app.route('/nearby-stops', methods=['GET', 'POST'])
+    def nearby_stops():
+        """
+        The closest stops of a position within a radius (meters), e.g. GET /nearby-stops?lat=47.99&lon=7.84&limit=5
+        Uses the grid index of the GTFS container instead of comparing every stop.
+        """
+        if not IS_API_ON:
+            print("API is offline", flush=True)
+            return {}, 503
+
+        req = request.args if request.method == "GET" and "lat" in request.args else parse_json()
+        parsed = parse_nearby_stops_request(req)
+        if parsed is None:
+            return {}, 400
+
+        return to_json(nearby_stops_to_dict(gtfs_container.get_nearby_stops(*parsed)))
 
     @app.route('/shapes', methods=['GET', 'POST'])
     def get_shape():
         """
         As the actual shape from the GTFS data is not loaded in memory (too large),
         calculate the shape based on the GTFS graph in the GTFS-Container.
+        The shapes are cached in the container. The answer has an ETag and Cache-Control,
+        GET /shapes?shape_id=...&trip_id=... can also be cached by proxies.
+        Optional: "zoom" (web map zoom level) or "tolerance" (meters) for a simplified polyline,
+        "encoding" ("polyline" or "delta") and "precision" (decimals) for compact coordinates.
         """
-        print("\nShape Request start", flush=True)
         if not IS_API_ON:
             print("API is offline", flush=True)
             return {}, 503
 
-        req = request.json
-        if not req:
+        req = request.args if request.method == "GET" and "shape_id" in request.args else parse_json()
+        parsed = parse_shapes_request(req)
+        if parsed is None:
             return {}, 400
+        shape_id, trip_id, zoom, tolerance, encoding, precision = parsed
+
+        headers = {"ETag": shape_etag(gtfs_container.version, *parsed),
+                   "Cache-Control": f"public, max-age={config['SHAPES_MAX_AGE']}"}
+        if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+            return Response(status=304, headers=headers)
 
         if DEBUG:
             print("", flush=True)
@@ -281,28 +465,32 @@ if __name__ == "__main__":
             print(req, flush=True)
             print("", flush=True)
 
-        polyline, stops = gtfs_container.get_shape_polyline_and_stops(req["shape_id"], req["trip_id"])
+        polyline = gtfs_container.get_simplified_shape_polyline(shape_id, zoom=zoom, tolerance=tolerance)
+        stops = gtfs_container.get_trip_stop_positions(trip_id)
 
-        print("Shapes Request end\n", flush=True)
-        return {"polyline": polyline, "stops": stops}, 200
+        return to_json(shape_to_dict(polyline, stops, encoding, precision), headers=headers)
 
     @app.route('/chat', methods=['GET', 'POST'])
     def get_chat():
         """
         Handles the chat messages.
         If a new message has been sent, save it.
-        Always send back the current chat messages of the current trip.
+        Always send back the current chat messages of the current trip,
+        only the ones after "after_id" if given (the message id is the last element of a message).
+        With "wait" (seconds), the request waits for a new message if there is none yet (long polling).
         """
-        print("Chat Request start", flush=True)
         if not IS_API_ON:
             print("API is offline", flush=True)
             return {}, 503
 
-        print(f"server start stamp: {server_start_timestamp}", flush=True)
-
-        req = request.json
+        req = parse_json()
         if DEBUG:
+            print(f"server start stamp: {server_start_timestamp}", flush=True)
             print(f"req: {req}", flush=True)
+        poll = parse_chat_poll(req, config["CHAT_MAX_WAIT_SECONDS"])
+        if poll is None:
+            return {}, 400
+        after_id, wait = poll
 
         # manage user_id
         user_id = manage_user_ids(int(req["user_id"]), float(req["server_start_timestamp"]))
@@ -314,16 +502,40 @@ if __name__ == "__main__":
                 user_id, req['user_name'], req['message'], req['user_time']
             ))
 
+        if wait:
+            # the waiting request gives its admission slot back, and the wait is not part of the runtime of /chat
+            if "admission_ticket" in g:
+                g.admission_ticket.release()
+            chat.wait_for_messages(trip_id, after_id, wait)
+
         if DEBUG:
-            print(f"get message: {chat.get_messages(trip_id)}")
+            print(f"get message: {chat.get_messages(trip_id, after_id)}")
 
         ret_dct = {
             'user_id': user_id,
             'server_start_timestamp': server_start_timestamp,
-            'messages': chat.get_messages(trip_id)
+            'messages': chat.get_messages(trip_id, after_id)
         }
 
-        print("Chat Request end", flush=True)
-        return ret_dct, 200
+        return to_json(ret_dct)
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        """
+        Latency histograms of the map matcher stages and the endpoints, counters and cache hit rates
+        in the Prometheus text format.
+        """
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route('/debug/memory', methods=['GET'])
+    def get_memory_report():
+        """
+        Bytes of every structure of the GTFS container, only if MEMORY_REPORT_ENDPOINT is set in the config.
+        Walks every object of the container, so it takes seconds for large networks.
+        """
+        if not config["MEMORY_REPORT_ENDPOINT"]:
+            return to_json({"error": "the memory report is disabled"}, status=404)
+
+        return to_json(dict(container_memory_report(gtfs_container)))
 
     run_app()
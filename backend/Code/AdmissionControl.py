@@ -0,0 +1,219 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+Admission control in front of the handlers of the API.
+Limits the number of concurrent requests per endpoint, lets /map-match go before /chat and /connections
+and rejects requests fast if they would wait longer than a budget, instead of letting the latency grow for everyone.
+"""
+import heapq
+from itertools import count
+from math import ceil
+from threading import Condition
+from time import monotonic
+
+from Metrics import REGISTRY
+
+# lower values go first
+DEFAULT_PRIORITIES = {"/map-match": 0, "/shapes": 1, "/connections": 2, "/journeys": 2, "/search-stops": 2,
+                      "/nearby-stops": 2, "/chat": 3}
+DEFAULT_LIMITS = {"/map-match": 4, "/shapes": 4, "/connections": 4, "/journeys": 2, "/search-stops": 4,
+                  "/nearby-stops": 4, "/chat": 8}
+# weight of a new runtime in the moving average of the runtimes
+RUNTIME_SMOOTHING = 0.2
+
+queue_depth = REGISTRY.gauge("admission_queue_depth", "Number of requests waiting for admission")
+running_requests = REGISTRY.gauge("admission_running_requests", "Number of admitted requests that are running")
+shed_total = REGISTRY.counter("admission_shed_total", "Number of rejected requests of each endpoint", "endpoint")
+wait_seconds = REGISTRY.histogram("admission_wait_seconds", "Time requests waited for admission", "endpoint")
+
+
+class Rejected(Exception):
+    """
+    The request is not admitted. status is 429 if the wait would exceed the budget, 503 if the queue is full.
+    """
+
+    def __init__(self, status: int, retry_after: int):
+        super().__init__(f"rejected with {status}, retry after {retry_after}s")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Requests of endpoints without a limit are not controlled.
+
+    >>> controller = AdmissionController(max_concurrent=1, limits={"/map-match": 1, "/chat": 1}, queue_size=1)
+    >>> with controller.admit("/chat"):
+    ...     controller.running
+    1
+    >>> with controller.admit("/metrics"):
+    ...     controller.running
+    0
+    >>> ticket = controller.admit("/map-match")
+    >>> # the only slot is taken and nobody releases it in time
+    >>> controller.max_wait = 0.01
+    >>> try:
+    ...     controller.admit("/chat")
+    ... except Rejected as e:
+    ...     e.status
+    503
+    >>> ticket.release()
+    >>> controller.shed["/chat"], controller.running
+    (1, 0)
+    """
+
+    def __init__(self, max_concurrent: int = 8, limits: dict = None, priorities: dict = None,
+                 queue_size: int = 64, max_wait_ms: float = 2000):
+        """
+        Input:
+            max_concurrent: number of admitted requests that run at once
+            limits: {endpoint: number of concurrent requests}
+            priorities: {endpoint: priority}, lower priorities are admitted first
+            queue_size: number of requests that wait at most, more are rejected with 503
+            max_wait_ms: budget of the wait, requests whose estimated wait is longer are rejected with 429,
+                requests that waited longer are rejected with 503
+        """
+        self.max_concurrent = max_concurrent
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.priorities = dict(DEFAULT_PRIORITIES if priorities is None else priorities)
+        self.queue_size = queue_size
+        self.max_wait = max_wait_ms / 1000
+        self.running = 0
+        self.running_per_endpoint = {endpoint: 0 for endpoint in self.limits}
+        # moving average of the runtime of each endpoint
+        self.runtimes = {endpoint: 0.0 for endpoint in self.limits}
+        self.shed = {endpoint: 0 for endpoint in self.limits}
+        # heap of (priority, sequence number, endpoint)
+        self._queue = []
+        self._counter = count()
+        self._condition = Condition()
+
+        queue_depth.function = lambda: len(self._queue)
+        running_requests.function = lambda: self.running
+
+    def has_capacity(self, endpoint: str) -> bool:
+        return self.running < self.max_concurrent and self.running_per_endpoint[endpoint] < self.limits[endpoint]
+
+    def estimated_wait(self, priority: int) -> float:
+        """
+        Seconds until a new request with priority is admitted: the runtimes of the waiting requests
+        that go first, shared by the concurrent slots
+        """
+        ahead = sum(self.runtimes[endpoint] for p, _, endpoint in self._queue if p <= priority)
+        return ahead / self.max_concurrent
+
+    def retry_after(self) -> int:
+        return max(1, ceil(self.estimated_wait(float("inf"))))
+
+    def _reject(self, endpoint: str, status: int):
+        self.shed[endpoint] += 1
+        shed_total.inc(label=endpoint)
+        raise Rejected(status, self.retry_after())
+
+    def _is_next(self, entry: tuple) -> bool:
+        """
+        entry is the waiting request with the lowest priority, whose endpoint has capacity
+        """
+        for waiting in sorted(self._queue):
+            if self.has_capacity(waiting[2]):
+                return waiting is entry
+        return False
+
+    def admit(self, endpoint: str):
+        """
+        Blocks until the request is admitted.
+        Returns a Ticket that has to be released after the request, e.g. with "with".
+        Raises Rejected if the request is not admitted.
+
+        >>> # two waiters, both slots are released at once, both waiters are admitted
+        >>> from threading import Thread
+        >>> from time import sleep
+        >>> controller = AdmissionController(max_concurrent=2, limits={"/map-match": 2}, max_wait_ms=5000)
+        >>> running = [controller.admit("/map-match"), controller.admit("/map-match")]
+        >>> admitted = []
+        >>> waiters = [Thread(target=lambda: admitted.append(controller.admit("/map-match"))) for _ in range(2)]
+        >>> for waiter in waiters:
+        ...     waiter.start()
+        >>> while len(controller._queue) < 2:
+        ...     sleep(0.001)
+        >>> with controller._condition:
+        ...     for ticket in running:
+        ...         ticket.release()
+        >>> for waiter in waiters:
+        ...     waiter.join()
+        >>> len(admitted), controller.running, controller.shed["/map-match"]
+        (2, 2, 0)
+        """
+        if endpoint not in self.limits:
+            return Ticket(self, None, monotonic())
+
+        start = monotonic()
+        with self._condition:
+            priority = self.priorities.get(endpoint, max(self.priorities.values(), default=0) + 1)
+            if not self._queue and self.has_capacity(endpoint):
+                self._start(endpoint)
+                wait_seconds.observe(0, endpoint)
+                return Ticket(self, endpoint, start)
+
+            if len(self._queue) >= self.queue_size:
+                self._reject(endpoint, 503)
+            if self.estimated_wait(priority) > self.max_wait:
+                self._reject(endpoint, 429)
+
+            entry = (priority, next(self._counter), endpoint)
+            heapq.heappush(self._queue, entry)
+            deadline = start + self.max_wait
+            while not self._is_next(entry):
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    # another request may be admitted now
+                    self._condition.notify_all()
+                    self._reject(endpoint, 503)
+                self._condition.wait(remaining)
+
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            self._start(endpoint)
+            # the head of the queue changed, the next waiter may be admitted with another free slot
+            self._condition.notify_all()
+            wait_seconds.observe(monotonic() - start, endpoint)
+            return Ticket(self, endpoint, monotonic())
+
+    def _start(self, endpoint: str):
+        self.running += 1
+        self.running_per_endpoint[endpoint] += 1
+
+    def release(self, endpoint: str, runtime: float):
+        with self._condition:
+            self.running -= 1
+            self.running_per_endpoint[endpoint] -= 1
+            self.runtimes[endpoint] += RUNTIME_SMOOTHING * (runtime - self.runtimes[endpoint])
+            self._condition.notify_all()
+
+
+class Ticket:
+    """
+    An admitted request, released exactly once
+    """
+
+    __slots__ = ["controller", "endpoint", "start", "released"]
+
+    def __init__(self, controller: AdmissionController, endpoint, start: float):
+        self.controller = controller
+        self.endpoint = endpoint
+        self.start = start
+        self.released = False
+
+    def release(self):
+        if not self.released and self.endpoint is not None:
+            self.controller.release(self.endpoint, monotonic() - self.start)
+        self.released = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.release()
@@ -0,0 +1,462 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+Async serving mode of the API, an ASGI app served by uvicorn (needs starlette and uvicorn).
+The requests are received and parsed on an event loop, the map matching runs in a pool of worker processes,
+so slow /map-match requests do not block /chat and /connections and multiple trajectories are matched at once.
+The routes and the JSON answers are the same as in API.py.
+In addition, /map-match/ws is a WebSocket for streaming map matching (needs the websockets package for uvicorn):
+the client sends only its new GPS fixes {"coordinates": [...]} and gets the /map-match answer whenever it changes.
+
+python AsyncAPI.py
+
+The worker processes are forked after the GTFS container is loaded and share its memory copy on write.
+If more than ASYNC_MAX_PENDING_PER_WORKER map matching requests per worker are waiting, /map-match answers
+503 with Retry-After instead of queueing them.
+The workers send the map matching metrics they recorded and the statistics of their candidate caches with every
+answer, /metrics shows them summed over the workers.
+Not supported compared to API.py: fetching new GTFS files while running (UPDATE_GTFS) and the cProfile profiles.
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from json import JSONDecodeError, loads
+from multiprocessing import get_all_start_methods, get_context
+from time import perf_counter
+from traceback import format_exc
+from typing import Tuple
+from weakref import WeakValueDictionary
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from BackgroundScheduler import SCHEDULER
+from Caches import CandidateCache
+from ChatMessages import Chat, ChatMessage
+from GTFSContainer import GTFSContainer
+from MapMatcher import NetworkOfRoutes, STAGE_SECONDS, CANDIDATES_PER_POINT, TRANSITIONS_PER_REQUEST, MATCH_TIER, \
+    DEGRADED_MATCHES
+from MatchSessions import MatchSession
+from MemoryReport import container_memory_report
+from Metrics import REGISTRY
+from ParseConfig import get_config, get_city_config, get_credentials
+from Raptor import Raptor
+from RequestParsing import parse_map_match_request, parse_connections_request, connections_to_dict, \
+    parse_journeys_request, parse_shapes_request, shape_to_dict, shape_etag, etag_matches, parse_stop_search_request, \
+    stops_to_dict, parse_nearby_stops_request, nearby_stops_to_dict, parse_match_session_message, parse_chat_poll
+from TraceRecorder import TraceRecorder
+
+# the container of the main process, the forked worker processes inherit it
+_container = None
+# the map matcher of a worker process
+_network = None
+
+request_seconds = REGISTRY.histogram(
+    "api_request_seconds", "Runtime of the requests of each endpoint in seconds", "endpoint")
+requests_total = REGISTRY.counter("api_requests_total", "Number of requests of each endpoint", "endpoint")
+rejected_total = REGISTRY.counter(
+    "api_rejected_requests_total", "Number of requests rejected because the worker pool is saturated", "endpoint")
+session_updates_total = REGISTRY.counter(
+    "match_session_updates_total", "Number of changed answers sent to the map matching WebSocket sessions")
+
+# seconds a session waits before it tries again to match, if the worker pool is saturated
+SESSION_RETRY_SECONDS = 0.2
+# metrics that the workers record while matching, they are sent to the main process with every answer
+WORKER_METRICS = [metric.name for metric in (STAGE_SECONDS, CANDIDATES_PER_POINT, TRANSITIONS_PER_REQUEST,
+                                             MATCH_TIER, DEGRADED_MATCHES)]
+
+
+def load_container(config: dict, city_config: dict, updates: dict) -> GTFSContainer:
+    return GTFSContainer(
+        path_gtfs="../" + city_config["path-to-GTFS"] + "/gtfs-out/",
+        path_saved_dictionaries=r"../saved_dictionaries/" + config["CITY"] + "/",
+        update_dicts=config["UPDATE_DICTS"], rt_dict=updates, verbose=config["DEBUG"],
+        shape_cache_size=config["SHAPE_CACHE_SIZE"], connections_cache_size=config["CONNECTIONS_CACHE_SIZE"])
+
+
+def new_candidate_cache(config: dict) -> CandidateCache:
+    return CandidateCache(
+        max_size=config["CANDIDATE_CACHE_SIZE"], quantized=config["CANDIDATE_CACHE_QUANTIZED"],
+        grid_size=config["CANDIDATE_CACHE_GRID_SIZE"], time_bucket=config["CANDIDATE_CACHE_TIME_BUCKET"])
+
+
+def fetch_gtfs_rt(config: dict, city_config: dict, container: GTFSContainer, on_update=None):
+    """
+    Updates the dict of the realtime data of the container periodically,
+    in every process that matches or answers requests
+    """
+    from FetchRealtimeUpdates import GTFSrtGetter
+
+    if "RT-API-key" in city_config:
+        api_key_name = city_config["RT-API-key"]
+        creds = get_credentials([api_key_name])[api_key_name]
+    else:
+        creds = None
+    gtfs_rt = GTFSrtGetter(config["CITY"], city_config["GTFS-RT-feed"], creds, debug_print=config["DEBUG"],
+                           on_update=on_update, gtfs_container=container, timezone=city_config["timezone"])
+    gtfs_rt.fetch_trip_updates_every_n_minutes(city_config["RT-UPDATE-PERIOD"])(container.gtfs_rt_dict)
+
+
+def init_worker(config: dict, city_config: dict):
+    """
+    Runs once in every worker process. Without fork, the worker loads the container itself.
+    """
+    global _container, _network
+
+    if _container is None:
+        _container = load_container(dict(config, UPDATE_DICTS=False), city_config, {})
+    candidate_cache = new_candidate_cache(config)
+    if config["USE_GTFS_RT"]:
+        # the threads of the main process are not forked, every worker fetches its own realtime data
+        fetch_gtfs_rt(config, city_config, _container, on_update=candidate_cache.invalidate)
+    _network = NetworkOfRoutes.from_config(_container, config, city_config["timezone"],
+                                           candidate_cache=candidate_cache)
+
+
+def match_in_worker(route: list, trip_id: str, deadline_ms) -> Tuple[dict, dict, int, dict]:
+    """
+    Returns: (answer of /map-match, metrics recorded since the last call, pid of the worker,
+        statistics of the candidate cache of the worker)
+    """
+    answer = _network.find_route_name(route, dist=0.1, trip_id=trip_id, deadline_ms=deadline_ms)
+    cache_stats = _network.candidate_cache.stats() if _network.candidate_cache is not None else {}
+    return answer, REGISTRY.drain(WORKER_METRICS), os.getpid(), cache_stats
+
+
+def warm_up_worker() -> int:
+    return os.getpid()
+
+
+def create_app(config: dict, city_config: dict, pool: ProcessPoolExecutor, num_workers: int,
+               chat: Chat, trace_recorder: TraceRecorder, raptor: Raptor = None) -> Starlette:
+    """
+    The app with the routes of API.py, /journeys answers 404 without raptor
+    """
+    timezone = city_config["timezone"]
+    max_pending = num_workers * config["ASYNC_MAX_PENDING_PER_WORKER"]
+    server_start_timestamp = datetime.now().timestamp()
+    state = {"pending": 0, "last_user_id": 0, "sessions": 0}
+    # {trip_id: asyncio.Event} of the /chat requests that wait for a new message,
+    # an entry is removed when no request waits for it anymore
+    chat_waiters = WeakValueDictionary()
+
+    REGISTRY.gauge("async_pending_matches", "Number of map matching requests in the worker pool",
+                   function=lambda: state["pending"])
+    REGISTRY.gauge("match_sessions", "Number of open map matching WebSocket sessions",
+                   function=lambda: state["sessions"])
+
+    # {pid of a worker: statistics of its candidate cache after its last answer}
+    worker_cache_stats = {}
+
+    def cache_stat(name: str) -> float:
+        return sum(stats.get(name, 0) for stats in worker_cache_stats.values())
+
+    def cache_hit_rate() -> float:
+        lookups = cache_stat("hits") + cache_stat("misses")
+        return cache_stat("hits") / lookups if lookups else 0.0
+
+    # the same metrics as in API.py, summed over the workers
+    REGISTRY.gauge("candidate_cache_hit_rate", "Hit rate of the candidate caches of the workers",
+                   function=cache_hit_rate)
+    REGISTRY.gauge("candidate_cache_size", "Number of gps points in the candidate caches of the workers",
+                   function=lambda: cache_stat("size"))
+    REGISTRY.gauge("candidate_cache_invalidations", "Number of times the candidate caches of the workers were cleared",
+                   function=lambda: cache_stat("invalidations"))
+
+    def worker_answer(result: Tuple[dict, dict, int, dict]) -> dict:
+        """
+        Records the metrics of a result of match_in_worker, returns the answer
+        """
+        answer, metrics, pid, cache_stats = result
+        REGISTRY.merge(metrics)
+        worker_cache_stats[pid] = cache_stats
+        return answer
+
+    def endpoint(path: str, query_parameters: bool = False):
+        """
+        Decorates a handler: async handler(request body, request) -> (answer, status, headers).
+        Parses the body (or the query parameters of a GET request if query_parameters),
+        serializes the answer (no body if the answer is None), records the metrics and the trace.
+        """
+        def decorator(handler):
+            async def wrapper(request: Request):
+                start = perf_counter()
+                if query_parameters and request.method == "GET" and request.query_params:
+                    req = dict(request.query_params)
+                else:
+                    try:
+                        req = await request.json()
+                    except (JSONDecodeError, UnicodeDecodeError):
+                        req = None
+
+                if req is None:
+                    answer, status, headers = {}, 400, None
+                else:
+                    answer, status, headers = await handler(req, request)
+
+                duration = perf_counter() - start
+                request_seconds.observe(duration, path)
+                requests_total.inc(label=path)
+                if trace_recorder.should_record():
+                    trace_recorder.record(path, req, status, duration, answer)
+                if answer is None:
+                    return Response(status_code=status, headers=headers)
+                return JSONResponse(answer, status_code=status, headers=headers)
+            return Route(path, wrapper, methods=["GET", "POST"])
+        return decorator
+
+    @endpoint("/map-match")
+    async def map_match(req: dict, _: Request):
+        parsed = parse_map_match_request(req, config["MATCH_MAX_DEADLINE_MS"])
+        if parsed is None or not parsed[0]:
+            return {}, 400, None
+        route, trip_id, deadline_ms = parsed
+
+        # backpressure: do not queue more requests than the workers can answer in time
+        if state["pending"] >= max_pending:
+            rejected_total.inc(label="/map-match")
+            return {}, 503, {"Retry-After": "1"}
+
+        state["pending"] += 1
+        try:
+            answer = worker_answer(await asyncio.get_running_loop().run_in_executor(
+                pool, match_in_worker, route, trip_id, deadline_ms))
+        finally:
+            state["pending"] -= 1
+        return answer, 200, None
+
+    async def match_session(websocket: WebSocket):
+        """
+        Streaming /map-match: the matcher runs in the worker pool whenever the client sent new GPS fixes,
+        while a match runs the new fixes are collected and matched together afterwards.
+        If the worker pool is saturated, the session waits instead of answering 503.
+        """
+        if state["sessions"] >= config["MATCH_SESSIONS_MAX"]:
+            # 1013: try again later
+            await websocket.close(code=1013)
+            return
+        await websocket.accept()
+        state["sessions"] += 1
+        session = MatchSession(config["MATCH_SESSION_MAX_POINTS"])
+        loop = asyncio.get_running_loop()
+
+        async def run_matches():
+            while session.dirty:
+                if state["pending"] >= max_pending:
+                    await asyncio.sleep(SESSION_RETRY_SECONDS)
+                    continue
+                session.dirty = False
+                state["pending"] += 1
+                start = perf_counter()
+                try:
+                    answer = session.update(worker_answer(await loop.run_in_executor(
+                        pool, match_in_worker, session.route, session.trip_id, session.deadline_ms)))
+                    if answer is not None:
+                        session_updates_total.inc()
+                except Exception:
+                    # the session stays open, the client gets the error and its next fixes are matched again
+                    print(f"map matching of a session failed:\n{format_exc()}", flush=True)
+                    answer = {"error": "map matching failed"}
+                finally:
+                    state["pending"] -= 1
+                request_seconds.observe(perf_counter() - start, "/map-match/ws")
+                requests_total.inc(label="/map-match/ws")
+                if answer is not None:
+                    try:
+                        await websocket.send_json(answer)
+                    except (WebSocketDisconnect, RuntimeError):
+                        # the client closed the session while the matcher was running
+                        return
+
+        matches = None
+        try:
+            while True:
+                try:
+                    parsed = parse_match_session_message(
+                        loads(await websocket.receive_text()), config["MATCH_MAX_DEADLINE_MS"])
+                except (JSONDecodeError, UnicodeDecodeError):
+                    parsed = None
+                if parsed is None:
+                    await websocket.send_json({"error": "invalid message"})
+                    continue
+
+                route, trip_id, session.deadline_ms = parsed
+                if trip_id is not None:
+                    session.trip_id = trip_id
+                if session.add_fixes(route) and (matches is None or matches.done()):
+                    matches = asyncio.create_task(run_matches())
+        except WebSocketDisconnect:
+            pass
+        finally:
+            state["sessions"] -= 1
+            if matches is not None:
+                matches.cancel()
+
+    @endpoint("/connections")
+    async def get_connections(req: dict, _: Request):
+        parsed = parse_connections_request(req, timezone)
+        if parsed is None:
+            return {}, 400, None
+        if parsed == "":
+            return {"length": 0}, 200, None
+
+        next_stop_name, user_time_datetime, trip_id = parsed
+        # the stop name of the frontend may differ slightly from the feed, e.g. in umlauts or the city
+        next_stop_name = await run_in_threadpool(_container.stop_search.resolve, next_stop_name)
+        if next_stop_name is None:
+            return {"length": 0}, 200, None
+        possibilities = await run_in_threadpool(
+            _container.find_transfer_possibilities, next_stop_name, user_time_datetime, trip_id)
+        return connections_to_dict(possibilities, next_stop_name), 200, None
+
+    @endpoint("/journeys")
+    async def get_journeys(req: dict, _: Request):
+        if raptor is None:
+            return {"error": "journeys are disabled"}, 404, None
+        parsed = parse_journeys_request(req, timezone, max_transfers=config["JOURNEYS_MAX_TRANSFERS"])
+        if parsed is None:
+            return {}, 400, None
+
+        from_stop_name, to_stop_name, user_time_datetime, max_transfers, max_minutes = parsed
+        # stop names that differ slightly from the feed, unknown stop names have no journeys
+        from_stop_name = _container.stop_search.resolve(from_stop_name) or from_stop_name
+        if to_stop_name is not None:
+            to_stop_name = _container.stop_search.resolve(to_stop_name) or to_stop_name
+        if to_stop_name is None:
+            stops = await run_in_threadpool(
+                raptor.reachable_stops, from_stop_name, user_time_datetime, max_minutes, max_transfers)
+            return {"stops": stops, "length": len(stops)}, 200, None
+        journeys = await run_in_threadpool(
+            raptor.earliest_arrival, from_stop_name, to_stop_name, user_time_datetime, max_transfers)
+        return {"journeys": journeys, "length": len(journeys)}, 200, None
+
+    @endpoint("/search-stops", query_parameters=True)
+    async def search_stops(req: dict, _: Request):
+        parsed = parse_stop_search_request(req)
+        if parsed is None:
+            return {}, 400, None
+        query, limit = parsed
+        return stops_to_dict(await run_in_threadpool(_container.search_stops, query, limit)), 200, None
+
+    @endpoint("/nearby-stops", query_parameters=True)
+    async def nearby_stops(req: dict, _: Request):
+        parsed = parse_nearby_stops_request(req)
+        if parsed is None:
+            return {}, 400, None
+        return nearby_stops_to_dict(_container.get_nearby_stops(*parsed)), 200, None
+
+    @endpoint("/shapes", query_parameters=True)
+    async def get_shape(req: dict, request: Request):
+        parsed = parse_shapes_request(req)
+        if parsed is None:
+            return {}, 400, None
+        shape_id, trip_id, zoom, tolerance, encoding, precision = parsed
+
+        headers = {"ETag": shape_etag(_container.version, *parsed),
+                   "Cache-Control": f"public, max-age={config['SHAPES_MAX_AGE']}"}
+        if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+            return None, 304, headers
+
+        polyline = await run_in_threadpool(
+            _container.get_simplified_shape_polyline, shape_id, zoom, tolerance)
+        stops = _container.get_trip_stop_positions(trip_id)
+        return shape_to_dict(polyline, stops, encoding, precision), 200, headers
+
+    @endpoint("/chat")
+    async def get_chat(req: dict, _: Request):
+        poll = parse_chat_poll(req, config["CHAT_MAX_WAIT_SECONDS"])
+        if poll is None:
+            return {}, 400, None
+        after_id, wait = poll
+
+        # same user ids as API.manage_user_ids, the event loop runs one handler at a time
+        user_id = int(req["user_id"])
+        if user_id == 0 or float(req["server_start_timestamp"]) < server_start_timestamp:
+            state["last_user_id"] += 1
+            user_id = state["last_user_id"]
+        trip_id = req['trip_id']
+
+        # save new message if a message has been sent
+        if not req['just_fetch'] and not user_id == 0:
+            chat.add_message(trip_id, ChatMessage(user_id, req['user_name'], req['message'], req['user_time']))
+            if trip_id in chat_waiters:
+                chat_waiters.pop(trip_id).set()
+
+        # long polling without a thread: wait on the event loop until a message of the trip is added
+        if wait and not chat.has_messages_after(trip_id, after_id):
+            new_message = chat_waiters.setdefault(trip_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(new_message.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+        return {'user_id': user_id, 'server_start_timestamp': server_start_timestamp,
+                'messages': chat.get_messages(trip_id, after_id)}, 200, None
+
+    async def get_metrics(_: Request):
+        return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+    async def get_memory_report(_: Request):
+        if not config["MEMORY_REPORT_ENDPOINT"]:
+            return JSONResponse({"error": "the memory report is disabled"}, status_code=404)
+        return JSONResponse(dict(await run_in_threadpool(container_memory_report, _container)))
+
+    routes = [map_match, get_connections, get_journeys, search_stops, nearby_stops, get_shape, get_chat,
+              WebSocketRoute("/map-match/ws", match_session),
+              Route("/metrics", get_metrics, methods=["GET"]),
+              Route("/debug/memory", get_memory_report, methods=["GET"])]
+    # like flask_cors.CORS(app)
+    return Starlette(routes=routes, middleware=[Middleware(CORSMiddleware, allow_origins=["*"],
+                                                           allow_methods=["*"], allow_headers=["*"])])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    config = get_config()
+    city_config = get_city_config(config["CITY"], gtfs_rt=config["USE_GTFS_RT"])
+    if config["UPDATE_GTFS"]:
+        print("UPDATE_GTFS is not supported by the async API, restart it to use new GTFS files", flush=True)
+    if config["UPDATE_GTFS_ON_STARTUP"]:
+        from ControlGTFSFiles import try_to_fetch_gtfs
+        try_to_fetch_gtfs(config["CITY"])
+
+    updates = {}
+    _container = load_container(config, city_config, updates)
+
+    # fork the workers before any thread is started, they share the container
+    num_workers = config["ASYNC_WORKERS"] or os.cpu_count()
+    start_method = "fork" if "fork" in get_all_start_methods() else "spawn"
+    worker_pool = ProcessPoolExecutor(max_workers=num_workers, mp_context=get_context(start_method),
+                                      initializer=init_worker, initargs=(config, city_config))
+    worker_pool.submit(warm_up_worker).result()
+    print(f"{num_workers} map matching workers started ({start_method})", flush=True)
+
+    if config["USE_GTFS_RT"]:
+        fetch_gtfs_rt(config, city_config, _container)
+
+    chat = Chat(_container, debug=config["DEBUG"], max_messages=config["CHAT_MAX_MESSAGES"],
+                max_message_length=config["CHAT_MAX_MESSAGE_LENGTH"])
+    chat.remove_inactive_trips_every_hour()
+    trace_recorder = TraceRecorder(
+        config["TRACE_DIRECTORY"], sample_rate=config["TRACE_SAMPLE_RATE"],
+        max_bytes=config["TRACE_MAX_MEGABYTES"] * 1024 ** 2, max_files=config["TRACE_MAX_FILES"])
+
+    raptor = Raptor(_container, city_config["timezone"], config["JOURNEYS_TRANSFER_SECONDS"]) \
+        if config["JOURNEYS"] else None
+
+    app = create_app(config, city_config, worker_pool, num_workers, chat, trace_recorder, raptor)
+    print("Server is now online. You can now connect with the frontend.", flush=True)
+    try:
+        uvicorn.run(app, host="0.0.0.0", port=config["SERVER_PORT"], log_level="warning")
+    finally:
+        SCHEDULER.shutdown()
+        worker_pool.shutdown()
@@ -0,0 +1,196 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+One scheduler for the periodic background work of the API: fetching the GTFS-RT feed, removing inactive chats
+and fetching new GTFS files. A single thread waits for the next due job and hands it to a small pool of threads,
+instead of starting a new timer thread for every run.
+A job is skipped if its previous run is still running. The runtimes, runs, skipped runs and failures of every job
+are recorded in the metrics, so /metrics shows when background work competes with the requests.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from random import uniform
+from threading import Condition, Thread
+from time import monotonic, perf_counter
+from traceback import format_exc
+from typing import Callable, Union
+
+from Metrics import REGISTRY, DEFAULT_BUCKETS
+
+# number of jobs that can run at the same time, e.g. a GTFS update does not delay the realtime updates
+BACKGROUND_WORKERS = 4
+# a GTFS update takes minutes
+JOB_BUCKETS = DEFAULT_BUCKETS + (30, 60, 300, 900, 3600)
+
+job_seconds = REGISTRY.histogram("background_job_seconds", "Runtime of the background jobs in seconds", "job",
+                                 buckets=JOB_BUCKETS)
+job_runs_total = REGISTRY.counter("background_job_runs_total", "Number of runs of each background job", "job")
+job_skipped_total = REGISTRY.counter(
+    "background_job_skipped_total", "Number of runs skipped because the previous run was still running", "job")
+job_failures_total = REGISTRY.counter(
+    "background_job_failures_total", "Number of runs of each background job that raised an exception", "job")
+job_running = REGISTRY.gauge("background_job_running", "1 while the background job runs", "job")
+
+
+def seconds_until(time_of_day: str, days: int = 1, now: datetime = None) -> float:
+    """
+    Seconds until the time of day ("HH:MM:SS", local time), at least days - 1 days from now,
+    i.e. the next run of a job that runs every days days at the time of day
+
+    >>> seconds_until("05:00:00", now=datetime(2022, 9, 15, 4, 0))
+    3600.0
+    >>> seconds_until("05:00:00", now=datetime(2022, 9, 15, 6, 0)) / 3600
+    23.0
+    >>> seconds_until("05:00:00", days=7, now=datetime(2022, 9, 15, 6, 0)) / 3600 / 24
+    6.958333333333333
+    """
+    now = now or datetime.now()
+    start = now + timedelta(days=days - 1)
+    target = datetime.combine(start.date(), time.fromisoformat(time_of_day))
+    if target <= start:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+class Job:
+    """
+    interval: seconds between the runs, or a function that returns the seconds until the next run
+    jitter: each delay is randomly longer or shorter by up to this fraction of the interval,
+        so that the jobs of multiple processes (e.g. the workers of AsyncAPI.py) do not run at the same time
+    """
+
+    __slots__ = ["name", "function", "interval", "jitter", "next_run", "running"]
+
+    def __init__(self, name: str, function: Callable, interval: Union[float, Callable[[], float]], jitter: float,
+                 next_run: float):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.jitter = jitter
+        # monotonic time of the next run
+        self.next_run = next_run
+        self.running = False
+
+    def delay(self) -> float:
+        """
+        >>> Job("job", print, 60, 0, 0).delay(), 54 <= Job("job", print, 60, 0.1, 0).delay() <= 66
+        (60, True)
+        """
+        interval = self.interval() if callable(self.interval) else self.interval
+        return interval + uniform(-self.jitter, self.jitter) * interval if self.jitter else interval
+
+
+class BackgroundScheduler:
+    """
+    Runs periodic jobs in a pool of BACKGROUND_WORKERS threads. Starts its thread with the first job.
+
+    >>> from threading import Event
+    >>> scheduler = BackgroundScheduler()
+    >>> done = Event()
+    >>> _ = scheduler.add_job("doctest", done.set, interval=60)
+    >>> done.wait(5)
+    True
+    >>> scheduler.shutdown()
+    >>> job_runs_total.get("doctest")
+    1
+    """
+
+    def __init__(self, workers: int = BACKGROUND_WORKERS):
+        self.workers = workers
+        self._pid = None
+        self._reset()
+
+    def _reset(self):
+        """
+        A forked process (e.g. a worker of AsyncAPI.py) has a copy of the scheduler but not its threads,
+        it starts its own scheduler without the jobs of the parent.
+        """
+        self._pid = os.getpid()
+        self._jobs = {}
+        self._condition = Condition()
+        self._stopped = False
+        self._thread = None
+        self._executor = None
+
+    def add_job(self, name: str, function: Callable, interval: Union[float, Callable[[], float]],
+                first_delay: float = 0.0, jitter: float = 0.0) -> Job:
+        """
+        Runs function() every interval seconds, the first time after first_delay seconds.
+        A job with the same name is replaced.
+        Input:
+            interval: seconds, or a function that returns the seconds until the next run (e.g. seconds_until)
+            jitter: fraction of the interval, see Job
+        """
+        if self._pid != os.getpid():
+            self._reset()
+        with self._condition:
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="background-job")
+                self._thread = Thread(target=self._run, name="background-scheduler", daemon=True)
+                self._thread.start()
+            job = Job(name, function, interval, jitter, monotonic() + first_delay)
+            self._jobs[name] = job
+            self._condition.notify()
+        return job
+
+    def remove_job(self, name: str):
+        """
+        The job is not run again, a running run is not interrupted
+        """
+        with self._condition:
+            self._jobs.pop(name, None)
+
+    def _run(self):
+        """
+        The thread of the scheduler: submits the due jobs and waits until the next one is due
+        """
+        with self._condition:
+            while not self._stopped:
+                now = monotonic()
+                for job in self._jobs.values():
+                    if job.next_run > now:
+                        continue
+                    job.next_run = now + job.delay()
+                    if job.running:
+                        job_skipped_total.inc(label=job.name)
+                        continue
+                    job.running = True
+                    self._executor.submit(self._execute, job)
+                next_run = min((job.next_run for job in self._jobs.values()), default=None)
+                self._condition.wait(None if next_run is None else max(0.0, next_run - monotonic()))
+
+    def _execute(self, job: Job):
+        """
+        Runs a job in a thread of the pool, an exception is printed and the job runs again at its next time
+        """
+        job_running.set(1, job.name)
+        start = perf_counter()
+        try:
+            job.function()
+        except Exception:
+            job_failures_total.inc(label=job.name)
+            print(f"background job {job.name} failed:\n{format_exc()}", flush=True)
+        finally:
+            job_seconds.observe(perf_counter() - start, job.name)
+            job_runs_total.inc(label=job.name)
+            job_running.set(0, job.name)
+            with self._condition:
+                job.running = False
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops the scheduler, no job is started anymore. If wait, waits until the running jobs are finished.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._reset()
+
+
+# scheduler of the running process, like Metrics.REGISTRY
+SCHEDULER = BackgroundScheduler()
@@ -0,0 +1,492 @@
+# Benchmark the hot paths of the map matcher and the GTFS container
+# runs offline on saved dictionaries, e.g. of the doctest feed or of a generated feed
+#
+# run:      python Benchmark.py run --saved ../../saved_dictionaries/Doctests --output doctest.json
+# generated feed, parsed with parseGTFS first:
+#           python Benchmark.py run --generate city --gtfs ../../GTFS/Synthetic/city \
+#               --saved ../../saved_dictionaries/Synthetic_city --output city.json
+# memory:   python Benchmark.py memory --presets town city region --output memory.json
+# peak memory while loading generated feeds of increasing size
+# compare:  python Benchmark.py compare old.json new.json
+# compare exits with 1 if a hot path got slower (or a load needs more memory) by more than REGRESSION_THRESHOLD
+import json
+import resource
+import subprocess as sp
+import tracemalloc
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from multiprocessing import Pool
+from datetime import datetime, timedelta
+from platform import python_version
+from random import Random
+from statistics import median, mean
+from time import perf_counter
+
+import sys
+import os.path
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+from google.transit import gtfs_realtime_pb2
+from shapely.geometry import Point
+import LoadJson
+from GTFSContainer import GTFSContainer
+from MapMatcher import NetworkOfRoutes
+from Raptor import Raptor
+from StopSearch import StopSearchIndex
+from FetchRealtimeUpdates import trip_delays_from_feed
+from Utilities import convert_local_time_to_utc, get_rt_offset
+from MemoryReport import container_memory_report
+from GenerateGTFS import generate_preset, PRESETS
+
+# default parameters can be changed here
+REPEAT = 5
+NUM_ROUTES = 20
+POINTS_PER_ROUTE = 6
+CANDIDATES_PER_POINT = 3
+DIST = 0.1
+SEED = 42
+TIMEZONE = "Europe/Berlin"
+PARSE_GTFS = "../parseGTFS/parseGTFSMain"
+# a result is flagged, if its time per call is more than 20% slower
+REGRESSION_THRESHOLD = 0.2
+# differences below 10 microseconds per call are noise
+NOISE_FLOOR = 0.00001
+
+
+def time_function(function, repeat=REPEAT, calls=1, setup=None) -> dict:
+    """
+    Runs function repeat times, calls is the number of calls to the hot path that one run does.
+    setup runs before every run and is not timed, e.g. to clear a cache, so that every run measures the same work.
+    Returns the statistics in seconds per run and the time per call of the fastest run, as timeit does.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start_time = perf_counter()
+        function()
+        times.append(perf_counter() - start_time)
+
+    return {"repeat": repeat, "calls": calls, "min": min(times), "median": median(times), "mean": mean(times),
+            "max": max(times), "per_call": min(times) / max(1, calls)}
+
+
+def bench_container_load(path_saved, repeat=REPEAT) -> dict:
+    """
+    Times the loading of every saved dictionary, in the same order as GTFSContainer._load_dictionaries
+    """
+    if path_saved[-1] != "/":
+        path_saved += "/"
+
+    results = {}
+    loaded = {}
+
+    def load(name, function, *args):
+        results["load_" + name] = time_function(lambda: loaded.__setitem__(name, function(*args)), repeat)
+
+    load("service_id_to_service_information", LoadJson.generate_service_id_to_service_information,
+         path_saved + "service_id_to_service_information.json")
+    load("trip_id_to_route_id_and_list_of_stop_times_and_stop_id",
+         LoadJson.generate_trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict,
+         path_saved + "trip_id_to_route_id_and_list_of_stop_times_and_stop_id.json")
+    load("trips_with_stops_and_times", LoadJson.generate_trip_id_to_trips_with_stops_dict,
+         path_saved + "trips_with_stops_and_times.json",
+         loaded["trip_id_to_route_id_and_list_of_stop_times_and_stop_id"], loaded["service_id_to_service_information"])
+    load("edges_for_graph", LoadJson.generate_graph_and_geo_index, path_saved + "edges_for_graph.json")
+    load("map_hash_to_edge_id_to_trip_segment_id", LoadJson.generate_hash_to_edge_id_to_trip_segment_id_dict_dict,
+         path_saved + "map_hash_to_edge_id_to_trip_segment_id.json")
+    load("route_id_to_route_information", LoadJson.generate_route_id_to_route_information_dict,
+         path_saved + "route_id_to_route_information.json")
+    load("shape_id_to_trip_service_route_ids", LoadJson.generate_shape_id_to_trip_service_route_ids_dict,
+         path_saved + "shape_id_to_trip_service_route_ids.json")
+    load("stop_id_to_stop_information", LoadJson.generate_stop_id_to_stop_information_dict,
+         path_saved + "stop_id_to_stop_information.json")
+    load("stop_id_to_trips_with_departure_time", LoadJson.generate_stop_id_to_trips_with_departure_time_dict,
+         path_saved + "stop_id_to_trips_with_departure_time.json")
+    load("stop_name_to_list_of_stop_ids", LoadJson.generate_stop_name_to_list_of_stop_ids_dict,
+         path_saved + "stop_name_to_list_of_stop_ids.json")
+
+    return results
+
+
+def get_service_date(container: GTFSContainer, trip_id: str):
+    """
+    First date of the service of the trip, where the trip is active
+    """
+    service_id = container.trip_id_to_trip_with_stops_dict[trip_id].service_id
+    active_weekdays, start_date, end_date, extra_dates, removed_dates = \
+        container.service_id_to_service_information_dict[service_id]
+    date = start_date
+    while date <= end_date:
+        if date.weekday() in active_weekdays and date not in removed_dates:
+            return date
+        date += timedelta(days=1)
+    return min(extra_dates) if extra_dates else None
+
+
+def gen_test_routes(container: GTFSContainer, num_routes=NUM_ROUTES, points=POINTS_PER_ROUTE, seed=SEED,
+                    timezone=TIMEZONE) -> list:
+    """
+    Generates gps points without noise between consecutive stops of random trips,
+    at the time the vehicle passes according to the schedule.
+    Returns [(trip_id, local datetime of the last point, [(lat, lon, utc timestamp)])]
+    """
+    rnd = Random(seed)
+    trip_ids = sorted(container.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict)
+    rnd.shuffle(trip_ids)
+
+    routes = []
+    for trip_id in trip_ids:
+        if len(routes) >= num_routes:
+            break
+        _, stop_times = container.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id]
+        date = get_service_date(container, trip_id)
+        if date is None or len(stop_times) < 2:
+            continue
+
+        route, local_time = [], None
+        start = rnd.randrange(max(1, len(stop_times) - points))
+        for i in range(start, min(start + points, len(stop_times) - 1)):
+            _, (departure, departure_overtime), stop_id = stop_times[i]
+            (arrival, arrival_overtime), _, next_stop_id = stop_times[i + 1]
+            _, lat, lon = container.stop_id_to_stop_information_dict[stop_id]
+            _, next_lat, next_lon = container.stop_id_to_stop_information_dict[next_stop_id]
+
+            # halfway between the stops
+            departure_time = datetime.combine(date, departure.time()) + timedelta(days=int(departure_overtime))
+            arrival_time = datetime.combine(date, arrival.time()) + timedelta(days=int(arrival_overtime))
+            local_time = departure_time + (arrival_time - departure_time) / 2
+            route.append(((lat + next_lat) / 2, (lon + next_lon) / 2,
+                          int(convert_local_time_to_utc(local_time, timezone).timestamp())))
+
+        if route:
+            routes.append((trip_id, local_time, route))
+
+    return routes
+
+
+def bench_matcher(container: GTFSContainer, routes: list, repeat=REPEAT, timezone=TIMEZONE) -> dict:
+    """
+    Times the hot paths of the map matcher and the container on the given test routes.
+    The candidate cache is disabled, so every call does the full work.
+    """
+    network = NetworkOfRoutes(container, timezone=timezone)
+    points = [point for _, _, route in routes for point in route]
+    results = {}
+
+    results["query_near_edges"] = time_function(
+        lambda: [network.query_near_edges(Point(lat, lon), DIST) for lat, lon, _ in points], repeat, len(points))
+    results["get_close_edges"] = time_function(
+        lambda: [network.get_close_edges(lat, lon, tim, DIST) for lat, lon, tim in points], repeat, len(points))
+
+    # transitions between the closest candidates of consecutive points
+    transitions = []
+    for _, _, route in routes:
+        last_nodes = []
+        for coord in route:
+            nodes = [NetworkOfRoutes.StateNode(coord, idx, length, start, end, edge_data)
+                     for idx, length, start, end, edge_data, _ in
+                     network.get_close_edges(*coord, DIST)[:CANDIDATES_PER_POINT]]
+            transitions.extend((start_node, end_node) for start_node in last_nodes for end_node in nodes)
+            last_nodes = nodes
+    results["edge_likelihood"] = time_function(
+        lambda: [network.edge_likelihood(start, end, {"distance": 0}) for start, end in transitions],
+        repeat, len(transitions))
+
+    results["calculate_path"] = time_function(
+        lambda: [network.calculate_path(route, DIST) for _, _, route in routes], repeat, len(routes))
+
+    paths = [path for path in (network.calculate_path(route, DIST) for _, _, route in routes) if path]
+    results["get_most_likely_shape"] = time_function(
+        lambda: [network.get_most_likely_shape(path) for path in paths], repeat, len(paths))
+
+    results["find_route_name"] = time_function(
+        lambda: [network.find_route_name(route, dist=DIST) for _, _, route in routes], repeat, len(routes))
+
+    # next stop of every test route, at the time of its last point
+    transfers = []
+    for trip_id, local_time, _ in routes:
+        _, stop_times = container.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id]
+        stop_name = container.stop_id_to_stop_information_dict[stop_times[-1][2]][0]
+        transfers.append((stop_name, local_time, trip_id))
+    # without the cached departures, otherwise every run after the first one only measures cache hits
+    results["find_transfer_possibilities"] = time_function(
+        lambda: [container.find_transfer_possibilities(*transfer) for transfer in transfers], repeat, len(transfers),
+        setup=container.connections_cache.clear)
+
+    # the first half of the next stop names as autocomplete query, lower case and with a typo to resolve
+    stop_names = [stop_name for stop_name, _, _ in transfers]
+    results["stop_search_build"] = time_function(
+        lambda: StopSearchIndex(container.stop_name_to_list_of_stop_ids_dict), repeat, 1)
+    results["autocomplete"] = time_function(
+        lambda: [container.stop_search.autocomplete(name[:len(name) // 2]) for name in stop_names],
+        repeat, len(stop_names))
+    results["resolve_stop_name"] = time_function(
+        lambda: [container.stop_search.resolve(name.lower()[:-2] + name[-1]) for name in stop_names],
+        repeat, len(stop_names))
+
+    results["raptor_build"] = time_function(lambda: Raptor(container, timezone), repeat, 1)
+    raptor = Raptor(container, timezone)
+    # from the first stop of every test trip to its next stop, departing an hour before
+    journeys = []
+    for stop_name, local_time, trip_id in transfers:
+        _, stop_times = container.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id]
+        first_stop_name = container.stop_id_to_stop_information_dict[stop_times[0][2]][0]
+        journeys.append((first_stop_name, stop_name, local_time - timedelta(hours=1)))
+    results["earliest_arrival"] = time_function(
+        lambda: [raptor.earliest_arrival(*journey) for journey in journeys], repeat, len(journeys))
+
+    def clear_shape_caches():
+        container.shape_polyline_cache.clear()
+        container.trip_stops_cache.clear()
+        container.simplified_shape_cache.clear()
+
+    # like the connections, the shapes are built again in every run instead of read from the caches
+    shapes = [network.get_most_likely_shape(path)[:3:2] for path in paths]
+    results["get_shape_polyline_and_stops"] = time_function(
+        lambda: [container.get_shape_polyline_and_stops(shape_id, trip_id) for shape_id, trip_id in shapes],
+        repeat, len(shapes), setup=clear_shape_caches)
+    results["get_simplified_shape_polyline"] = time_function(
+        lambda: [container.get_simplified_shape_polyline(shape_id, zoom=12) for shape_id, _ in shapes],
+        repeat, len(shapes), setup=clear_shape_caches)
+
+    return results
+
+
+def gen_test_feed(container: GTFSContainer, seed=SEED, timezone=TIMEZONE) -> bytes:
+    """
+    GTFS-RT feed with a trip update for every trip: a delay at a random stop and a predicted time at a later stop.
+    Returns the serialized FeedMessage
+    """
+    rnd = Random(seed)
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    for trip_id in sorted(container.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict):
+        _, stop_times = container.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id]
+        date = get_service_date(container, trip_id)
+        if date is None or len(stop_times) < 2:
+            continue
+        trip_update = feed.entity.add(id=trip_id).trip_update
+        trip_update.trip.trip_id = trip_id
+        trip_update.trip.start_date = date.strftime("%Y%m%d")
+        first = rnd.randrange(len(stop_times) - 1)
+        update = trip_update.stop_time_update.add(stop_sequence=first + 1)
+        update.departure.delay = rnd.randrange(-60, 600)
+        (arrival, arrival_overtime), _, _ = stop_times[first + 1]
+        predicted = datetime.combine(date, arrival.time()) + timedelta(days=int(arrival_overtime),
+                                                                       seconds=rnd.randrange(0, 900))
+        update = trip_update.stop_time_update.add(stop_sequence=first + 2)
+        update.arrival.time = int(convert_local_time_to_utc(predicted, timezone).timestamp())
+    return feed.SerializeToString()
+
+
+def bench_realtime(container: GTFSContainer, repeat=REPEAT, timezone=TIMEZONE) -> dict:
+    """
+    Times the ingestion of a GTFS-RT feed with an update for every trip and the delay lookups of the matcher
+    """
+    content = gen_test_feed(container, timezone=timezone)
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(content)
+
+    def stop_times(trip_id):
+        return container.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id][1]
+
+    def ingest():
+        parsed = gtfs_realtime_pb2.FeedMessage()
+        parsed.ParseFromString(content)
+        return trip_delays_from_feed(parsed, stop_times, timezone)
+
+    results = {"gtfs_rt_ingest": time_function(ingest, repeat, max(1, len(feed.entity)))}
+    trip_delays = ingest()
+    lookups = [(delays, trip_segment_id) for delays in trip_delays.values() for trip_segment_id in range(len(delays))]
+    results["get_rt_offset"] = time_function(
+        lambda: [get_rt_offset(delays, trip_segment_id) for delays, trip_segment_id in lookups],
+        repeat, max(1, len(lookups)))
+    return results
+
+
+def bench_parse_gtfs(path_gtfs, path_saved, parse_gtfs=PARSE_GTFS) -> dict:
+    """
+    Parses the GTFS files with the c++ program once and times it
+    """
+    if not os.path.isfile(parse_gtfs):
+        raise FileNotFoundError(f"{parse_gtfs} not found, compile it with 'make install' in Code/parseGTFS")
+    os.makedirs(path_saved, exist_ok=True)
+    return time_function(lambda: sp.run([parse_gtfs, os.path.join(path_gtfs, ""), "-o", os.path.join(path_saved, "")],
+                                        check=True, stdout=sp.DEVNULL), repeat=1)
+
+
+def get_commit() -> str:
+    try:
+        return sp.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                      cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run_benchmark(path_gtfs, path_saved, output, name="", parse=False, repeat=REPEAT,
+                  num_routes=NUM_ROUTES, timezone=TIMEZONE, parse_gtfs=PARSE_GTFS) -> dict:
+    """
+    Runs every benchmark and writes the results to output as JSON.
+    If parse, the GTFS files are parsed with parseGTFS first.
+    """
+    results = {}
+    if parse:
+        results["parse_gtfs"] = bench_parse_gtfs(path_gtfs, path_saved, parse_gtfs)
+
+    # LoadJson prints its progress
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        results.update(bench_container_load(path_saved, repeat))
+
+    container = GTFSContainer(path_gtfs=path_gtfs, path_saved_dictionaries=path_saved, verbose=False)
+    routes = gen_test_routes(container, num_routes, timezone=timezone)
+    results.update(bench_matcher(container, routes, repeat, timezone))
+    results.update(bench_realtime(container, repeat, timezone))
+
+    benchmark = {
+        "meta": {"name": name or path_saved, "commit": get_commit(), "python": python_version(),
+                 "date": datetime.now().isoformat(), "repeat": repeat, "num_routes": len(routes),
+                 "num_trips": len(container.trip_id_to_trip_with_stops_dict),
+                 "num_edges": container.GTFSGraph.number_of_edges()},
+        "results": results
+    }
+    with open(output, "w") as f:
+        json.dump(benchmark, f, indent=2)
+
+    for bench_name, stats in results.items():
+        print(f"{bench_name:60} {stats['per_call'] * 1000:10.4f} ms per call", flush=True)
+    return benchmark
+
+
+def measure_load_memory(path_gtfs, path_saved) -> dict:
+    """
+    Loads the container with tracemalloc. Run it in a new process, so the peaks of earlier loads do not count.
+    tracemalloc only sees allocations of python objects, the coordinates of the shapely geometries are missing,
+    max_rss contains them.
+    """
+    tracemalloc.start()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        container = GTFSContainer(path_gtfs=path_gtfs, path_saved_dictionaries=path_saved, verbose=False)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"peak_bytes": peak, "loaded_bytes": current,
+            # kilobytes on linux
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "num_trips": len(container.trip_id_to_trip_with_stops_dict),
+            "num_edges": container.GTFSGraph.number_of_edges(),
+            "structures": dict(container_memory_report(container))}
+
+
+def run_memory_benchmark(directory, output, presets=("town", "city"), seed=1, parse_gtfs=PARSE_GTFS) -> dict:
+    """
+    Generates a feed for every preset, parses it and measures the memory needed to load it.
+    The feeds are written to directory/<preset>, the saved dictionaries to directory/<preset>_saved_dictionaries
+    """
+    results = {}
+    for preset in presets:
+        path_gtfs = os.path.join(directory, preset)
+        path_saved = os.path.join(directory, preset + "_saved_dictionaries")
+        generate_preset(path_gtfs, preset, seed)
+        bench_parse_gtfs(path_gtfs, path_saved, parse_gtfs)
+
+        with Pool(1) as pool:
+            results[preset] = pool.apply(measure_load_memory, (path_gtfs, path_saved))
+
+        stats = results[preset]
+        print(f"{preset:10} {stats['num_trips']:10} trips {stats['peak_bytes'] / 1024 ** 2:10.2f} MB peak "
+              f"{stats['loaded_bytes'] / 1024 ** 2:10.2f} MB loaded "
+              f"{stats['structures']['total'] / 1024 ** 2:10.2f} MB structures "
+              f"{stats['max_rss_bytes'] / 1024 ** 2:10.2f} MB max rss", flush=True)
+
+    benchmark = {
+        "meta": {"name": "memory", "commit": get_commit(), "python": python_version(),
+                 "date": datetime.now().isoformat(), "seed": seed},
+        "results": results
+    }
+    with open(output, "w") as f:
+        json.dump(benchmark, f, indent=2)
+    return benchmark
+
+
+def get_compared_value(stats: dict) -> float:
+    """
+    Time per call of the run benchmark, peak bytes of the memory benchmark
+    """
+    return stats["per_call"] if "per_call" in stats else stats["peak_bytes"]
+
+
+def compare(old_file, new_file, threshold=REGRESSION_THRESHOLD) -> list:
+    """
+    Compares the time per call (or the peak memory) of two benchmark results.
+    Returns the names of the regressions, i.e. hot paths that are more than threshold slower.
+    """
+    with open(old_file, "r") as f:
+        old = json.load(f)
+    with open(new_file, "r") as f:
+        new = json.load(f)
+
+    print(f"old: {old['meta'].get('commit', '')} {old['meta']['name']}, "
+          f"new: {new['meta'].get('commit', '')} {new['meta']['name']}")
+
+    regressions = []
+    for bench_name, new_stats in new["results"].items():
+        if bench_name not in old["results"]:
+            continue
+        old_value, new_value = get_compared_value(old["results"][bench_name]), get_compared_value(new_stats)
+        ratio = new_value / old_value if old_value else float("inf")
+        flag = ""
+        noise_floor = NOISE_FLOOR if "per_call" in new_stats else 0
+        if new_value > old_value * (1 + threshold) and new_value - old_value > noise_floor:
+            regressions.append(bench_name)
+            flag = "REGRESSION"
+        if "per_call" in new_stats:
+            print(f"{bench_name:60} {old_value * 1000:10.4f} ms {new_value * 1000:10.4f} ms {ratio:6.2f}x {flag}")
+        else:
+            print(f"{bench_name:60} {old_value / 1024 ** 2:10.2f} MB {new_value / 1024 ** 2:10.2f} MB "
+                  f"{ratio:6.2f}x {flag}")
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Benchmark the hot paths of the map matcher and the GTFS container")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("--gtfs", default="../../GTFS/doctest_files", help="GTFS directory")
+    run_parser.add_argument("--saved", default="../../saved_dictionaries/Doctests", help="saved dictionaries")
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--name", default="")
+    run_parser.add_argument("--parse", action="store_true", help="parse the GTFS files with parseGTFS first")
+    run_parser.add_argument("--parse-gtfs", default=PARSE_GTFS, help="compiled parseGTFS")
+    run_parser.add_argument("--generate", choices=sorted(PRESETS),
+                            help="generate a synthetic feed of this size to --gtfs first, implies --parse")
+    run_parser.add_argument("--seed", type=int, default=1, help="seed of the generated feed")
+    run_parser.add_argument("--repeat", type=int, default=REPEAT)
+    run_parser.add_argument("--routes", type=int, default=NUM_ROUTES)
+    run_parser.add_argument("--timezone", default=TIMEZONE)
+
+    memory_parser = subparsers.add_parser("memory")
+    memory_parser.add_argument("--presets", nargs="+", default=["town", "city"], choices=sorted(PRESETS))
+    memory_parser.add_argument("--directory", default="../../GTFS/Synthetic", help="where the feeds are generated")
+    memory_parser.add_argument("--output", default="memory.json")
+    memory_parser.add_argument("--seed", type=int, default=1)
+    memory_parser.add_argument("--parse-gtfs", default=PARSE_GTFS, help="compiled parseGTFS")
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+
+    args = parser.parse_args()
+    if args.mode == "run":
+        if args.generate:
+            generate_preset(args.gtfs, args.generate, args.seed)
+        run_benchmark(args.gtfs, args.saved, args.output, args.name or args.generate or "",
+                      args.parse or bool(args.generate), args.repeat, args.routes, args.timezone, args.parse_gtfs)
+    elif args.mode == "memory":
+        run_memory_benchmark(args.directory, args.output, args.presets, args.seed, args.parse_gtfs)
+    elif compare(args.old, args.new, args.threshold):
+        sys.exit(1)
@@ -0,0 +1,245 @@
+# Generate synthetic GTFS feeds for scaling experiments
+# the feeds are seeded and deterministic, so benchmarks on them can be reproduced without network access
+#
+# python GenerateGTFS.py --preset town --output ../../GTFS/Synthetic/town
+# the output can be parsed with parseGTFS and loaded with the GTFSContainer like any downloaded feed
+import csv
+from argparse import ArgumentParser
+from math import cos, radians, sqrt, ceil
+from os import makedirs
+from os.path import join
+from random import Random
+
+# the sizes range from a small town to a country
+PRESETS = {
+    "town": {"lines": 10, "stops_per_line": 15, "trips_per_day": 40, "corridors": 2},
+    "city": {"lines": 60, "stops_per_line": 25, "trips_per_day": 80, "corridors": 10},
+    "region": {"lines": 300, "stops_per_line": 30, "trips_per_day": 50, "corridors": 40},
+    "country": {"lines": 2000, "stops_per_line": 30, "trips_per_day": 30, "corridors": 200},
+}
+
+# center of the generated network, Freiburg
+CENTER = (47.995, 7.85)
+# distance between two shape points in meters
+SHAPE_POINT_DISTANCE = 100
+# a town with 10 lines covers ~ 8 km x 8 km, the area grows with the number of lines
+EXTENT_PER_SQRT_LINE = 2500
+SPEED = {0: 7, 2: 20, 3: 8}  # m/s of tram, rail and bus
+DWELL_TIME = 30
+DAY_START = 5 * 3600
+DAY_END = 23 * 3600 + 30 * 60
+# night trips start between 23:30 and 03:00, i.e. with times after 24:00:00
+NIGHT_START = 23 * 3600 + 30 * 60
+NIGHT_END = 27 * 3600
+START_DATE = "20220101"
+END_DATE = "20301231"
+# Christmas has the weekend schedule
+HOLIDAYS = ["20221226", "20231225", "20231226", "20241225", "20241226"]
+
+
+def meters_to_degrees(meters_lat: float, meters_lon: float, lat: float) -> (float, float):
+    # 0.00001° ~ 1.112m
+    return meters_lat / 1.112 * 0.00001, meters_lon / 1.112 * 0.00001 / cos(radians(lat))
+
+
+def distance_in_meters(point1, point2) -> float:
+    d_lat = (point1[0] - point2[0]) * 111200
+    d_lon = (point1[1] - point2[1]) * 111200 * cos(radians(point1[0]))
+    return sqrt(d_lat ** 2 + d_lon ** 2)
+
+
+def interpolate(start, end, rnd: Random, jitter=True) -> list:
+    """
+    Points every SHAPE_POINT_DISTANCE meters from start (exclusive) to end (inclusive)
+    """
+    num = max(1, ceil(distance_in_meters(start, end) / SHAPE_POINT_DISTANCE))
+    points = []
+    for i in range(1, num + 1):
+        lat = start[0] + (end[0] - start[0]) * i / num
+        lon = start[1] + (end[1] - start[1]) * i / num
+        if jitter and i < num:
+            lat += rnd.uniform(-0.00005, 0.00005)
+            lon += rnd.uniform(-0.00005, 0.00005)
+        points.append((round(lat, 7), round(lon, 7)))
+    return points
+
+
+def random_point(rnd: Random, extent: float) -> (float, float):
+    d_lat, d_lon = meters_to_degrees(rnd.uniform(-extent / 2, extent / 2), rnd.uniform(-extent / 2, extent / 2),
+                                     CENTER[0])
+    return round(CENTER[0] + d_lat, 7), round(CENTER[1] + d_lon, 7)
+
+
+def gtfs_time(seconds: int) -> str:
+    """
+    >>> gtfs_time(3600 * 25 + 61)
+    '25:01:01'
+    """
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def write_file(path, name, header, rows):
+    with open(join(path, name), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def generate_gtfs(path, lines=10, stops_per_line=15, trips_per_day=40, corridors=2, corridor_share=0.5,
+                  night_share=0.2, seed=1) -> dict:
+    """
+    Writes a GTFS feed to path.
+
+    Input:
+        lines: number of lines, each line has a shape and trips in both directions
+        stops_per_line: number of stops of each line
+        trips_per_day: number of trips per direction on weekdays, half of them on weekends
+        corridors: number of corridors, lines on a corridor share shape points and stops
+        corridor_share: share of the lines that use a corridor
+        night_share: share of the lines with night trips on friday and saturday, their times are after 24:00:00
+        seed: same seed and parameters generate the same feed
+
+    Returns the number of rows of each file.
+
+    >>> from tempfile import TemporaryDirectory
+    >>> with TemporaryDirectory() as tmp_dir:
+    ...     counts = generate_gtfs(tmp_dir, lines=3, stops_per_line=4, trips_per_day=2, corridors=1, seed=3)
+    ...     with open(join(tmp_dir, "stop_times.txt")) as f:
+    ...         stop_times = f.read()
+    ...     counts_again = generate_gtfs(tmp_dir, lines=3, stops_per_line=4, trips_per_day=2, corridors=1, seed=3)
+    ...     with open(join(tmp_dir, "stop_times.txt")) as f:
+    ...         stop_times == f.read()
+    True
+    >>> counts == counts_again, counts["routes.txt"], counts["trips.txt"] >= 3 * 2 * 3
+    (True, 3, True)
+    """
+    rnd = Random(seed)
+    makedirs(path, exist_ok=True)
+    extent = EXTENT_PER_SQRT_LINE * sqrt(lines)
+
+    # corridors are straight polylines through the network, e.g. a main road or a tunnel
+    corridor_points = []
+    for _ in range(corridors):
+        start = random_point(rnd, extent * 0.6)
+        corridor_points.append([start] + interpolate(start, random_point(rnd, extent * 0.6), rnd, jitter=False))
+
+    stops, stop_id_by_point, stop_names = [], {}, {}
+    routes, trips, stop_times, shapes = [], [], [], []
+
+    def get_stop_id(point, name):
+        # stops on corridors are shared by the lines
+        if point not in stop_id_by_point:
+            stop_id_by_point[point] = f"stop_{len(stops)}"
+            stop_names[stop_id_by_point[point]] = name
+            stops.append((stop_id_by_point[point], name, point[0], point[1]))
+        return stop_id_by_point[point]
+
+    for line in range(lines):
+        route_id = f"route_{line}"
+        route_type = rnd.choice([0, 3, 3, 3, 2]) if lines > 1 else 3
+        color = "" if rnd.random() < 0.3 else f"{rnd.randrange(0x1000000):06X}"
+        routes.append((route_id, "agency_0", str(line + 1), f"Line {line + 1}", route_type, color,
+                       "FFFFFF" if color else ""))
+
+        # shape: start -> (corridor) -> end
+        start, end = random_point(rnd, extent), random_point(rnd, extent)
+        points = [start]
+        if corridors and rnd.random() < corridor_share:
+            corridor = rnd.choice(corridor_points)
+            if rnd.random() < 0.5:
+                corridor = corridor[::-1]
+            points += interpolate(start, corridor[0], rnd) + corridor[1:]
+        points += interpolate(points[-1], end, rnd)
+        # remove consecutive duplicates, e.g. if a line starts at a corridor
+        points = [p for i, p in enumerate(points) if i == 0 or p != points[i - 1]]
+
+        # evenly spaced stops along the shape
+        num_stops = max(2, min(stops_per_line, len(points)))
+        stop_indices = sorted(set(round(i * (len(points) - 1) / (num_stops - 1)) for i in range(num_stops)))
+        line_stops = [get_stop_id(points[idx], f"Line {line + 1} Stop {n + 1}")
+                      for n, idx in enumerate(stop_indices)]
+
+        # travel time between the stops
+        speed = SPEED[route_type]
+        offsets, offset = [0], 0
+        for a, b in zip(stop_indices, stop_indices[1:]):
+            length = sum(distance_in_meters(points[i], points[i + 1]) for i in range(a, b))
+            offset += int(length / speed) + DWELL_TIME
+            offsets.append(offset)
+
+        night_line = rnd.random() < night_share
+        for direction in (0, 1):
+            shape_id = f"shape_{line}_{direction}"
+            shape_points = points if direction == 0 else points[::-1]
+            shapes.extend((shape_id, lat, lon, i + 1) for i, (lat, lon) in enumerate(shape_points))
+            direction_stops = line_stops if direction == 0 else line_stops[::-1]
+            direction_offsets = offsets if direction == 0 else [offsets[-1] - o for o in offsets[::-1]]
+
+            departures = [("weekday", DAY_START + k * (DAY_END - DAY_START) // max(1, trips_per_day))
+                          for k in range(trips_per_day)]
+            departures += [("weekend", DAY_START + k * (DAY_END - DAY_START) // max(1, trips_per_day // 2))
+                           for k in range(trips_per_day // 2)]
+            if night_line:
+                departures += [("night", t) for t in range(NIGHT_START, NIGHT_END, 3600)]
+
+            for k, (service_id, departure) in enumerate(departures):
+                departure += rnd.randrange(0, 120)
+                trip_id = f"trip_{line}_{direction}_{k}"
+                trips.append((route_id, service_id, trip_id, stop_names[direction_stops[-1]], direction, shape_id))
+                for sequence, (stop_id, stop_offset) in enumerate(zip(direction_stops, direction_offsets)):
+                    arrival = departure + stop_offset
+                    # no dwell time at the first and the last stop
+                    stop_departure = arrival if sequence in (0, len(direction_stops) - 1) else arrival + DWELL_TIME // 2
+                    stop_times.append((trip_id, gtfs_time(arrival), gtfs_time(stop_departure), stop_id, sequence + 1))
+
+    calendar = [("weekday", 1, 1, 1, 1, 1, 0, 0, START_DATE, END_DATE),
+                ("weekend", 0, 0, 0, 0, 0, 1, 1, START_DATE, END_DATE),
+                ("night", 0, 0, 0, 0, 1, 1, 0, START_DATE, END_DATE)]
+    # exception_type 1 adds, 2 removes the service on a date
+    calendar_dates = [row for date in HOLIDAYS for row in (("weekday", date, 2), ("weekend", date, 1))]
+
+    files = {
+        "agency.txt": (["agency_id", "agency_name", "agency_url", "agency_timezone"],
+                       [("agency_0", "Synthetic Transit", "http://localhost", "Europe/Berlin")]),
+        "stops.txt": (["stop_id", "stop_name", "stop_lat", "stop_lon"], stops),
+        "routes.txt": (["route_id", "agency_id", "route_short_name", "route_long_name", "route_type", "route_color",
+                        "route_text_color"], routes),
+        "trips.txt": (["route_id", "service_id", "trip_id", "trip_headsign", "direction_id", "shape_id"], trips),
+        "stop_times.txt": (["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"], stop_times),
+        "shapes.txt": (["shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence"], shapes),
+        "calendar.txt": (["service_id", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+                          "start_date", "end_date"], calendar),
+        "calendar_dates.txt": (["service_id", "date", "exception_type"], calendar_dates),
+    }
+    for name, (header, rows) in files.items():
+        write_file(path, name, header, rows)
+
+    return {name: len(rows) for name, (_, rows) in files.items()}
+
+
+def generate_preset(path, preset="town", seed=1, **kwargs) -> dict:
+    """
+    Generates a feed with the parameters of a preset, kwargs overwrite them
+    """
+    parameters = dict(PRESETS[preset])
+    parameters.update({key: value for key, value in kwargs.items() if value is not None})
+    return generate_gtfs(path, seed=seed, **parameters)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Generate a synthetic GTFS feed")
+    parser.add_argument("--preset", default="town", choices=sorted(PRESETS))
+    parser.add_argument("--output", required=True, help="directory of the feed")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--lines", type=int)
+    parser.add_argument("--stops-per-line", type=int)
+    parser.add_argument("--trips-per-day", type=int)
+    parser.add_argument("--corridors", type=int)
+    parser.add_argument("--night-share", type=float)
+    args = parser.parse_args()
+
+    row_counts = generate_preset(args.output, args.preset, args.seed, lines=args.lines,
+                                 stops_per_line=args.stops_per_line, trips_per_day=args.trips_per_day,
+                                 corridors=args.corridors, night_share=args.night_share)
+    for file_name, row_count in row_counts.items():
+        print(f"{file_name:20} {row_count:10} rows")
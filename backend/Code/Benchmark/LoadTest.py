@@ -0,0 +1,356 @@
+# Headless load test of a running API
+# simulates many riders at once: every rider replays a GPS trajectory and sends the growing history to /map-match,
+# fetches the shape of a new match, the connections at the next stop every minute and the chat every 10 seconds,
+# like the app does
+#
+# python LoadTest.py --url http://localhost:5000 --gtfs ../../GTFS/Freiburg/gtfs-out/ --riders 1000 --speedup 10
+# replay recorded requests (JSON lines {"time": unix seconds, "endpoint": "/map-match", "body": {...}}):
+# python LoadTest.py --url http://localhost:5000 --log requests.jsonl.gz --speedup 10
+import csv
+import gzip
+import json
+import threading
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from math import ceil
+from random import Random
+from time import perf_counter, sleep
+
+import sys
+import os.path
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+from requests import Session, RequestException
+
+# default parameters can be changed here
+RIDERS = 100
+TRAJECTORIES = 50
+# the app sends the last 10 gps points
+HISTORY = 10
+SIGNAL_EVERY_N_SECONDS = 5
+CHAT_INTERVAL = 10
+CONNECTIONS_INTERVAL = 60
+# the riders start evenly distributed over the ramp up
+RAMP_UP = 60
+# the replay is speedup times faster than real time
+SPEEDUP = 1
+WORKERS = 64
+TIMEOUT = 30
+SEED = 42
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: list, p: float) -> float:
+    """
+    Nearest rank percentile of sorted values
+
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 50), percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 95)
+    (5, 10)
+    >>> percentile([], 99)
+    0
+    """
+    if not values:
+        return 0
+    return values[max(0, ceil(p / 100 * len(values)) - 1)]
+
+
+def read_json_lines(file_name: str) -> list:
+    """
+    Reads JSON lines, e.g. the traces of the TraceRecorder.
+    A trace that is still written to has no gzip end marker, its flushed lines are read.
+    """
+    opener = gzip.open if file_name.endswith(".gz") else open
+    ret = []
+    with opener(file_name, "rt") as f:
+        try:
+            for line in f:
+                if line.endswith("\n"):
+                    ret.append(json.loads(line))
+        except EOFError:
+            pass
+    return ret
+
+
+def generate_trajectories(path_to_gtfs, num_trajectories=TRAJECTORIES, seed=SEED, date=None) -> list:
+    """
+    Noisy gps trajectories of random trips, generated with GPSTestdata.
+    Returns [{"trip_id": trip_id, "points": [(lat, lon, time in milliseconds)]}]
+    """
+    from GPSTestdata import generate_noisified_gps_data
+    from Evaluation.EvaluationDataset import GenerationDataSet
+
+    if path_to_gtfs[-1] != "/":
+        path_to_gtfs += "/"
+    gen_dataset = GenerationDataSet(path_to_gtfs)
+    with open(path_to_gtfs + "trips.txt", "r") as trips_csv:
+        trips = [(line["trip_id"], line["shape_id"]) for line in csv.DictReader(trips_csv)]
+
+    trajectories = []
+    for trip_id, shape_id in Random(seed).sample(trips, min(num_trajectories, len(trips))):
+        _, points, timestamps = generate_noisified_gps_data(
+            path_to_gtfs, trip_id, shape_id, signal_every_n_seconds=SIGNAL_EVERY_N_SECONDS,
+            timestamp_date=date or datetime.now(), gen_dataset=gen_dataset, verbose=False)
+        trajectories.append({"trip_id": trip_id,
+                             "points": [(lat, lon, int(t)) for (lat, lon), t in zip(points, timestamps)]})
+    return trajectories
+
+
+class Rider:
+    """
+    One simulated app. Keeps the state the app keeps between requests: the last gps points,
+    the matched trip, its shape and the next stop.
+    """
+
+    __slots__ = ["user_id", "server_start_timestamp", "points", "history", "trip_id", "shape_id", "next_stop", "lock"]
+
+    def __init__(self, points: list, history: int = HISTORY):
+        self.user_id = 0
+        self.server_start_timestamp = 0
+        self.points = points
+        self.history = history
+        self.trip_id = ""
+        self.shape_id = ""
+        self.next_stop = ""
+        self.lock = threading.Lock()
+
+    def timeline(self, speedup=SPEEDUP) -> list:
+        """
+        Returns [(seconds after the start of the rider, endpoint, index of the gps point)]
+
+        >>> rider = Rider([(0, 0, 0), (0, 0, 20000), (0, 0, 65000)])
+        >>> rider.timeline()  # doctest: +NORMALIZE_WHITESPACE
+        [(0.0, '/map-match', 0), (10.0, '/chat', 0), (20.0, '/chat', 1), (20.0, '/map-match', 1),
+         (30.0, '/chat', 1), (40.0, '/chat', 1), (50.0, '/chat', 1), (60.0, '/chat', 1), (60.0, '/connections', 1),
+         (65.0, '/map-match', 2)]
+        """
+        start = self.points[0][2] / 1000
+        offsets = [point[2] / 1000 - start for point in self.points]
+        events = [(offset, "/map-match", i) for i, offset in enumerate(offsets)]
+        for endpoint, interval in (("/chat", CHAT_INTERVAL), ("/connections", CONNECTIONS_INTERVAL)):
+            i = 0
+            for k in range(1, int(offsets[-1] // interval) + 1):
+                # the app uses the state of the last map matching
+                while i + 1 < len(offsets) and offsets[i + 1] <= k * interval:
+                    i += 1
+                events.append((k * interval, endpoint, i))
+        return sorted((offset / speedup, endpoint, i) for offset, endpoint, i in events)
+
+    def body(self, endpoint: str, idx: int):
+        """
+        Request body of the endpoint at the gps point idx, None if the app would not send the request yet
+        """
+        lat, lon, timestamp = self.points[idx]
+        if endpoint == "/map-match":
+            coordinates = [f"{p[0]}, {p[1]}, {p[2]}" for p in self.points[max(0, idx + 1 - self.history):idx + 1]]
+            return {"coordinates": coordinates, "trip_id": self.trip_id, "shape_id": self.shape_id}
+        if endpoint == "/connections":
+            if not self.next_stop:
+                return None
+            return {"next_stop_name": self.next_stop, "user_time": str(timestamp), "trip_id": self.trip_id}
+        if endpoint == "/shapes":
+            return {"shape_id": self.shape_id, "trip_id": self.trip_id}
+        if endpoint == "/chat":
+            return {"just_fetch": True, "user_id": self.user_id,
+                    "server_start_timestamp": self.server_start_timestamp,
+                    "trip_id": self.trip_id}
+        raise ValueError(f"unknown endpoint {endpoint}")
+
+    def update(self, endpoint: str, answer: dict) -> bool:
+        """
+        Keeps the state of an answer. Returns True if the shape changed and has to be fetched.
+        """
+        with self.lock:
+            if endpoint == "/chat":
+                self.user_id = answer.get("user_id", self.user_id)
+                self.server_start_timestamp = answer.get("server_start_timestamp", self.server_start_timestamp)
+                return False
+            if endpoint != "/map-match" or not answer.get("trip_id"):
+                return False
+            new_shape = answer.get("shape_id", "") != self.shape_id
+            self.trip_id = answer["trip_id"]
+            self.shape_id = answer.get("shape_id", "")
+            self.next_stop = answer.get("next_stop", "")
+            return new_shape and bool(self.shape_id)
+
+
+class LoadTest:
+    """
+    Sends scheduled requests with a pool of workers and records the latency and the errors per endpoint.
+    The schedule is open loop: a slow API does not slow the riders down, the requests queue up.
+    lag is how late a request was sent, a high lag means the load test itself is the bottleneck.
+    """
+
+    def __init__(self, url: str, workers: int = WORKERS, timeout: float = TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.sessions = threading.local()
+        self.lock = threading.Lock()
+        # {endpoint: [latencies of the successful requests]}
+        self.latencies = {}
+        self.errors = {}
+        self.max_lag = 0.0
+
+    def get_session(self) -> Session:
+        # one keep alive connection per worker
+        if not hasattr(self.sessions, "session"):
+            self.sessions.session = Session()
+        return self.sessions.session
+
+    def send(self, endpoint: str, body: dict):
+        """
+        Returns the answer as dict or None if the request failed
+        """
+        start = perf_counter()
+        try:
+            response = self.get_session().post(self.url + endpoint, json=body, timeout=self.timeout)
+            ok = response.status_code < 400
+            answer = response.json() if ok else None
+        except (RequestException, ValueError):
+            ok, answer = False, None
+        latency = perf_counter() - start
+
+        with self.lock:
+            if ok:
+                self.latencies.setdefault(endpoint, []).append(latency)
+            else:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return answer
+
+    def rider_request(self, rider: Rider, endpoint: str, idx: int):
+        with rider.lock:
+            body = rider.body(endpoint, idx)
+        if body is None:
+            return
+        answer = self.send(endpoint, body)
+        if answer is not None and rider.update(endpoint, answer):
+            with rider.lock:
+                body = rider.body("/shapes", idx)
+            self.send("/shapes", body)
+
+    def run(self, schedule: list) -> float:
+        """
+        schedule: [(seconds after the start, function, args)], sorted by time
+        Returns the duration of the test in seconds
+        """
+        start = perf_counter()
+        futures = []
+        for offset, function, args in schedule:
+            wait = start + offset - perf_counter()
+            if wait > 0:
+                sleep(wait)
+            else:
+                self.max_lag = max(self.max_lag, -wait)
+            futures.append(self.executor.submit(function, *args))
+        for future in futures:
+            future.result()
+        self.executor.shutdown()
+        return perf_counter() - start
+
+    def report(self, duration: float) -> dict:
+        """
+        Returns {endpoint: {"requests", "errors", "error_rate", "throughput", "p50", "p95", "p99", "mean"}}
+            the latencies in seconds, "total" is the sum over all endpoints
+        """
+        ret = {}
+        all_latencies, all_errors = [], 0
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            latencies = sorted(self.latencies.get(endpoint, []))
+            errors = self.errors.get(endpoint, 0)
+            all_latencies += latencies
+            all_errors += errors
+            ret[endpoint] = self.get_stats(latencies, errors, duration)
+        ret["total"] = self.get_stats(sorted(all_latencies), all_errors, duration)
+        ret["total"]["duration"] = duration
+        ret["total"]["max_lag"] = self.max_lag
+        return ret
+
+    @staticmethod
+    def get_stats(latencies: list, errors: int, duration: float) -> dict:
+        requests = len(latencies) + errors
+        stats = {"requests": requests, "errors": errors, "error_rate": errors / requests if requests else 0,
+                 "throughput": requests / duration if duration else 0,
+                 "mean": sum(latencies) / len(latencies) if latencies else 0}
+        for p in PERCENTILES:
+            stats[f"p{p}"] = percentile(latencies, p)
+        return stats
+
+
+def rider_schedule(load_test: LoadTest, trajectories: list, riders=RIDERS, ramp_up=RAMP_UP, speedup=SPEEDUP,
+                   history=HISTORY, seed=SEED) -> list:
+    """
+    Every rider replays a random trajectory, the riders start evenly distributed over ramp_up seconds
+    """
+    rnd = Random(seed)
+    schedule = []
+    for n in range(riders):
+        rider = Rider(rnd.choice(trajectories)["points"], history)
+        rider_start = ramp_up * n / riders
+        schedule.extend((rider_start + offset, load_test.rider_request, (rider, endpoint, idx))
+                        for offset, endpoint, idx in rider.timeline(speedup))
+    schedule.sort(key=lambda x: x[0])
+    return schedule
+
+
+def log_schedule(load_test: LoadTest, log: list, speedup=SPEEDUP) -> list:
+    """
+    Replays recorded requests with their original spacing
+    """
+    log = sorted(log, key=lambda x: x["time"])
+    start = log[0]["time"] if log else 0
+    return [((entry["time"] - start) / speedup, load_test.send, (entry["endpoint"], entry["body"])) for entry in log]
+
+
+def print_report(report: dict):
+    print(f"{'endpoint':15}{'requests':>10}{'req/s':>10}{'errors':>10}"
+          + "".join(f"{'p' + str(p) + ' ms':>12}" for p in PERCENTILES), flush=True)
+    for endpoint, stats in report.items():
+        print(f"{endpoint:15}{stats['requests']:10}{stats['throughput']:10.1f}{stats['error_rate'] * 100:9.1f}%"
+              + "".join(f"{stats[f'p{p}'] * 1000:12.1f}" for p in PERCENTILES), flush=True)
+    print(f"duration: {report['total']['duration']:.1f}s, max lag: {report['total']['max_lag'] * 1000:.1f}ms",
+          flush=True)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Load test of a running API with simulated riders or recorded requests")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--gtfs", help="GTFS directory to generate the trajectories from")
+    parser.add_argument("--trajectories", help="JSON file of the trajectories, written after generating them")
+    parser.add_argument("--log", help="recorded requests as JSON lines, replayed instead of riders")
+    parser.add_argument("--num-trajectories", type=int, default=TRAJECTORIES)
+    parser.add_argument("--riders", type=int, default=RIDERS)
+    parser.add_argument("--history", type=int, default=HISTORY, help="gps points sent per /map-match request")
+    parser.add_argument("--ramp-up", type=float, default=RAMP_UP)
+    parser.add_argument("--speedup", type=float, default=SPEEDUP)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--timeout", type=float, default=TIMEOUT)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    test = LoadTest(args.url, args.workers, args.timeout)
+    if args.log:
+        requests_schedule = log_schedule(test, read_json_lines(args.log), args.speedup)
+    else:
+        if args.trajectories and os.path.isfile(args.trajectories):
+            with open(args.trajectories, "r") as file:
+                test_trajectories = json.load(file)
+        elif args.gtfs:
+            test_trajectories = generate_trajectories(args.gtfs, args.num_trajectories, args.seed)
+            if args.trajectories:
+                with open(args.trajectories, "w") as file:
+                    json.dump(test_trajectories, file)
+        else:
+            parser.error("either --log, --trajectories or --gtfs is needed")
+        requests_schedule = rider_schedule(
+            test, test_trajectories, args.riders, args.ramp_up, args.speedup, args.history, args.seed)
+
+    print(f"sending {len(requests_schedule)} requests to {args.url} ...", flush=True)
+    load_report = test.report(test.run(requests_schedule))
+    print_report(load_report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"date": datetime.now().isoformat(), "arguments": vars(args),
+                       "report": load_report}, file, indent=2)
@@ -0,0 +1,183 @@
+# Local stand-in for a GTFS-RT feed server, to test the realtime updates without the real feed
+# serves recorded feeds with ETag and Last-Modified and answers conditional requests with 304 Not Modified,
+# like the real feed servers do
+#
+# serve the files of a directory, e.g. http://localhost:9090/tripupdates is the file recordings/tripupdates:
+# python RecordedFeedServer.py serve --dir recordings --port 9090
+# if the path is a directory of recordings, they are replayed in the order of their names,
+# the next one every --interval seconds, the last one stays (without --interval only the last one is served):
+# python RecordedFeedServer.py serve --dir recordings --port 9090 --interval 60
+# record a feed into recordings/tripupdates/, only the changed feeds are saved:
+# python RecordedFeedServer.py record --url https://example.org/gtfs-rt --output recordings/tripupdates --interval 30
+import os
+from argparse import ArgumentParser
+from email.utils import formatdate, parsedate_to_datetime
+from hashlib import sha1
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep, time
+from typing import Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+import sys
+import os.path
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+PORT = 9090
+
+
+class RecordedFeedHandler(BaseHTTPRequestHandler):
+    server: "RecordedFeedServer"
+
+    def do_GET(self):
+        recording = self.server.recording(self.path)
+        if recording is None:
+            self.send_error(404)
+            return
+        content, etag, modified = recording
+
+        if "If-None-Match" in self.headers:
+            not_modified = etag in [tag.strip() for tag in self.headers["If-None-Match"].split(",")]
+        elif "If-Modified-Since" in self.headers:
+            try:
+                not_modified = int(modified) <= parsedate_to_datetime(self.headers["If-Modified-Since"]).timestamp()
+            except (TypeError, ValueError):
+                not_modified = False
+        else:
+            not_modified = False
+
+        self.send_response(304 if not_modified else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(modified, usegmt=True))
+        if not_modified:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            super().log_message(*args)
+
+
+class RecordedFeedServer(ThreadingHTTPServer):
+    """
+    >>> from tempfile import TemporaryDirectory
+    >>> from threading import Thread
+    >>> from FetchRealtimeUpdates import FeedFetcher
+    >>> directory = TemporaryDirectory()
+    >>> with open(os.path.join(directory.name, "tripupdates"), "wb") as f:
+    ...     _ = f.write(b"feed 1")
+    >>> server = RecordedFeedServer(directory.name, port=0)
+    >>> Thread(target=server.serve_forever, daemon=True).start()
+    >>> fetcher = FeedFetcher(f"http://127.0.0.1:{server.server_port}/tripupdates", timeout=5)
+    >>> fetcher.fetch(), fetcher.fetch()
+    (b'feed 1', None)
+    >>> with open(os.path.join(directory.name, "tripupdates"), "wb") as f:
+    ...     _ = f.write(b"feed 2")
+    >>> fetcher.fetch()
+    b'feed 2'
+    >>> server.shutdown(); server.server_close(); directory.cleanup()
+    """
+
+    def __init__(self, directory: str, port: int = PORT, interval: float = None, verbose: bool = False):
+        """
+        Input:
+            directory: the files of the directory are served, a directory in it is a replay of recordings
+            interval: seconds between the recordings of a replay, None to serve only the last recording
+        """
+        super().__init__(("127.0.0.1", port), RecordedFeedHandler)
+        self.directory = os.path.realpath(directory)
+        self.interval = interval
+        self.verbose = verbose
+        self.start_time = time()
+        self.start = monotonic()
+        # {file name: (modification time, content, etag)}
+        self._cache = {}
+
+    def _read(self, file_name: str) -> Tuple[bytes, str, float]:
+        modified = os.path.getmtime(file_name)
+        if file_name not in self._cache or self._cache[file_name][0] != modified:
+            with open(file_name, "rb") as f:
+                content = f.read()
+            self._cache[file_name] = (modified, content, f'"{sha1(content).hexdigest()}"')
+        return self._cache[file_name][1], self._cache[file_name][2], modified
+
+    def recording(self, path: str) -> Optional[Tuple[bytes, str, float]]:
+        """
+        Returns (content, etag, modification time) of the recording at the url path, None if there is none
+        """
+        file_name = os.path.realpath(os.path.join(self.directory, unquote(urlsplit(path).path).lstrip("/")))
+        if os.path.commonpath([self.directory, file_name]) != self.directory:
+            return None
+        if os.path.isfile(file_name):
+            return self._read(file_name)
+        if not os.path.isdir(file_name):
+            return None
+
+        recordings = sorted(name for name in os.listdir(file_name) if os.path.isfile(os.path.join(file_name, name)))
+        if not recordings:
+            return None
+        if self.interval is None:
+            return self._read(os.path.join(file_name, recordings[-1]))
+        idx = min(int((monotonic() - self.start) / self.interval), len(recordings) - 1)
+        content, etag, _ = self._read(os.path.join(file_name, recordings[idx]))
+        # the recording is modified when the replay switches to it
+        return content, etag, self.start_time + idx * self.interval
+
+
+def record(url: str, output: str, interval: float, api_key: str = None, city: str = "Freiburg"):
+    """
+    Saves the feed every interval seconds as output/<unix time>.pb if it changed, until interrupted
+    """
+    from FetchRealtimeUpdates import FeedFetcher, map_city_to_headers_function
+
+    os.makedirs(output, exist_ok=True)
+    fetcher = FeedFetcher(url, map_city_to_headers_function[city](api_key))
+    while True:
+        try:
+            content = fetcher.fetch()
+        except Exception as e:
+            print(f"fetching the feed failed: {e}", flush=True)
+            content = None
+        if content is not None:
+            file_name = os.path.join(output, f"{int(time())}.pb")
+            with open(file_name, "wb") as f:
+                f.write(content)
+            print(f"saved {file_name} ({len(content)} bytes)", flush=True)
+        sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Serves or records GTFS-RT feeds")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("--dir", required=True, help="directory of the recorded feeds")
+    serve_parser.add_argument("--port", type=int, default=PORT)
+    serve_parser.add_argument("--interval", type=float, default=None,
+                              help="seconds between the recordings of a replay")
+    serve_parser.add_argument("--verbose", action="store_true")
+
+    record_parser = subparsers.add_parser("record")
+    record_parser.add_argument("--url", required=True)
+    record_parser.add_argument("--output", required=True, help="directory of the recordings")
+    record_parser.add_argument("--interval", type=float, default=30)
+    record_parser.add_argument("--api-key", default=None)
+    record_parser.add_argument("--city", default="Freiburg", help="city of the authentication of the feed")
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        server = RecordedFeedServer(args.dir, args.port, args.interval, args.verbose)
+        print(f"serving {server.directory} on http://127.0.0.1:{server.server_port}/", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+    else:
+        try:
+            record(args.url, args.output, args.interval, args.api_key, args.city)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,176 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+Bounded caches shared between requests.
+"""
+from collections import OrderedDict
+from threading import Lock
+from weakref import ref
+
+
+class LRUCache:
+    """
+    Bounded dict that evicts the least recently used entry once max_size is reached.
+    Counts hits and misses, so that the hit rate can be exposed.
+    Thread safe, as the flask API handles requests in multiple threads.
+
+    >>> cache = LRUCache(max_size=2)
+    >>> cache.put("a", 1)
+    >>> cache.put("b", 2)
+    >>> cache.get("a")
+    1
+    >>> cache.put("c", 3)  # "b" is the least recently used entry
+    >>> cache.get("b") is None
+    True
+    >>> sorted(cache.keys())
+    ['a', 'c']
+    >>> cache.stats() == {"size": 2, "max_size": 2, "hits": 1, "misses": 1, "hit_rate": 0.5, "invalidations": 0}
+    True
+    >>> cache.clear()
+    >>> len(cache), cache.invalidations
+    (0, 1)
+    """
+
+    __slots__ = ["max_size", "hits", "misses", "invalidations", "_data", "_lock"]
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value and marks it as recently used.
+        Returns default if the key is not cached.
+        """
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key, value):
+        """
+        Caches the value, evicts the least recently used entry if the cache is full.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes every entry. Hit and miss counts are kept.
+        """
+        with self._lock:
+            self._data.clear()
+            self.invalidations += 1
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hit_rate, "invalidations": self.invalidations}
+
+
+class CandidateCache(LRUCache):
+    """
+    Caches the result of NetworkOfRoutes.get_close_edges across requests.
+    The frontend resends its whole GPS history on every /map-match request,
+    so the same (lat, lon, time) points are looked up again and again.
+
+    Two modes:
+        exact: key is the exact point, the max_dist and the timestamp divided into buckets of time_bucket seconds.
+        quantized: key is a grid cell of grid_size meters and a minute bucket.
+            Near-duplicate points (e.g. riders on the same vehicle) then share their close edges.
+            The result of the first point in a cell is reused, so the distances are approximations.
+
+    The cached close edges depend on the GTFSContainer and the realtime data,
+        call invalidate() on realtime updates. Binding a new container clears the cache automatically.
+
+    >>> cache = CandidateCache(max_size=10)
+    >>> cache.make_key(47.4836, 7.5462, 1659030123, 0.1)
+    (47.4836, 7.5462, 1659030123, 0.1)
+    >>> quantized_cache = CandidateCache(max_size=10, quantized=True, grid_size=10)
+    >>> quantized_cache.make_key(47.48368, 7.54627, 1659030123, 0.1) == \
+        quantized_cache.make_key(47.48369, 7.54628, 1659030150, 0.1)
+    True
+    >>> quantized_cache.make_key(47.48368, 7.54627, 1659030123, 0.1) == \
+        quantized_cache.make_key(47.48468, 7.54627, 1659030123, 0.1)
+    False
+    >>> class Container:
+    ...     pass
+    >>> container_1, container_2 = Container(), Container()
+    >>> cache.bind_container(container_1)
+    >>> cache.put("key", [])
+    >>> cache.bind_container(container_1)
+    >>> "key" in cache
+    True
+    >>> cache.bind_container(container_2)
+    >>> "key" in cache
+    False
+    """
+
+    __slots__ = ["quantized", "grid_size_degrees", "time_bucket", "_container_ref"]
+
+    def __init__(self, max_size: int = 100000, quantized: bool = False, grid_size: float = 10, time_bucket: int = 1):
+        """
+        Input:
+            max_size: maximum number of cached points
+            quantized: use grid cells and minute buckets as key instead of the exact point
+            grid_size: size of a grid cell in meters, only used if quantized
+            time_bucket: size of the timestamp buckets in seconds, only used if not quantized
+        """
+        super().__init__(max_size)
+        self.quantized = quantized
+        # 0.00001° ~ 1.112m => from meters to degrees
+        self.grid_size_degrees = grid_size / 1.112 * 0.00001
+        self.time_bucket = max(1, time_bucket)
+        # weak reference, the cache should not keep an old container alive
+        self._container_ref = None
+
+    def make_key(self, lat: float, lon: float, tim: int, max_dist: float) -> tuple:
+        """
+        Key of a location time tuple, tim is a utc timestamp in seconds
+        """
+        if self.quantized:
+            return (int(lat // self.grid_size_degrees), int(lon // self.grid_size_degrees),
+                    int(tim // 60), max_dist)
+        return lat, lon, int(tim // self.time_bucket), max_dist
+
+    def bind_container(self, container):
+        """
+        The close edges are only valid for the container they were computed with.
+        Clears the cache if another container is used, e.g. after fetching new GTFS data.
+        """
+        if self._container_ref is None or self._container_ref() is not container:
+            if self._container_ref is not None:
+                self.clear()
+            self._container_ref = ref(container)
+
+    def invalidate(self, *_):
+        """
+        Clears the cache, used as a callback when new realtime data arrives.
+        """
+        self.clear()
@@ -2,10 +2,15 @@
 Copyright 2022
 Bachelor's thesis by Gerrit Freiwald and Robin Wu
 """
+from collections import deque
 from datetime import datetime
+from itertools import count
+from threading import Condition
+from typing import List
 from GTFSContainer import GTFSContainer
 from TripsWithStops import TripWithStopsAndTimes
 import Utilities as Utils
+from BackgroundScheduler import SCHEDULER
 
 
 class ChatMessage:
@@ -15,47 +20,74 @@ class ChatMessage:
         "user_name",
         "message",
         "user_time",
+        "message_id",
     ]
 
     def __init__(
-            self, user_id: int, user_name: str, message: str, user_time: str):
+            self, user_id: int, user_name: str, message: str, user_time: str, message_id: int = 0):
         """
         Properties:
             user_id: Int from the device that sent the message
             user_name: String of the name the user has given himself
             user_time: String of the user_time the message has been sent
             message: String of the message
+            message_id: Int that increases with every message of the server, set by Chat.add_message
         """
         self.user_id = user_id
         self.user_name = user_name
         self.user_time = user_time
         self.message = message
+        self.message_id = message_id
 
     def __repr__(self):
         return "user_id: {self.user_id}, user_name: {self.user_name}," +\
                "user_time: {self.user_time}, message: {self.message}"
 
     def to_list(self):
-        return [self.user_id, self.user_name, self.message, self.user_time]
+        return [self.user_id, self.user_name, self.message, self.user_time, self.message_id]
 
 
 class Chat:
     """
-    Controls a dict {"trip_id": [ChatMessage]}
+    Controls a dict {"trip_id": deque of the last max_messages ChatMessages}
     Deletes the messages if the trip is not active anymore.
+    Every message gets a message id that increases with every message of the server,
+    so a client can fetch only the messages after the last one it has seen.
+
+    >>> chat = Chat(None, max_messages=2, max_message_length=5)
+    >>> for text in ["hello world", "second", "third"]:
+    ...     chat.add_message("trip", ChatMessage(1, "Alice", text, "12:00"))
+    >>> chat.get_messages("trip")
+    [[1, 'Alice', 'secon', '12:00', 2], [1, 'Alice', 'third', '12:00', 3]]
+    >>> chat.get_messages("trip", after_id=2), chat.get_messages("trip", after_id=3), chat.last_message_id
+    ([[1, 'Alice', 'third', '12:00', 3]], [], 3)
+    >>> # the id is newer than every message of the server, the client has seen an older server
+    >>> len(chat.get_messages("trip", after_id=50))
+    2
+    >>> chat.wait_for_messages("trip", after_id=3, timeout=0.01)
+    False
     """
 
-    __slots__ = ["trip_id_to_chat_messages", "gtfs_container", "debug"]
+    __slots__ = ["trip_id_to_chat_messages", "gtfs_container", "debug", "max_messages", "max_message_length",
+                 "last_message_id", "_message_ids", "_new_message"]
 
-    def __init__(self, container: GTFSContainer, debug: bool = False):
+    def __init__(self, container: GTFSContainer, debug: bool = False, max_messages: int = 200,
+                 max_message_length: int = 1000):
         """
         Input:
-            path_to_gtfs_trips_file:
-            for example r"../GTFS/Schweiz/SBB/gtfs-out/trips.txt"
+            container: GTFSContainer of the trips, the chats of inactive trips are removed
+            max_messages: number of messages kept per trip, the oldest ones are dropped
+            max_message_length: longer messages and user names are cut, together they cap the memory per trip
         """
         self.trip_id_to_chat_messages = {}
         self.gtfs_container = container
         self.debug = debug
+        self.max_messages = max_messages
+        self.max_message_length = max_message_length
+        self.last_message_id = 0
+        self._message_ids = count(1)
+        # notifies the requests that wait for new messages (long polling)
+        self._new_message = Condition()
 
     def add_message(self, trip_id: str, message: ChatMessage):
         """
@@ -66,27 +98,64 @@ class Chat:
         if self.debug:
             print(f"trip_id in chat-dict?: \
             {trip_id in self.trip_id_to_chat_messages}")
-        if trip_id not in self.trip_id_to_chat_messages:
-            self.trip_id_to_chat_messages[trip_id] = [message]
-        else:
+        message.message = str(message.message)[:self.max_message_length]
+        message.user_name = str(message.user_name)[:self.max_message_length]
+        with self._new_message:
+            message.message_id = self.last_message_id = next(self._message_ids)
+            if trip_id not in self.trip_id_to_chat_messages:
+                self.trip_id_to_chat_messages[trip_id] = deque(maxlen=self.max_messages)
             self.trip_id_to_chat_messages[trip_id].append(message)
+            self._new_message.notify_all()
 
-    def get_messages(self, trip_id: str):
+    def get_messages(self, trip_id: str, after_id: int = 0) -> List[list]:
         """
         Returns a dict that is ready to be sent to the frontend:
-        [[user_id, 'user_name', 'message', 'time_sent'], ...]
+        [[user_id, 'user_name', 'message', 'time_sent', message_id], ...]
+        Only the messages with a message id larger than after_id,
+            all messages if after_id is larger than the last message id (e.g. the server restarted)
         """
         if self.debug:
             print("getting messages from dict:", self.trip_id_to_chat_messages)
             print(f"{trip_id} in dict? -> \
                 {trip_id in self.trip_id_to_chat_messages}")
-        if trip_id not in self.trip_id_to_chat_messages:
-            return []
-        return [chat_message.to_list()
-                for chat_message in self.trip_id_to_chat_messages[trip_id]]
+        # add_message appends to the deque in other threads, iterating it meanwhile raises a RuntimeError
+        with self._new_message:
+            messages = list(self.trip_id_to_chat_messages.get(trip_id, ()))
+            last_message_id = self.last_message_id
+        if after_id > last_message_id:
+            after_id = 0
+        new_messages = []
+        # the messages are sorted by their id, the new ones are at the end
+        for chat_message in reversed(messages):
+            if chat_message.message_id <= after_id:
+                break
+            new_messages.append(chat_message.to_list())
+        return new_messages[::-1]
+
+    def has_messages_after(self, trip_id: str, after_id: int) -> bool:
+        """
+        True if the trip has a message with a message id larger than after_id
+        """
+        # the lock of the condition is reentrant, wait_for_messages calls this with the lock held
+        with self._new_message:
+            messages = self.trip_id_to_chat_messages.get(trip_id)
+            return bool(messages) and (messages[-1].message_id > after_id or after_id > self.last_message_id)
+
+    def wait_for_messages(self, trip_id: str, after_id: int, timeout: float) -> bool:
+        """
+        Blocks until the trip has a message after after_id or the timeout (seconds) is over (long polling).
+        Returns True if there are new messages
+        """
+        with self._new_message:
+            return self._new_message.wait_for(lambda: self.has_messages_after(trip_id, after_id), timeout)
 
-    @Utils.repeat_every_n_minutes(60)
     def remove_inactive_trips_every_hour(self):
+        """
+        Removes the inactive trips now and then every hour, as a job of the background scheduler
+        """
+        SCHEDULER.add_job("chat_cleanup", self.remove_inactive_trips, 60 * 60)
+
+    def remove_inactive_trips(self):
         """
         Removes trips from self.trip_id_to_chat_messages if they are inactive.
         """
@@ -37,6 +37,8 @@ POINTS_PER_TEST = 10
 ADD_TIME_NOISE = False
 TIME_STOP_NOISE = 60
 TIME_POSITION_NOISE = 30
+# evaluate the sliding window matcher for these numbers of gps points, e.g. [1, 2, 4, 6, 8, 10], empty to skip
+WINDOW_SIZES = []
 
 
 def get_random_batches(test_data, num_batches):
@@ -114,7 +116,9 @@ def gen_network(path_to_gtfs, path_saved, timezone, config):
     return NetworkOfRoutes(
         gtfs_container, print_time=False, prefer_last_trip=config["PREFER_LAST_TRIP"],
         baseline=config["BASELINE"], baseline_hmm=config["BASELINE_HMM"], time_after=config["TIME_AFTER"], slack=config["SLACK"],
-        earliness=config["EARLINESS"], delay=config["DELAY"], timezone=timezone)
+        earliness=config["EARLINESS"], delay=config["DELAY"], timezone=timezone, cascade=config["CASCADE"],
+        window_points=config["WINDOW_POINTS"], window_seconds=config["WINDOW_SECONDS"],
+        window_prior_points=config["WINDOW_PRIOR_POINTS"])
 
 
 def get_paths_tz(city):
@@ -125,14 +129,17 @@ def get_paths_tz(city):
     return read_path, save_path, tz
 
 
-def evaluate(test_data):
+def evaluate(test_data, window_points=None):
     """
     run the evaluation, no realtime data for now
+    window_points overwrites WINDOW_POINTS of the config
     """
     num_test = len(test_data)
     print(f"Starting {current_process().name} with {num_test} tests")
 
     config = get_config(file_name="../../config.yml")
+    if window_points is not None:
+        config["WINDOW_POINTS"] = window_points
     network = gen_network(*get_paths_tz(config["CITY"]), config)
 
     evaluation_accuracy = []
@@ -210,6 +217,38 @@ def run_evaluation_multiprocess(num_processes=cpu_count()):
     calc_averages(city)
 
 
+def run_window_evaluation_multiprocess(num_processes=cpu_count()):
+    """
+    run the evaluation for every window size in WINDOW_SIZES,
+    writes the average accuracy and time per window size
+    """
+    city = get_config(file_name="../../config.yml")["CITY"]
+    test_data = read_mock_data(city, *get_paths_tz(city)[:2], False, num_processes)
+
+    split_shuffled = get_random_batches(test_data, num_processes)
+
+    window_results = []
+    with Pool(processes=num_processes) as pool:
+        for window_size in WINDOW_SIZES:
+            result = pool.starmap(evaluate, zip(split_shuffled, repeat(window_size)))
+
+            all_accuracy, all_time = [], []
+            for eval_accuracy, eval_time, _ in result:
+                all_accuracy.extend(eval_accuracy)
+                all_time.extend(eval_time)
+
+            avg_acc = sum(all_accuracy) / len(all_accuracy) if all_accuracy else 0
+            avg_tim = sum(all_time) / len(all_time) if all_time else 0
+            window_results.append((window_size, avg_acc, avg_tim))
+            print(f"window size {window_size}: accuracy {avg_acc}, time {avg_tim}", flush=True)
+
+    with open(city + "WindowEvaluation.txt", "w") as window_file:
+        window_file.write("Window size, Accuracy, Time:\n")
+        for window_size, avg_acc, avg_tim in window_results:
+            window_file.write(f"{window_size}, {avg_acc}, {avg_tim}\n")
+        window_file.close()
+
+
 def calc_averages(city):
     with open(city + "AccuracyEvaluation.txt", "r") as f:
         accuracies = f.read()
@@ -235,3 +274,5 @@ def calc_averages(city):
 if __name__ == '__main__':
     # insert number of processes as argument
     run_evaluation_multiprocess(cpu_count() // 2)
+    if WINDOW_SIZES:
+        run_window_evaluation_multiprocess(cpu_count() // 2)
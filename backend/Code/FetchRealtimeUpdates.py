@@ -2,10 +2,17 @@
 Copyright 2022
 Bachelor's thesis by Gerrit Freiwald and Robin Wu
 """
+from datetime import date, datetime
+from hashlib import sha1
+from time import perf_counter
+from typing import Callable, Dict, Optional, Tuple
+
 from google.transit import gtfs_realtime_pb2
-from requests import get
-from protobuf_to_dict import protobuf_to_dict
-from Utilities import repeat_every_n_minutes
+from requests import RequestException, Session, Timeout
+from urllib3.exceptions import HTTPError as Urllib3Error, ReadTimeoutError
+from BackgroundScheduler import SCHEDULER
+from Metrics import REGISTRY
+from RealtimeDelays import TripDelays, delay_of_time
 
 # from https://github.com/MobilityData/gtfs-realtime-bindings
 
@@ -18,119 +25,293 @@ from Utilities import repeat_every_n_minutes
 # guide to protocol buffers:
 # https://developers.google.com/protocol-buffers/docs/proto
 
+# seconds to connect to the feed server
+CONNECT_TIMEOUT = 3.05
+# seconds for the whole download, a slow feed must not delay the next fetch
+FETCH_TIMEOUT = 10
+# seconds a single read of the download may wait for data, the deadline is checked after every read
+READ_TIMEOUT = 3
+# maximum number of bytes of a read
+READ_SIZE = 16 * 1024
+
+rt_fetch_seconds = REGISTRY.histogram("gtfs_rt_fetch_seconds", "Download time of the GTFS-RT feed in seconds")
+rt_parse_seconds = REGISTRY.histogram(
+    "gtfs_rt_parse_seconds", "Time to parse the GTFS-RT feed and build the trip updates in seconds")
+rt_fetches_total = REGISTRY.counter(
+    "gtfs_rt_fetches_total", "Number of fetches of the GTFS-RT feed, by result: updated, not_modified (HTTP 304), "
+                             "unchanged (same content), stale (header timestamp not newer) or failed", "result")
 
-def get_feed_no_auth(url: str) -> bytes:
-    return get(url).content
 
+def headers_no_auth(api_key: str = None) -> dict:
+    return {}
 
-def get_feed_switzerland(url: str, api_key: str) -> bytes:
-    headers = {"Authorization": api_key, "Content-Type": "text/XML", "Accept": "application/octet-stream"}
-    return get(url, headers=headers).content
 
+def headers_switzerland(api_key: str) -> dict:
+    return {"Authorization": api_key, "Content-Type": "text/XML", "Accept": "application/octet-stream"}
 
-map_city_to_getter_function = {
-    "Freiburg": get_feed_no_auth,  # only used for testing, there is no official/real feed for Freiburg
-    "Schweiz": get_feed_switzerland
+
+map_city_to_headers_function = {
+    "Freiburg": headers_no_auth,  # only used for testing, there is no official/real feed for Freiburg
+    "Schweiz": headers_switzerland
 }
 
 
+class FeedFetcher:
+    """
+    Downloads a feed over a persistent connection with conditional requests: the ETag and Last-Modified of the
+    last response are sent as If-None-Match and If-Modified-Since. A feed that was not modified (HTTP 304)
+    or has the same content as the last one is not returned, so it is not parsed again.
+    See Benchmark/RecordedFeedServer.py for a local server of recorded feeds.
+    """
+
+    def __init__(self, url: str, headers: dict = None, timeout: float = FETCH_TIMEOUT):
+        """
+        Input:
+            headers: sent with every request, e.g. the authentication of the feed
+            timeout: seconds for the whole download
+        """
+        self.url = url
+        self.timeout = timeout
+        self.session = Session()
+        self.session.headers.update(headers or {})
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+
+    def conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def _download(self, start: float) -> Optional[bytes]:
+        with self.session.get(self.url, headers=self.conditional_headers(), stream=True,
+                              timeout=(CONNECT_TIMEOUT, min(READ_TIMEOUT, self.timeout))) as response:
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+            # the read timeout is per read, the deadline bounds the whole download.
+            # read1 (urllib3 2) returns what a single read of the socket got, unlike iter_content, which waits
+            # until a chunk is full, so a server that sends a few bytes at a time can not hold the download
+            read = getattr(response.raw, "read1", response.raw.read)
+            chunks = []
+            try:
+                while True:
+                    chunk = read(READ_SIZE, decode_content=True)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                    if perf_counter() - start > self.timeout:
+                        raise Timeout(f"downloading {self.url} took longer than {self.timeout} seconds")
+            except ReadTimeoutError as e:
+                raise Timeout(e) from e
+            except Urllib3Error as e:
+                raise RequestException(e) from e
+            self.etag = response.headers.get("ETag")
+            self.last_modified = response.headers.get("Last-Modified")
+            return b"".join(chunks)
+
+    def fetch(self) -> Optional[bytes]:
+        """
+        Returns the content of the feed, None if it did not change since the last fetch.
+        Raises a requests.RequestException if the request fails or takes longer than the timeout.
+        """
+        start = perf_counter()
+        try:
+            content = self._download(start)
+        except RequestException:
+            rt_fetches_total.inc(label="failed")
+            raise
+        finally:
+            rt_fetch_seconds.observe(perf_counter() - start)
+
+        if content is None:
+            rt_fetches_total.inc(label="not_modified")
+            return None
+        content_hash = sha1(content).digest()
+        if content_hash == self.content_hash:
+            rt_fetches_total.inc(label="unchanged")
+            return None
+        self.content_hash = content_hash
+        return content
+
+
+def event_delay(event, scheduled: Optional[Tuple[datetime, bool]], service_date: Optional[date],
+                timezone: str) -> Optional[int]:
+    """
+    Delay in seconds of a StopTimeEvent (arrival or departure), None if it has none.
+    If both time and delay are specified, according to the standard time should take precedence,
+    a time needs the scheduled time of the stop to be converted to a delay.
+    """
+    if event.time and scheduled is not None:
+        return delay_of_time(event.time, scheduled, service_date, timezone)
+    if event.HasField("delay"):
+        return event.delay
+    return None
+
+
+def trip_delays_from_feed(feed: gtfs_realtime_pb2.FeedMessage, stop_times: Callable[[str], Optional[list]] = None,
+                          timezone: str = "Europe/Berlin") -> Dict[str, TripDelays]:
+    """
+    Reads the trip updates of the feed into a table of the delays of every trip
+    Input:
+        stop_times: returns the stop times of a trip of the GTFSContainer (None if it is unknown),
+            the number of stops and the scheduled times convert predicted times to delays
+        timezone: of the GTFS times
+
+    >>> feed = gtfs_realtime_pb2.FeedMessage()
+    >>> feed.header.gtfs_realtime_version = "2.0"
+    >>> trip_update = feed.entity.add(id="1").trip_update
+    >>> trip_update.trip.trip_id = "trip"
+    >>> update = trip_update.stop_time_update.add(stop_sequence=2)
+    >>> update.departure.delay = 120
+    >>> update = trip_update.stop_time_update.add(stop_sequence=3)
+    >>> update.arrival.time = 1659030600  # 19:50 in Freiburg, 8 minutes late
+    >>> update = trip_update.stop_time_update.add(stop_sequence=4, schedule_relationship=2)  # NO_DATA
+    >>> schedule = [((datetime(1900, 1, 1, 19, 40 + i), False), (datetime(1900, 1, 1, 19, 40 + i), False), str(i))
+    ...             for i in range(6)]
+    >>> delays = trip_delays_from_feed(feed, stop_times=lambda trip_id: schedule)["trip"]
+    >>> list(delays.arrival), list(delays.departure)
+    ([0, 0, 480, 480, 480, 480], [0, 120, 480, 480, 480, 480])
+    """
+    no_data = gtfs_realtime_pb2.TripUpdate.StopTimeUpdate.NO_DATA
+    trip_delays = {}
+    for entity in feed.entity:
+        if not entity.HasField("trip_update"):
+            continue
+        trip_update = entity.trip_update
+        trip_id = trip_update.trip.trip_id
+        if not trip_id or not trip_update.stop_time_update:
+            continue
+        service_date = datetime.strptime(trip_update.trip.start_date, "%Y%m%d").date() \
+            if trip_update.trip.start_date else None
+        schedule = stop_times(trip_id) if stop_times is not None else None
+
+        updates = []
+        for stop_time_update in trip_update.stop_time_update:
+            # only works if stop_sequence is present, stops without data keep the delay of the stop before
+            if not stop_time_update.stop_sequence or stop_time_update.schedule_relationship == no_data:
+                continue
+            # stop_sequence is 1 based, trip_segment_id is 0 based
+            stop_sequence = stop_time_update.stop_sequence - 1
+            arrival_time, departure_time = None, None
+            if schedule is not None and stop_sequence < len(schedule):
+                arrival_time, departure_time, _ = schedule[stop_sequence]
+            arrival = event_delay(stop_time_update.arrival, arrival_time, service_date, timezone) \
+                if stop_time_update.HasField("arrival") else None
+            departure = event_delay(stop_time_update.departure, departure_time, service_date, timezone) \
+                if stop_time_update.HasField("departure") else None
+            if arrival is not None or departure is not None:
+                updates.append((stop_sequence, arrival, departure))
+
+        if updates:
+            trip_delays[trip_id] = TripDelays.from_updates(updates, num_stops=len(schedule) if schedule else 0)
+    return trip_delays
+
+
 class GTFSrtGetter:
     """
     Class that can read a gtfs-realtime feed from an url and return a dict with the information
 
-    In order to use this class, you need to specify in map_city_to_getter_function the function that can read the feed.
+    In order to use this class, you need to specify in map_city_to_headers_function the function that returns
+    the headers of the requests to the feed.
 
     Note that depending on the city, the feed might need authentication. In this case, you need to implement
     the function yourself (Authentication method might differ).
-    The function should take either url or, url and api_key as parameters.
-    The function should return the bytes of the response with the content of the feed.
+    The function takes the api_key (None if the city has none) and returns a dict of headers.
+
+    The feed is only parsed if it changed, see FeedFetcher, and its header timestamp is newer than the last one.
+    The trip updates are {trip_id: RealtimeDelays.TripDelays}. gtfs_container has the scheduled times that convert
+    the predicted times of the feed to delays, without it only the delays of the feed are used.
+
+    on_update is called without arguments every time the trip updates have been replaced,
+    e.g. to invalidate caches that depend on the realtime data.
     """
-    def __init__(self, city: str, url: str, api_key: str = None, debug_print: bool = False):
-        if city not in map_city_to_getter_function:
-            raise ValueError(f"{city} not found, please add to map_city_to_getter_function")
-        self._url = url
-        self._api_key = api_key
-        self._func_get_feed = map_city_to_getter_function[city]
+    def __init__(self, city: str, url: str, api_key: str = None, debug_print: bool = False, on_update=None,
+                 timeout: float = FETCH_TIMEOUT, gtfs_container=None, timezone: str = "Europe/Berlin"):
+        if city not in map_city_to_headers_function:
+            raise ValueError(f"{city} not found, please add to map_city_to_headers_function")
+        self._fetcher = FeedFetcher(url, map_city_to_headers_function[city](api_key), timeout)
         self._debug_print = debug_print
+        self._on_update = on_update
+        # POSIX time of the header of the last parsed feed
+        self._feed_timestamp = 0
+        # replaced by the API when the GTFS files are updated
+        self.gtfs_container = gtfs_container
+        self.timezone = timezone
+
+    def _stop_times(self, trip_id: str) -> Optional[list]:
+        container = self.gtfs_container
+        if container is None or trip_id not in container.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict:
+            return None
+        return container.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id][1]
 
-    @property
-    def _feed_dict(self) -> dict:
+    def _parse_feed(self, content: bytes) -> Optional[Dict[str, TripDelays]]:
+        """
+        Returns the delays of the trips in the feed, None if its header timestamp is not newer than the last one
+        """
         feed = gtfs_realtime_pb2.FeedMessage()
-        # if there is an api key, pass url and api key to the function
-        args = (self._url, self._api_key) if self._api_key else (self._url, )
-        feed.ParseFromString(self._func_get_feed(*args))
-        return protobuf_to_dict(feed)
+        feed.ParseFromString(content)
+        # e.g. a load balanced feed where one server is behind
+        if feed.header.timestamp and feed.header.timestamp <= self._feed_timestamp:
+            rt_fetches_total.inc(label="stale")
+            return None
+        if self._debug_print:
+            print(f"GTFS RT feed:\n{feed}")
+
+        # currently only the full dataset update is implemented
+        # feed header can be differential or full dataset
+        if feed.header.incrementality != gtfs_realtime_pb2.FeedHeader.FULL_DATASET:
+            raise Exception(f'GTFS-Realtime {feed.header.incrementality} incrementality not supported')
+
+        self._feed_timestamp = feed.header.timestamp
+        return trip_delays_from_feed(feed, self._stop_times, self.timezone)
 
-    def fetch_trip_updates_every_n_minutes(self, n: float):
-        @repeat_every_n_minutes(n)
+    def fetch_trip_updates_every_n_minutes(self, n: float, jitter: float = 0.1):
+        """
+        Returns a function that takes the dict of the trip updates and updates it every n minutes
+        as a job of the background scheduler, the first time at once.
+        jitter: the processes of AsyncAPI.py fetch the feed at slightly different times, see BackgroundScheduler.Job
+        """
         def fetch_trip_updates(trip_updates: dict):
             """
             Fetch latest realtime stream and generate dict with new information
             """
-            feed_dict = self._feed_dict
-            if self._debug_print:
-                print(f"GTFS RT feed:\n{feed_dict}")
-
-            # currently only the full dataset update is implemented
-            # feed header can be differential or full dataset
-            if "incrementality" in feed_dict["header"]:
-                inc_mode = feed_dict["header"]["incrementality"]
-                if inc_mode != gtfs_realtime_pb2.FeedHeader.FULL_DATASET:
-                    raise Exception(f'GTFS-Realtime {inc_mode} incrementality not supported')
-
-            if "entity" not in feed_dict:
-                print("no entities in feed")
+            content = self._fetcher.fetch()
+            if content is None:
+                if self._debug_print:
+                    print("GTFS RT feed did not change", flush=True)
                 return
+            with rt_parse_seconds.time():
+                new_dict = self._parse_feed(content)
+                if new_dict is None:
+                    return
+                # update the global dict with the new data
+                trip_updates.clear()
+                trip_updates.update(new_dict)
+            rt_fetches_total.inc(label="updated")
 
-            new_dict = {}
-            for entity in feed_dict["entity"]:
-                if "trip_update" in entity and "stop_time_update" in entity["trip_update"]:
-                    trip_update = entity["trip_update"]
-                    start_date = trip_update["trip"]["start_date"]
-
-                    for stop_time_update in trip_update["stop_time_update"]:
-                        arrival_time, departure_time, stop_sequence = None, None, None
-
-                        # since all information is optional in the standard,
-                        # we need to check if it is present
-                        # note: if both time and delay are specified, according to the standard
-                        #   time should take precedence, ideally they should be the same
-                        if "arrival" in stop_time_update:
-                            if "time" in stop_time_update["arrival"]:
-                                arrival_time = stop_time_update["arrival"]["time"], True
-                            elif "delay" in stop_time_update["arrival"]:
-                                arrival_time = stop_time_update["arrival"]["delay"], False
-
-                        if "departure" in stop_time_update:
-                            if "time" in stop_time_update["departure"]:
-                                departure_time = stop_time_update["departure"]["time"], True
-                            elif "delay" in stop_time_update["departure"]:
-                                departure_time = stop_time_update["departure"]["delay"], False
-
-                        if "stop_sequence" in stop_time_update:
-                            # stop_sequence is 1 based, trip_segment_id is 0 based
-                            stop_sequence = stop_time_update["stop_sequence"] - 1
-
-                        # only works if stop_sequence and one of the times is present
-                        if (arrival_time or departure_time) and stop_sequence:
-                            trip_id = trip_update["trip"]["trip_id"]
-                            if trip_id not in new_dict:
-                                new_dict[trip_id] = []
-                            new_dict[trip_id].append((stop_sequence, arrival_time, departure_time, start_date))
-
-            # update the global dict with the new data
-            trip_updates.clear()
-            trip_updates.update(new_dict)
+            if self._on_update is not None:
+                self._on_update()
 
             if self._debug_print:
                 print(f"Trip Updates Dict:\n{trip_updates}")
 
-        return fetch_trip_updates
+        def start(trip_updates: dict):
+            SCHEDULER.add_job("gtfs_rt", lambda: fetch_trip_updates(trip_updates), n * 60, jitter=jitter)
+
+        return start
 
 
 if __name__ == '__main__':
     DEBUG = True
     updates = {}
+    # e.g. recorded feeds served by: python Benchmark/RecordedFeedServer.py serve --dir recordings --port 9090
     gtfs_rt = GTFSrtGetter("Freiburg", "http://localhost:9090/tripupdates", debug_print=DEBUG)
 
     gtfs_rt.fetch_trip_updates_every_n_minutes(1)(updates)
+    # the background scheduler runs in a daemon thread
+    input("Fetching the trip updates every minute, press enter to stop\n")
+    SCHEDULER.shutdown()
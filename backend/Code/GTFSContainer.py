@@ -3,8 +3,10 @@ Copyright 2022
 Bachelor's thesis by Gerrit Freiwald and Robin Wu
 """
 import sys
+from array import array
+from bisect import bisect_left, bisect_right
 from typing import Tuple, List
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from shapely.geometry import Point, LineString
 from shapely.ops import split, snap
 import os
@@ -12,6 +14,16 @@ import subprocess as sp
 import LoadJson
 from operator import itemgetter
 import Utilities as Utils
+from Caches import LRUCache
+from StopSearch import StopSearchIndex
+from SpatialIndex import GridIndex
+
+# from this zoom level of a web map on, /shapes returns the full polyline
+MAX_SHAPE_ZOOM = 18
+# /connections shows the departures of the next hours
+CONNECTIONS_WINDOW_HOURS = 5
+# meters, get_next_stop without trip segment ids answers the closest stop of the trip within this distance
+NEXT_STOP_MAX_DISTANCE = 500
 
 
 class GTFSContainer:
@@ -20,9 +32,12 @@ class GTFSContainer:
     Load and save GTFS files via the constructor (load only: update_dicts=False)
     """
 
-    def __init__(self, path_gtfs, path_saved_dictionaries, update_dicts=False, verbose=False, rt_dict=None):
+    def __init__(self, path_gtfs, path_saved_dictionaries, update_dicts=False, verbose=False, rt_dict=None,
+                 shape_cache_size=1000, connections_cache_size=10000):
         """
         Only (re-)builds the dicts if specified, as it may take a few minutes to load the GTFS data.
+        shape_cache_size: number of shape polylines and trip stops that are cached for /shapes
+        connections_cache_size: number of (stop name, minute) departure lists that are cached for /connections
         """
         self.verbose = verbose
         # debug
@@ -61,6 +76,24 @@ class GTFSContainer:
 
         self.gtfs_rt_dict = rt_dict
 
+        # {shape_id: array [lat0, lon0, lat1, lon1, ...]}, built on demand by self.get_shape_polyline
+        self.shape_polyline_cache = LRUCache(shape_cache_size)
+        # {trip_id: array [lat0, lon0, ...]} of the stops of the trip
+        self.trip_stops_cache = LRUCache(shape_cache_size)
+        # {(shape_id, zoom): array [lat0, lon0, ...]}, the simplified polylines of each zoom level
+        self.simplified_shape_cache = LRUCache(shape_cache_size)
+        # {stop_id: (array of departure seconds since the start of the service day, [trip_id])}, sorted,
+        # built on demand by self.get_departure_index
+        self.stop_departure_index = {}
+        # {(stop_name, minute, n): departures of self._find_departures}
+        self.connections_cache = LRUCache(connections_cache_size)
+        # autocomplete and fuzzy search of the stop names, built by self._load_dictionaries
+        self.stop_search = None
+        # grid of the stop positions for the nearest stops of a position, built by self._load_dictionaries
+        self.stop_grid = None
+        # changes if the saved dictionaries are rebuilt, e.g. used for the ETag of /shapes
+        self.version = ""
+
         if not update_dicts and not self._does_saving_path_exist(path_saved_dictionaries):
             raise FileNotFoundError(f"No JSON files saved under the given path_saved_dictionaries "
                                     f"{path_saved_dictionaries}.\n"
@@ -73,6 +106,7 @@ class GTFSContainer:
 
         # load dictionaries
         self._load_dictionaries(path_saved_dictionaries)
+        self.version = str(int(os.path.getmtime(path_saved_dictionaries + "edges_for_graph.json")))
 
         # debug
         sys.stdout = old_stdout
@@ -156,6 +190,9 @@ class GTFSContainer:
 
         self._generate_dicts_process_1(path)
         self._generate_dicts_process_2(path)
+        self.stop_search = StopSearchIndex(self.stop_name_to_list_of_stop_ids_dict)
+        self.stop_grid = GridIndex((stop_id, lat, lon) for stop_id, (_, lat, lon)
+                                   in self.stop_id_to_stop_information_dict.items())
 
         if self.verbose:
             print("Finished loading dictionaries.", flush=True)
@@ -224,9 +261,8 @@ class GTFSContainer:
         >>> dat = datetime(2022, 7, 28, 19, 43, 0)  # 19h43 but with an earliness of 2mins, not 1min
         >>> tt.get_active_trips_information(shp, e_id, dat, earliness=timedelta(minutes=2))
         [('TA+k8700', '1.TA.91-10-A-j22-1.1.H', '91-10-A-j22-1', [1, 2])]
-        >>> realtime_update = {'1.TA.91-10-A-j22-1.1.H':
-        ...     [(1, None, (datetime(2022, 7, 28, 19, 46), True), None),
-        ...      (2, None, (-600, False), None)]}
+        >>> from RealtimeDelays import TripDelays
+        >>> realtime_update = {'1.TA.91-10-A-j22-1.1.H': TripDelays.from_updates([(1, None, 60), (2, None, -600)])}
         >>> tt = GTFSContainer("../GTFS/doctest_files", "../saved_dictionaries/Doctests",
         ...     verbose=False, rt_dict=realtime_update)
         >>> shp = "shp_0_573"
@@ -358,11 +394,15 @@ class GTFSContainer:
         "Oberwil BL, Huslimatt"
         True
         """
-        # if there is no trip segment id, we cannot determine the next stop
+        stops_in_trip = self.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id][1]
+
+        # if there is no trip segment id, we cannot determine the next stop, use the closest stop of the trip
         if len(trip_segment_ids) == 0:
-            return ""
+            trip_stop_ids = {stop_id for _, _, stop_id in stops_in_trip}
+            closest = self.stop_grid.nearest(*position, max_distance=NEXT_STOP_MAX_DISTANCE,
+                                             accept=trip_stop_ids.__contains__)
+            return self.stop_id_to_stop_information_dict[closest[0][1]][0] if closest else ""
 
-        stops_in_trip = self.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id][1]
         _, _, stop_id = stops_in_trip[trip_segment_ids[0] + 1]
         stop_name, stop_lat, stop_lon = self.stop_id_to_stop_information_dict[stop_id]
 
@@ -407,6 +447,72 @@ class GTFSContainer:
         stop_id = self.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id][1][-1][2]
         return self.stop_id_to_stop_information_dict[stop_id][0]
 
+    def get_following_trip_ids(self, trip_id: str, max_wait: int = 30 * 60) -> List[str]:
+        """
+        Returns the trips that the vehicle of the given trip probably continues with at its terminal stop,
+            sorted by their departure time.
+        The GTFS block_id is not parsed by parseGTFS, so the trips of the same block are guessed from the timing:
+            trips that start at the terminal stop (or a stop with the same name) of the given trip,
+            at most max_wait seconds after the trip arrived there.
+        The departures are in seconds of their service day, so the departures of the next service day
+            (e.g. 00:10 after a trip that ends at 23:50) and of the previous one (24:10 after 00:05) are searched too.
+
+        >>> tt = GTFSContainer(path_gtfs=r"../GTFS/doctest_files",
+        ...     path_saved_dictionaries=r"../saved_dictionaries/Doctests",
+        ...     verbose=False
+        ... )
+        >>> following = tt.get_following_trip_ids("1.TA.91-10-A-j22-1.1.H")
+        >>> "1.TA.91-10-A-j22-1.1.H" in following
+        False
+        >>> # every following trip departs where the trip ends
+        >>> first_stop_ids = [tt.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[next_trip_id][1][0][2]
+        ...                   for next_trip_id in following]
+        >>> {tt.stop_id_to_stop_information_dict[stop_id][0] for stop_id in first_stop_ids} <= {"Oberwil BL, Huslimatt"}
+        True
+        >>> set(tt.get_following_trip_ids("1.TA.91-10-A-j22-1.1.H", max_wait=0)) <= set(following)
+        True
+        >>> # trip "a" ends at 23:50, the vehicle continues at 00:10 of the next service day
+        >>> night = GTFSContainer.__new__(GTFSContainer)
+        >>> night.stop_id_to_stop_information_dict = {"1": ("Hbf", 0, 0), "2": ("Messe", 0, 0)}
+        >>> night.stop_name_to_list_of_stop_ids_dict = {"Hbf": ["1"], "Messe": ["2"]}
+        >>> night.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict = {
+        ...     "a": ("r", [(None, (datetime(1900, 1, 1, 23, 40), False), "1"),
+        ...                 ((datetime(1900, 1, 1, 23, 50), False), None, "2")]),
+        ...     "b": ("r", [(None, (datetime(1900, 1, 1, 0, 10), False), "2"),
+        ...                 ((datetime(1900, 1, 1, 0, 20), False), None, "1")])}
+        >>> night.stop_id_to_trips_with_departure_time_dict = {"1": [("a", "23:40:00")], "2": [("b", "00:10:00")]}
+        >>> night.stop_departure_index = {}
+        >>> night.get_following_trip_ids("a"), night.get_following_trip_ids("a", max_wait=10 * 60)
+        (['b'], [])
+        """
+        stops_in_trip = self.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id][1]
+        arrival_tuple, _, terminal_stop_id = stops_in_trip[-1]
+        arrival = Utils.time_tuple_to_seconds(arrival_tuple)
+
+        # the next trip might depart at another platform of the same station
+        terminal_stop_name = self.stop_id_to_stop_information_dict[terminal_stop_id][0]
+        terminal_stop_ids = set(self.stop_name_to_list_of_stop_ids_dict.get(terminal_stop_name, [terminal_stop_id]))
+
+        following_trips = []
+        for stop_id in terminal_stop_ids:
+            seconds, trip_ids = self.get_departure_index(stop_id)
+            # the same day, the next service day and the previous one, in seconds of the service day of the trip
+            for day_offset in (0, 24 * 60 * 60, -24 * 60 * 60):
+                start, end = arrival - day_offset, arrival - day_offset + max_wait
+                for i in range(bisect_left(seconds, start), bisect_right(seconds, end)):
+                    next_trip_id = trip_ids[i]
+                    if next_trip_id == trip_id:
+                        continue
+                    # the following trip has to start at the terminal stop
+                    next_trip_stops = \
+                        self.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[next_trip_id][1]
+                    if next_trip_stops[0][2] not in terminal_stop_ids:
+                        continue
+                    following_trips.append((seconds[i] - start, next_trip_id))
+
+        following_trips.sort()
+        return [next_trip_id for _, next_trip_id in following_trips]
+
     def get_route_color(self, route_id: str) -> str:
         """
         Finds the color of a given route
@@ -463,93 +569,99 @@ class GTFSContainer:
         ... )
         [('10', 'Oberwil BL, Huslimatt', '0', 1663256580000, '777777', 'FFFFFF')]
         """
-        # get list of stop_ids with the given stop name
-        stops_to_check = self.stop_name_to_list_of_stop_ids_dict[stop_name]
-
+        minute = time.replace(second=0, microsecond=0)
+        key = (stop_name, minute, n)
+        connections = self.connections_cache.get(key)
+        if connections is None:
+            connections = self._find_departures(stop_name, minute, n)
+            self.connections_cache.put(key, connections)
+
+        # the cached departures start at the minute of the given time, without the own trip of the frontend
         possible_connections_list = []
+        for departure_time, connection, trip_ids in connections:
+            # no need to show own trip on the connections page
+            if departure_time <= time or trip_ids == {trip_id_frontend}:
+                continue
+            possible_connections_list.append(connection)
+        return possible_connections_list[:n]
 
-        # repeat 5 times, to check active trips for the next 4 to 5 hours if there are less than 20 trips accumulated
-        hours = 0
-        while hours < 5:
-            for stop_id in stops_to_check:
-                # get list of trip_ids and the departure time of that trip at the current stop
-                if stop_id not in self.stop_id_to_trips_with_departure_time_dict:
-                    # might be parent stop, that combines multiple stops together
-                    # they might not have trips, so skip in this case
-                    continue
-                trip_ids_and_departure_times = self.stop_id_to_trips_with_departure_time_dict[stop_id]
-
-                for trip_id, departure_time in trip_ids_and_departure_times:
-                    # no need to show own trip on the connections page
-                    if trip_id == trip_id_frontend:
-                        continue
-
-                    # Get the trip
-                    trip_with_stops = self.trip_id_to_trip_with_stops_dict[trip_id]
-
-                    # get the time plus a couple of hours to catch trips that have not yet started,
-                    # but still pass the current stop
-                    time_offset = time + timedelta(hours=hours)
-
-                    # Check whether the trip is active on the given time and day  (time: user time)
-                    is_active, overtime = trip_with_stops.is_trip_active(
-                        time_offset, self)
-
-                    if not is_active:
-                        continue
-
-                    # check if departure_time hour is something like "25:30:00" (if it is overflowing)
-                    # if so, correct the departure time, so it can be converted to a timestamp
-                    departure_overtime = False
-                    if int(departure_time[:2]) >= 24:
-                        departure_time = str(int(departure_time[:2]) - 24) + departure_time[2:]
-                        departure_overtime = True
-
-                    # add or subtract a day if needed
-                    delta = timedelta(0)
-                    if overtime and not departure_overtime:
-                        delta = timedelta(days=-1)
-                    if not overtime and departure_overtime:
-                        delta = timedelta(days=1)
-
-                    # convert departure time to datetime object
-                    departure_time = datetime.strptime(
-                        time_offset.date().strftime("%d/%m/%Y") + departure_time, "%d/%m/%Y%H:%M:%S") + delta
-
-                    # datetime object is in utc, because server uses utc.
-                    departure_time_utc = Utils.convert_local_time_to_utc(departure_time)
-
-                    # convert departure time to epoch timestamp
-                    departure_timestamp = datetime.timestamp(departure_time_utc)
-
-                    # trips with more than 22h offset should not be shown
-                    # (who wants to see a trip that starts in more than 22h?)
-                    if abs(departure_time - time) > timedelta(hours=22):
+    def _find_departures(self, stop_name: str, minute: datetime, n: int) -> List[Tuple[datetime, tuple, set]]:
+        """
+        Used by self.find_transfer_possibilities, cached per stop name and minute.
+        Returns [(local departure time, connection tuple, {trip_id, ...})],
+            sorted by the departure time, without duplicates:
+            every departure within the minute and the next n + 1 departures after it
+            (enough if the trip of the frontend is removed), at most CONNECTIONS_WINDOW_HOURS later.
+        """
+        end_of_minute = minute + timedelta(minutes=1)
+        departures = []
+        for stop_id in self.stop_name_to_list_of_stop_ids_dict[stop_name]:
+            # a departure after midnight may belong to the service day before (e.g. "25:30:00")
+            for days in (-1, 0, 1):
+                service_day = minute.date() + timedelta(days=days)
+                midnight = datetime.combine(service_day, datetime.min.time())
+                seconds, trip_ids = self.get_departure_index(stop_id)
+                # departures after the minute started, binary search in the sorted departures of the stop
+                first_seconds = int((minute - midnight).total_seconds())
+                last_seconds = first_seconds + CONNECTIONS_WINDOW_HOURS * 3600
+                for i in range(bisect_right(seconds, first_seconds), bisect_right(seconds, last_seconds)):
+                    trip_id = trip_ids[i]
+                    if not self.is_service_active(self.trip_id_to_trip_with_stops_dict[trip_id].service_id,
+                                                  service_day):
                         continue
+                    departures.append((midnight + timedelta(seconds=seconds[i]), trip_id))
+
+        departures.sort(key=itemgetter(0))
+        connections = {}
+        after_minute = 0
+        for departure_time, trip_id in departures:
+            route_id = self.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id][0]
+            # find route_short_name
+            # agency_id, short_name, long_name, route_type, color, text_color
+            route_short_name, route_type, route_color, route_text_color = \
+                self.route_id_to_route_information_dict[route_id]
+            # datetime object is in utc, because server uses utc.
+            departure_timestamp = datetime.timestamp(Utils.convert_local_time_to_utc(departure_time))
+            connection = (route_short_name, self.get_destination(trip_id), str(route_type),
+                          int(departure_timestamp * 1000), route_color, route_text_color)
+
+            # the same departure may be in the feed multiple times
+            if connection in connections:
+                connections[connection][2].add(trip_id)
+                continue
+            if departure_time >= end_of_minute:
+                after_minute += 1
+                if after_minute > n + 1:
+                    break
+            connections[connection] = (departure_time, connection, {trip_id})
 
-                    route_id = self.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id][0]
-
-                    # find route_short_name
-                    # agency_id, short_name, long_name, route_type, color, text_color
-                    route_short_name, route_type, route_color, route_text_color = \
-                        self.route_id_to_route_information_dict[route_id]
-
-                    # find last stop of trip
-                    destination = self.get_destination(trip_id)
-
-                    # only take NEW trips that are not yet in the possible_connections_list
-                    # also only choose trips that start AFTER the user time.
-                    if departure_time > time and (
-                            route_short_name, destination, str(route_type), int(departure_timestamp * 1000),
-                            route_color, route_text_color) not in possible_connections_list:
-                        possible_connections_list.append((route_short_name, destination, str(route_type),
-                                                          int(departure_timestamp * 1000),
-                                                          route_color, route_text_color))
-            hours += 1
+        return list(connections.values())
 
-        # only return the next n departing vehicles.
-        possible_connections_list.sort(key=itemgetter(3))
-        return possible_connections_list[:n]
+    def get_departure_index(self, stop_id: str) -> Tuple[array, List[str]]:
+        """
+        The departures at a stop, sorted by the seconds since the start of the service day
+        (larger than 24 * 60 * 60 after midnight), built on demand and kept in self.stop_departure_index.
+        Returns: (array of the seconds, [trip_id] in the same order)
+        """
+        index = self.stop_departure_index.get(stop_id)
+        if index is None:
+            # parent stops, that combine multiple stops together, might not have trips
+            departures = sorted(
+                (Utils.gtfs_time_to_seconds(departure_time), trip_id)
+                for trip_id, departure_time in self.stop_id_to_trips_with_departure_time_dict.get(stop_id, []))
+            index = array("l", [seconds for seconds, _ in departures]), [trip_id for _, trip_id in departures]
+            self.stop_departure_index[stop_id] = index
+        return index
+
+    def is_service_active(self, service_id: str, service_day: date) -> bool:
+        """
+        Whether the trips of the service run on the given day, like TripWithStopsAndTimes.is_trip_active
+        the start and end date of the service are not checked
+        """
+        active_weekdays, _, _, extra_dates, removed_dates = self.service_id_to_service_information_dict[service_id]
+        if service_day in extra_dates:
+            return True
+        return service_day.weekday() in active_weekdays and service_day not in removed_dates
 
     def get_shape_polyline_and_stops(
             self,
@@ -587,14 +699,102 @@ class GTFSContainer:
         ...      (47.49933242800001, 7.5571761131), (47.506542206000006, 7.5552716255000005)])
         True
         """
+        return self.get_shape_polyline(shape_id), self.get_trip_stop_positions(trip_id)
+
+    def get_shape_polyline(self, shape_id: str) -> List[Tuple[float, float]]:
+        """
+        The polyline of a shape, cached in self.shape_polyline_cache
+        """
+        packed = self.shape_polyline_cache.get(shape_id)
+        if packed is None:
+            packed = Utils.pack_coordinates(self._build_shape_polyline(shape_id))
+            self.shape_polyline_cache.put(shape_id, packed)
+        return Utils.unpack_coordinates(packed)
+
+    def get_simplified_shape_polyline(
+            self,
+            shape_id: str,
+            zoom: int = None,
+            tolerance: float = None
+    ) -> List[Tuple[float, float]]:
+        """
+        The polyline of a shape without the details that are not visible at the zoom level of a web map.
+        A tolerance in meters is rounded to the next zoom level, so that every shape has at most
+        MAX_SHAPE_ZOOM simplified polylines, cached in self.simplified_shape_cache.
+        Without zoom and tolerance or from MAX_SHAPE_ZOOM on, the full polyline is returned.
+        """
+        polyline = self.get_shape_polyline(shape_id)
+        if not polyline or (zoom is None and tolerance is None):
+            return polyline
+
+        lat = polyline[0][0]
+        if zoom is None:
+            zoom = Utils.tolerance_to_zoom(tolerance, lat, MAX_SHAPE_ZOOM)
+        zoom = max(0, int(zoom))
+        if zoom >= MAX_SHAPE_ZOOM:
+            return polyline
+
+        packed = self.simplified_shape_cache.get((shape_id, zoom))
+        if packed is None:
+            simplified = Utils.simplify_polyline(polyline, Utils.zoom_to_tolerance(zoom, lat))
+            packed = Utils.pack_coordinates(simplified)
+            self.simplified_shape_cache.put((shape_id, zoom), packed)
+        return Utils.unpack_coordinates(packed)
+
+    def search_stops(self, query: str, limit: int = 10) -> List[Tuple[str, float, float]]:
+        """
+        Autocomplete of the stop names, filled up with fuzzy matches (see StopSearch.StopSearchIndex.search)
+        Returns: [(stop_name, lat, lon)] with the position of the first stop id of the stop name
+        """
+        stops = []
+        for stop_name in self.stop_search.search(query, limit):
+            _, lat, lon = self.stop_id_to_stop_information_dict[self.stop_name_to_list_of_stop_ids_dict[stop_name][0]]
+            stops.append((stop_name, lat, lon))
+        return stops
+
+    def get_nearby_stops(self, lat: float, lon: float, limit: int = 10,
+                         radius: float = 1000) -> List[Tuple[str, str, float, float, float]]:
+        """
+        The closest stops of a position, using the grid index self.stop_grid
+        Input:
+            lat, lon: the position
+            limit: maximum number of stops
+            radius: maximum distance in meters
+        Returns: [(stop_id, stop_name, lat, lon, distance in meters)], the closest first
+        """
+        stops = []
+        for distance, stop_id in self.stop_grid.nearest(lat, lon, k=limit, max_distance=radius):
+            stop_name, stop_lat, stop_lon = self.stop_id_to_stop_information_dict[stop_id]
+            stops.append((stop_id, stop_name, stop_lat, stop_lon, distance))
+        return stops
+
+    def get_trip_stop_positions(self, trip_id: str) -> List[Tuple[float, float]]:
+        """
+        (lat, lon) of the stops of a trip, cached in self.trip_stops_cache
+        """
+        packed = self.trip_stops_cache.get(trip_id)
+        if packed is None:
+            stops = self.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id][1]
+            stop_positions = []
+            for _, _, stop_id in stops:
+                name, lat, lon = self.stop_id_to_stop_information_dict[stop_id]
+                stop_positions.append((lat, lon))
+            packed = Utils.pack_coordinates(stop_positions)
+            self.trip_stops_cache.put(trip_id, packed)
+        return Utils.unpack_coordinates(packed)
+
+    def _build_shape_polyline(self, shape_id: str) -> List[Tuple[float, float]]:
+        """
+        Used by self.get_shape_polyline. Walks the GTFSGraph along the edges of the shape.
+        """
         # get the first edge of the shape
         # first_edge: (float, float, float, float)
         first_edge = self.shape_id_to_trip_service_route_ids_dict[shape_id][0]
         edge_end_point = (first_edge[2], first_edge[3])
 
-        traversed_sequence_ids = []
+        # every edge of the shape is used once, so the walk ends after the last sequence id
+        traversed_sequence_ids = set()
 
-        counter = 0
         polyline = [(first_edge[0], first_edge[1])]
         while True:
             # get neighbors of current edge end point
@@ -621,27 +821,11 @@ class GTFSContainer:
                 # print(f"shape {shape_id} done:\n{polyline}", flush=True)
                 break
 
-            if len(neighbor_edges_with_same_shape) > 1:
-                # choose the edge with the smallest sequence id
-                neighbor_edges_with_same_shape.sort(key=lambda x: x[1])  # in-place sorting
-                traversed_sequence_ids.append(neighbor_edges_with_same_shape[0][1])
-
-            polyline.append(neighbor_edges_with_same_shape[0][0])
-            edge_end_point = neighbor_edges_with_same_shape[0][0]
-
-            counter += 1
-            if counter % 1000 == 0:
-                print(counter, flush=True)
-
-            # should never arise, but just in case
-            if counter > 100000:
-                break
+            # choose the edge with the smallest sequence id
+            next_point, sequence_id = min(neighbor_edges_with_same_shape, key=itemgetter(1))
+            traversed_sequence_ids.add(sequence_id)
 
-        # get stops
-        stops = self.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[trip_id][1]
-        stop_positions = []
-        for _, _, stop_id in stops:
-            name, lat, lon = self.stop_id_to_stop_information_dict[stop_id]
-            stop_positions.append((lat, lon))
+            polyline.append(next_point)
+            edge_end_point = next_point
 
-        return polyline, stop_positions
+        return polyline
@@ -4,14 +4,29 @@ Bachelor's thesis by Gerrit Freiwald and Robin Wu
 
 Implements a Hidden Markov Model for the map matching
 """
-from time import time
+from time import monotonic
 import networkx as nx
 from shapely.geometry import LineString, Point
 from GTFSContainer import GTFSContainer
+from Caches import CandidateCache
+from Metrics import REGISTRY
 import Utilities as Utils
 from typing import Tuple, List
 from datetime import timedelta
-from math import floor
+from math import floor, ceil
+
+# metrics are recorded for every request, see the /metrics endpoint of the API
+STAGE_SECONDS = REGISTRY.histogram(
+    "map_match_stage_seconds", "Runtime of the stages of the map matcher in seconds", "stage")
+CANDIDATES_PER_POINT = REGISTRY.histogram(
+    "map_match_candidates_per_point", "Number of close active edges per gps point",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200))
+TRANSITIONS_PER_REQUEST = REGISTRY.histogram(
+    "map_match_transitions_per_request", "Number of transitions in the HMM of a request",
+    buckets=(0, 10, 50, 100, 500, 1000, 5000, 10000, 50000))
+MATCH_TIER = REGISTRY.counter("map_match_tier_total", "Number of requests answered by each matcher tier", "tier")
+DEGRADED_MATCHES = REGISTRY.counter(
+    "map_match_degraded_total", "Number of requests that took a shortcut to stay within the deadline")
 
 
 class NetworkOfRoutes:
@@ -21,12 +36,25 @@ class NetworkOfRoutes:
 
     Input:
         container: GTFSContainer that has all information from GTFS files
-        print_time: prints runtime of major parts
+        print_time: prints runtime of major parts, the runtime is always recorded in STAGE_SECONDS
         baseline: use the baseline algorithm, i.e. only use the last GPS point no time
         baseline_hmm: use the baseline algorithm, hmm with no time
         time_after: use time to determine the most likely trip after matching
         slack: if close edges is empty we can skip floor(slack * len(route)) points
             to prevent no match
+        candidate_cache: CandidateCache that stores the close edges of gps points across requests,
+            None disables caching
+        trip_lock: if the request carries the trip_id of the last match, first check whether the
+            last trip_lock_points points still fit to that trip, skip the HMM if they do
+        trip_lock_points: number of points that are checked by the trip lock
+        cascade: first check the close active edges of the last point only,
+            run the HMM only if more than one trip is close to it
+        window_points: only use the last window_points gps points for the HMM, 0 uses all points
+        window_seconds: only use the gps points of the last window_seconds seconds for the HMM, 0 uses all points
+        window_prior_points: the points before the window are summarized by counting the active trips
+            close to at most window_prior_points of them, used if multiple trips are equally likely
+        deadline_ms: default latency budget of find_route_name in milliseconds, 0 means no deadline
+        degraded_candidates: number of close edges per point that are used once the budget runs low
     """
     class StateNode:
         """
@@ -46,9 +74,45 @@ class NetworkOfRoutes:
         def coordinates(self):
             return [self.from_node, self.to_node]
 
+    class Deadline:
+        """
+        Latency budget of a single request.
+        The budget runs low after low_fraction of it is used up.
+        degraded is set by the matcher, if it had to take a shortcut to stay within the budget.
+
+        >>> deadline = NetworkOfRoutes.Deadline(None)
+        >>> deadline.is_low(), deadline.is_expired(), deadline.degraded
+        (False, False, False)
+        >>> deadline = NetworkOfRoutes.Deadline(0.001)
+        >>> from time import sleep
+        >>> sleep(0.01)
+        >>> deadline.is_low(), deadline.is_expired()
+        (True, True)
+        """
+
+        __slots__ = ["end", "low", "degraded"]
+
+        def __init__(self, budget_ms, low_fraction=0.5):
+            if budget_ms:
+                start = monotonic()
+                self.end = start + budget_ms / 1000
+                self.low = start + budget_ms / 1000 * low_fraction
+            else:
+                self.end = self.low = None
+            self.degraded = False
+
+        def is_low(self) -> bool:
+            return self.low is not None and monotonic() >= self.low
+
+        def is_expired(self) -> bool:
+            return self.end is not None and monotonic() >= self.end
+
     def __init__(self, container: GTFSContainer, print_time=False,
                  prefer_last_trip=False, baseline=False, baseline_hmm=False, time_after=False,
-                 slack=0.2, delay=0, earliness=0, timezone="Europe/Berlin"):
+                 slack=0.2, delay=0, earliness=0, timezone="Europe/Berlin",
+                 candidate_cache: CandidateCache = None, trip_lock=False, trip_lock_points=3,
+                 cascade=False, window_points=0, window_seconds=0, window_prior_points=5,
+                 deadline_ms=0, degraded_candidates=3):
         self.print_time = print_time
         self.tt = container
         self.baseline = baseline
@@ -59,12 +123,46 @@ class NetworkOfRoutes:
         self.delay = timedelta(minutes=delay)
         self.earliness = timedelta(minutes=earliness)
         self.timezone = timezone
-
-    def find_route_name(self, route, trip_id="", dist=0.05):
+        self.candidate_cache = candidate_cache
+        self.trip_lock = trip_lock
+        self.trip_lock_points = trip_lock_points
+        self.cascade = cascade
+        self.window_points = window_points
+        self.window_seconds = window_seconds
+        self.window_prior_points = window_prior_points
+        self.deadline_ms = deadline_ms
+        self.degraded_candidates = degraded_candidates
+        # only add the "match_tier" to the answer if there is more than one tier
+        self.report_match_tier = trip_lock or cascade
+
+    @classmethod
+    def from_config(cls, container: GTFSContainer, config: dict, timezone: str,
+                    candidate_cache: CandidateCache = None, print_time=False):
+        """
+        Network with the map matching settings of the config.yml, used by the APIs
+        """
+        return cls(
+            container, print_time=print_time,
+            prefer_last_trip=config["PREFER_LAST_TRIP"],
+            baseline=config["BASELINE"],
+            baseline_hmm=config["BASELINE_HMM"],
+            time_after=config["TIME_AFTER"], slack=config["SLACK"],
+            earliness=config["EARLINESS"], delay=config["DELAY"],
+            timezone=timezone, candidate_cache=candidate_cache,
+            trip_lock=config["TRIP_LOCK"], trip_lock_points=config["TRIP_LOCK_POINTS"],
+            cascade=config["CASCADE"], window_points=config["WINDOW_POINTS"],
+            window_seconds=config["WINDOW_SECONDS"], window_prior_points=config["WINDOW_PRIOR_POINTS"],
+            deadline_ms=config["MATCH_DEADLINE_MS"], degraded_candidates=config["DEGRADED_CANDIDATES"])
+
+    def find_route_name(self, route, trip_id="", dist=0.05, deadline_ms=None):
         """
         Input:
             route: list of coordinates time tuples (length can vary)
             dist: the distance for which edges are considered close
+            deadline_ms: latency budget in milliseconds, None uses self.deadline_ms.
+                If the budget runs low, fewer close edges are used per point, the time based trip selection is skipped,
+                and once it is used up the remaining points except the last one are skipped
+                and the network distance is replaced by the great circle distance.
 
         Returns the most likely path and line as a dict that looks like:
         {
@@ -77,6 +175,9 @@ class NetworkOfRoutes:
             "next_stop": "str",
             "location": [float(latitude), float(longitude)]
         }
+        If self.trip_lock or self.cascade, the dict also contains "match_tier", i.e. which part of the matcher answered:
+            "trip_lock", "nearest_edge", "baseline" or "hmm"
+        If the matcher had to take a shortcut to stay within the deadline, the dict contains "degraded": True.
 
         >>> gtfs_container = GTFSContainer(
         ...     path_gtfs=r"../GTFS/doctest_files",
@@ -100,31 +201,244 @@ class NetworkOfRoutes:
         #             "next_stop": "", "location": [0, 0]}
 
         path = []
-        start_time = time()
+        trip_prior = {}
+        tier = "hmm"
+        deadline = NetworkOfRoutes.Deadline(self.deadline_ms if deadline_ms is None else deadline_ms)
+
+        # fast path: the rider is most likely still on the trip of the last match
+        if self.trip_lock and trip_id and route and route[0] != '0, 0, 0':
+            with self.stage_timer("trip_lock", "Trip Lock"):
+                locked_path = self.find_locked_trip_path(route, trip_id, dist)
+            if locked_path:
+                return self.add_match_tier(self.get_all_data(
+                    route[-1], [node.coordinates for node in locked_path], *self.get_locked_trip_ids(locked_path)),
+                    "trip_lock")
 
         # route: [(lat, lon, unix_time)]
-        if route and route[0] != '0, 0, 0':
-            # route = remove_outliers(route)
-            if self.baseline:
-                path = self.calculate_path([route[-1]], dist)
-            else:
-                path = self.calculate_path(route, dist)
-
-        end_time = time()
-        if self.print_time:
-            print("Time Calculate Path: %.4f" % (end_time - start_time), flush=True)
+        with self.stage_timer("calculate_path", "Calculate Path"):
+            if route and route[0] != '0, 0, 0':
+                # route = remove_outliers(route)
+                if self.baseline:
+                    path = self.calculate_path([route[-1]], dist, deadline)
+                    tier = "baseline"
+                else:
+                    # cheap check first, only build the HMM if several trips are close to the last point
+                    if self.cascade:
+                        path = self.find_unambiguous_path(route[-1], dist)
+                        if path:
+                            tier = "nearest_edge"
+                    if not path:
+                        # bound the length of the HMM, the older points are only used as a prior over the trips
+                        history, window = Utils.split_route_window(route, self.window_points, self.window_seconds)
+                        if history:
+                            trip_prior = self.get_trip_prior(history, dist)
+                        path = self.calculate_path(window, dist, deadline)
 
         # if still empty list we can skip everything after
         if not path:
-            return {"route_name": "", "trip_id": "",
-                    "route_type": "", "route_dest": "",
-                    "route_color": "", "shape_id": "",
-                    "next_stop": "", "location": [0, 0]}
+            return self.add_match_tier({"route_name": "", "trip_id": "",
+                                        "route_type": "", "route_dest": "",
+                                        "route_color": "", "shape_id": "",
+                                        "next_stop": "", "location": [0, 0]}, tier)
 
         path_coords = [node.coordinates for node in path]
 
-        return self.get_all_data(
-            route[-1], path_coords, *self.get_most_likely_shape(path, trip_id))
+        with self.stage_timer("trip_selection"):
+            most_likely_ids = self.get_most_likely_shape(path, trip_id, trip_prior, deadline)
+        ret = self.add_match_tier(self.get_all_data(route[-1], path_coords, *most_likely_ids), tier)
+        if deadline.degraded:
+            DEGRADED_MATCHES.inc()
+            ret["degraded"] = True
+        return ret
+
+    def stage_timer(self, stage: str, print_name: str = None):
+        """
+        Records the runtime of a stage in STAGE_SECONDS, prints it if self.print_time and a print_name is given.
+        """
+        return STAGE_SECONDS.time(stage, print_name if self.print_time else None)
+
+    def get_trip_prior(self, history, dist=0.05) -> dict:
+        """
+        Summarizes the gps points before the sliding window.
+        For at most self.window_prior_points evenly spaced points (starting with the most recent one),
+            count the trips that are active on the close edges.
+        As the close edges of these points were already needed for earlier requests,
+            they are usually served by the candidate cache.
+
+        Returns {trip_id: number of sampled points close to the trip}
+
+        no doctest for this function
+        """
+        step = max(1, ceil(len(history) / max(1, self.window_prior_points)))
+        trip_prior = {}
+        for lat, lon, tim in history[::-step]:
+            trips = set()
+            for _, _, _, _, edge_data, _ in self.get_close_edges(lat, lon, tim, dist):
+                for _, ids in edge_data:
+                    for _, trip, _, _ in ids:
+                        trips.add(trip)
+            for trip in trips:
+                trip_prior[trip] = trip_prior.get(trip, 0) + 1
+        return trip_prior
+
+    def add_match_tier(self, ret: dict, tier: str) -> dict:
+        """
+        Adds the tier of the matcher that answered the request, if self.report_match_tier.
+        The tier is always counted in MATCH_TIER.
+
+        >>> class Container:
+        ...     pass
+        >>> NetworkOfRoutes(Container()).add_match_tier({"trip_id": ""}, "hmm")
+        {'trip_id': ''}
+        >>> NetworkOfRoutes(Container(), cascade=True).add_match_tier({"trip_id": ""}, "hmm")
+        {'trip_id': '', 'match_tier': 'hmm'}
+        """
+        MATCH_TIER.inc(label=tier)
+        if self.report_match_tier:
+            ret["match_tier"] = tier
+        return ret
+
+    def find_unambiguous_path(self, coord, dist=0.05) -> list:
+        """
+        First tier of the cascade, only looks at the close active edges of the last gps point.
+        If exactly one trip is active on these edges, there is nothing the HMM could decide,
+            so the closest edge is returned as a path with a single StateNode.
+
+        Returns [] if no or multiple trips are close to the point.
+
+        >>> gtfs_container = GTFSContainer(
+        ...     path_gtfs=r"../GTFS/doctest_files",
+        ...     path_saved_dictionaries=r"../saved_dictionaries/Doctests",
+        ...     verbose=False)
+        >>> network = NetworkOfRoutes(gtfs_container, cascade=True)
+
+        two trips on different shapes are close to the point
+        >>> network.find_unambiguous_path((47.483688354, 7.5462784767, 1659030121))
+        []
+        """
+        lat, lon, tim = coord
+        close_edges = self.get_close_edges(lat, lon, tim, dist)
+
+        trips = set()
+        for _, _, _, _, edge_data, _ in close_edges:
+            for (shape, _), ids in edge_data:
+                for _, trip, _, _ in ids:
+                    trips.add((shape, trip))
+                    if len(trips) > 1:
+                        return []
+
+        if not trips:
+            return []
+
+        # close edges are sorted by the distance to the point
+        idx, length, start, end, edge_data, _ = close_edges[0]
+        return [NetworkOfRoutes.StateNode(coord, idx, length, start, end, edge_data)]
+
+    def find_locked_trip_path(self, route, trip_id: str, dist=0.05) -> list:
+        """
+        Fast path for riders that have already been matched to trip_id.
+        The last self.trip_lock_points points are consistent with the trip, if every point is close to an edge
+            of the trip's shape where the trip is active at the time of the point,
+            and the sequence ids along the shape do not decrease.
+        If they are not, try the trips that the vehicle continues with at the terminal stop.
+        The feed has no block_id, so these trips are guessed from the timing by GTFSContainer.get_following_trip_ids.
+
+        Returns a path of StateNodes that only contain the matched trip, [] if no trip is consistent.
+
+        >>> # trip "1" on shape "s1" continues as trip "2" on shape "s2", the close edge of a point depends on its lat
+        >>> class Container:
+        ...     trip_id_to_trip_with_stops_dict = {"1": None, "2": None}
+        ...     def get_following_trip_ids(self, trip_id):
+        ...         return ["2"] if trip_id == "1" else []
+        >>> edges = {1: ("s1", 1, "1"), 2: ("s1", 2, "1"), 3: ("s2", 1, "2"), 4: ("s2", 2, "2")}
+        >>> def get_close_edges(lat, lon, tim, dist):
+        ...     shape_id, sequence, trip_id = edges[lat]
+        ...     return [(lat, 10.0, None, None, [((shape_id, sequence), [("daily", trip_id, "r", [sequence])])], None)]
+        >>> network = NetworkOfRoutes(Container(), trip_lock=True, trip_lock_points=2)
+        >>> network.get_close_edges = get_close_edges
+        >>> # the points still follow the shape of the trip, the lock is held
+        >>> NetworkOfRoutes.get_locked_trip_ids(network.find_locked_trip_path([(1, 0, 0), (2, 0, 60)], "1"))
+        ('s1', 'daily', '1', 'r', [2])
+        >>> # the vehicle continued with its next trip at the terminal stop
+        >>> path = network.find_locked_trip_path([(2, 0, 0), (3, 0, 60), (4, 0, 120)], "1")
+        >>> NetworkOfRoutes.get_locked_trip_ids(path)
+        ('s2', 'daily', '2', 'r', [2])
+        >>> # backwards on the shape or an unknown trip, the lock is released
+        >>> network.find_locked_trip_path([(2, 0, 0), (1, 0, 60)], "1"), network.find_locked_trip_path([(1, 0, 0)], "3")
+        ([], [])
+        """
+        if trip_id not in self.tt.trip_id_to_trip_with_stops_dict:
+            return []
+
+        points = route[-self.trip_lock_points:]
+        path = self._check_trip_lock(points, trip_id, dist)
+        if path:
+            return path
+
+        # at the terminal stop the vehicle continues with another trip of its block
+        for following_trip_id in self.tt.get_following_trip_ids(trip_id):
+            path = self._check_trip_lock(points, following_trip_id, dist)
+            if path:
+                return path
+
+        return []
+
+    def _check_trip_lock(self, points, trip_id: str, dist) -> list:
+        """
+        Used by self.find_locked_trip_path.
+        For every point take the closest active edge of the trip, that does not go backwards on the shape.
+
+        >>> # the closest edge belongs to another trip, the next one is shared by trip "1" and trip "2"
+        >>> class Container:
+        ...     pass
+        >>> network = NetworkOfRoutes(Container())
+        >>> network.get_close_edges = lambda lat, lon, tim, dist: [
+        ...     (0, 1.0, None, None, [(("s2", 5), [("daily", "2", "r", [5])])], None),
+        ...     (1, 2.0, None, None, [(("s1", 3), [("daily", "1", "r", [3]), ("daily", "2", "r", [3])])], None)]
+        >>> path = network._check_trip_lock([(47.9, 7.8, 0)], "1", 0.05)
+        >>> [(node.edge, node.ids) for node in path]
+        [(1, [(('s1', 3), [('daily', '1', 'r', [3])])])]
+        >>> network._check_trip_lock([(47.9, 7.8, 0)], "3", 0.05)
+        []
+        """
+        path = []
+        last_shape_sequence = None
+        for coord in points:
+            lat, lon, tim = coord
+            node = None
+            # close edges are sorted by the distance to the point
+            for idx, length, start, end, edge_data, _ in self.get_close_edges(lat, lon, tim, dist):
+                for shape_sequence, ids in edge_data:
+                    if last_shape_sequence is not None and (
+                            shape_sequence[0] != last_shape_sequence[0] or shape_sequence[1] < last_shape_sequence[1]):
+                        continue
+                    trip_info = [info for info in ids if info[1] == trip_id]
+                    if trip_info:
+                        node = NetworkOfRoutes.StateNode(coord, idx, length, start, end, [(shape_sequence, trip_info)])
+                        last_shape_sequence = shape_sequence
+                        break
+                if node:
+                    break
+
+            if not node:
+                return []
+            path.append(node)
+
+        return path
+
+    @staticmethod
+    def get_locked_trip_ids(path: list) -> Tuple[str, str, str, str, List[int]]:
+        """
+        Returns the ids of the trip of a path found by self.find_locked_trip_path
+            in the same format as self.get_most_likely_shape.
+
+        >>> node = NetworkOfRoutes.StateNode((47.500282288, 7.5572729111, 1659030391), 0, 1.0, None, None,
+        ...     [(("shp_0_573", 2), [("TA+k8700", "1.TA.91-10-A-j22-1.1.H", "91-10-A-j22-1", [2])])])
+        >>> NetworkOfRoutes.get_locked_trip_ids([node])
+        ('shp_0_573', 'TA+k8700', '1.TA.91-10-A-j22-1.1.H', '91-10-A-j22-1', [2])
+        """
+        (shape_id, _), [(service_id, trip_id, route_id, ts_ids)] = path[-1].ids[0]
+        return shape_id, service_id, trip_id, route_id, ts_ids
 
     def get_all_data(self, location, path_coords, shape_id, service_id,
                      trip_id, route_id, trip_segment_ids: List[int]):
@@ -160,22 +474,19 @@ class NetworkOfRoutes:
         location_tuple = (probable_location.x, probable_location.y)
         ret["location"] = location_tuple
 
-        start_time = time()
-        ret["next_stop"] = self.tt.get_next_stop(trip_id, location_tuple, path_coords[-1], trip_segment_ids)
-        ret["route_name"] = self.tt.get_route_short_name(route_id)
-        ret["route_type"] = self.tt.get_route_type(route_id)
-        ret["route_dest"] = self.tt.get_destination(trip_id)
-        ret["route_color"] = self.tt.get_route_color(route_id)
-        ret["trip_id"] = trip_id
-        ret["shape_id"] = shape_id
-        end_time = time()
-
-        if self.print_time:
-            print("Time Get Info: %.4f" % (end_time - start_time), flush=True)
+        with self.stage_timer("get_all_data", "Get Info"):
+            ret["next_stop"] = self.tt.get_next_stop(trip_id, location_tuple, path_coords[-1], trip_segment_ids)
+            ret["route_name"] = self.tt.get_route_short_name(route_id)
+            ret["route_type"] = self.tt.get_route_type(route_id)
+            ret["route_dest"] = self.tt.get_destination(trip_id)
+            ret["route_color"] = self.tt.get_route_color(route_id)
+            ret["trip_id"] = trip_id
+            ret["shape_id"] = shape_id
+
         return ret
 
     def get_most_likely_shape(
-            self, path: list, last_trip_id=""
+            self, path: list, last_trip_id="", trip_prior: dict = None, deadline: Deadline = None
     ) -> Tuple[str, str, str, str, List[int]]:
         """
         Take the route and decide which shape and trip is the most likely one.
@@ -188,6 +499,11 @@ class NetworkOfRoutes:
         If last_trip_id is specified, prefer the same trip_id, if there are multiply
         most likely trips.
 
+        If trip_prior {trip_id: count} is specified, e.g. from the points before a sliding window,
+        first prefer the most likely trips with the highest count.
+
+        If the deadline runs low, the time based matching is skipped.
+
         As input take a path of network x nodes.
 
         Returns:
@@ -230,7 +546,8 @@ class NetworkOfRoutes:
 
                 if shape not in shapes_count:
                     shapes_count[shape] = 1
-                    shapes_info[shape] = other_ids
+                    # copy, the ids belong to the (possibly cached) close edges and must not be extended
+                    shapes_info[shape] = list(other_ids)
                 else:
                     shapes_count[shape] += 1
                     shapes_info[shape] += other_ids
@@ -256,12 +573,16 @@ class NetworkOfRoutes:
 
         most_likely_trips = Utils.get_multiple_max_values(list(count_dict.items()))
 
+        # prefer the trips that were close to the gps points before the window
+        if len(most_likely_trips) > 1 and trip_prior:
+            most_likely_trips = Utils.get_multiple_max_values(
+                [(trip, trip_prior.get(trip[1], 0)) for trip in most_likely_trips])
+
         most_likely_trip = None
         # if there is only one trip, take it
         if len(most_likely_trips) == 1:
             most_likely_trip = most_likely_trips[0]
         else:
-            start_time = time()
             # if last trip id is specified, prefer the same trip id
             # also skip the time based check in this case
             if last_trip_id and self.prefer_last_trip:
@@ -270,21 +591,25 @@ class NetworkOfRoutes:
                         most_likely_trip = trip
                         break
 
+            # the time based matching is expensive, skip it if the deadline runs low
+            time_after = self.time_after
+            if time_after and not most_likely_trip and deadline is not None and deadline.is_low():
+                deadline.degraded = True
+                time_after = False
+
             # do the time based matching here
-            if not most_likely_trip and self.time_after:
-                avg_diff = {}
-                for s_id, t_id, r_id, shp in most_likely_trips:
-                    to_add = []
-                    # for every point in the route calculate the time difference
-                    for ts_ids, route_point in zip(info_to_ts[s_id, t_id, r_id, shp], route_points):
-                        to_add.append(self.tt.get_time_difference(t_id, route_point, ts_ids))
-                    avg_diff[(s_id, t_id, r_id, shp)] = sum(to_add, timedelta()) / len(to_add)
-
-                # get the trip, that has the smallest average time difference
-                most_likely_trip = min(avg_diff, key=avg_diff.get)
-                end_time = time()
-                if self.print_time:
-                    print(f"Time based matching took {end_time - start_time} seconds")
+            if not most_likely_trip and time_after:
+                with self.stage_timer("time_after", "Time based matching"):
+                    avg_diff = {}
+                    for s_id, t_id, r_id, shp in most_likely_trips:
+                        to_add = []
+                        # for every point in the route calculate the time difference
+                        for ts_ids, route_point in zip(info_to_ts[s_id, t_id, r_id, shp], route_points):
+                            to_add.append(self.tt.get_time_difference(t_id, route_point, ts_ids))
+                        avg_diff[(s_id, t_id, r_id, shp)] = sum(to_add, timedelta()) / len(to_add)
+
+                    # get the trip, that has the smallest average time difference
+                    most_likely_trip = min(avg_diff, key=avg_diff.get)
             # if no trip was found, just take the first one
             elif not most_likely_trip:
                 most_likely_trip = most_likely_trips[0]
@@ -301,13 +626,16 @@ class NetworkOfRoutes:
                             # if fitting information is found, just return
                             return most_likely_shape_id, service_id, trip_id, route_id, ts_ids
 
-    def calculate_path(self, route, dist=0.05):
+    def calculate_path(self, route, dist=0.05, deadline: Deadline = None):
         """
         Calculate the most likely path.
         Create a graph that represents the markov chain.
         Take a list of Points as Route and a list of Edges,
         Edges should only be close ones.
 
+        If the deadline runs low, only the self.degraded_candidates closest edges are used per point.
+        If it is used up, all points but the last one are skipped, so the partial path still ends at the last point.
+
         >>> gtfs_container = GTFSContainer(
         ...     path_gtfs=r"../GTFS/doctest_files",
         ...     path_saved_dictionaries=r"../saved_dictionaries/Doctests",
@@ -335,37 +663,46 @@ class NetworkOfRoutes:
         last_state = [start_state]
         slack = floor(len(route) * self.slack)
 
-        start_time = time()
-        for coord in route:
-            current_state = []
-            lat, lon, tim = coord
+        with self.stage_timer("trellis_build", "Get Close edges and build Graph"):
+            for i, coord in enumerate(route):
+                # out of time, only the last point is still needed
+                if deadline is not None and i < len(route) - 1 and deadline.is_expired():
+                    deadline.degraded = True
+                    continue
 
-            # get all edges that are reasonably close to the point while being active at the time
-            close_edges = self.get_close_edges(lat, lon, tim, dist)
+                current_state = []
+                lat, lon, tim = coord
 
-            if slack > 0 and not close_edges:
-                slack -= 1
-                continue
+                # get all edges that are reasonably close to the point while being active at the time
+                close_edges = self.get_close_edges(lat, lon, tim, dist)
 
-            for edge in close_edges:
-                # edge: (id, length, from location, to location, shape names with ids)
-                next_state = NetworkOfRoutes.StateNode(coord, edge[0], edge[1], edge[2], edge[3], edge[4])
-                graph.add_node(next_state)
-                current_state.append(next_state)
+                # the close edges are sorted by distance, so keep the closest ones
+                if deadline is not None and len(close_edges) > self.degraded_candidates and deadline.is_low():
+                    deadline.degraded = True
+                    close_edges = close_edges[:self.degraded_candidates]
+                CANDIDATES_PER_POINT.observe(len(close_edges))
+
+                if slack > 0 and not close_edges:
+                    slack -= 1
+                    continue
 
-                for node in last_state:
-                    graph.add_edge(node, next_state)
+                for edge in close_edges:
+                    # edge: (id, length, from location, to location, shape names with ids)
+                    next_state = NetworkOfRoutes.StateNode(coord, edge[0], edge[1], edge[2], edge[3], edge[4])
+                    graph.add_node(next_state)
+                    current_state.append(next_state)
 
-            last_state = current_state
+                    for node in last_state:
+                        graph.add_edge(node, next_state)
 
-        end_state = NetworkOfRoutes.StateNode(None, None, None, None, None, None, "end")
-        graph.add_node(end_state)
-        for node in last_state:
-            graph.add_edge(node, end_state)
+                last_state = current_state
 
-        end_time = time()
-        if self.print_time:
-            print("Time Get Close edges and build Graph: %.4f" % (end_time - start_time), flush=True)
+            end_state = NetworkOfRoutes.StateNode(None, None, None, None, None, None, "end")
+            graph.add_node(end_state)
+            for node in last_state:
+                graph.add_edge(node, end_state)
+
+        TRANSITIONS_PER_REQUEST.observe(graph.number_of_edges())
 
         # calculate the distance between the last edges to the last point
         distances = {}
@@ -373,25 +710,23 @@ class NetworkOfRoutes:
             distances[edge] = LineString(edge[0].coordinates).distance(Point(route[-1]))
         nx.set_edge_attributes(graph, distances, "distance")
 
-        start_time = time()
         try:
-            calculated_path = nx.bidirectional_dijkstra(graph, start_state, end_state, weight=self.edge_likelihood)[1]
+            with self.stage_timer("shortest_path", "to calculate shortest path in graph"):
+                calculated_path = nx.bidirectional_dijkstra(
+                    graph, start_state, end_state,
+                    weight=lambda start, end, attributes: self.edge_likelihood(start, end, attributes, deadline))[1]
         except nx.NetworkXNoPath:
-            end_time = time()
-            if self.print_time:
-                print("Time to calculate shortest path in graph Exception: %.4f" % (end_time - start_time), flush=True)
             return []
-        end_time = time()
-        if self.print_time:
-            print("Time to calculate shortest path in graph: %.4f" % (end_time - start_time), flush=True)
 
         return calculated_path[1:-1]
 
-    def edge_likelihood(self, start, end, attributes=None):
+    def edge_likelihood(self, start, end, attributes=None, deadline: Deadline = None):
         """
         First implement a very simple version.
         Use log2 space, so squared distances
 
+        If the deadline is used up, the great circle distance replaces the shortest path in the network.
+
         >>> gtfs_container = GTFSContainer(
         ...     path_gtfs=r"../GTFS/doctest_files",
         ...     path_saved_dictionaries=r"../saved_dictionaries/Doctests",
@@ -435,8 +770,12 @@ class NetworkOfRoutes:
         # if there is no path set a high score
         distance = 1000000000
         if direction_penalty != -1:
-            distance = Utils.bidirectional_dijkstra_modified(
-                self.tt.GTFSGraph, start.to_node, end.from_node, weight="length")
+            if deadline is not None and deadline.is_expired():
+                deadline.degraded = True
+                distance = Utils.distance_wrapper(start.to_node, end.from_node)
+            else:
+                distance = Utils.bidirectional_dijkstra_modified(
+                    self.tt.GTFSGraph, start.to_node, end.from_node, weight="length")
 
         transition = start.dist + distance + end.dist
 
@@ -455,6 +794,9 @@ class NetworkOfRoutes:
 
         max_dist is in kilometers
 
+        If a candidate cache is given, the close edges are reused across requests.
+        The returned list is shared with the cache and must not be modified.
+
         >>> gtfs_container = GTFSContainer(
         ...     path_gtfs=r"../GTFS/doctest_files",
         ...     path_saved_dictionaries=r"../saved_dictionaries/Doctests",
@@ -478,6 +820,24 @@ class NetworkOfRoutes:
         ...     0.0004067599908268084)]
         True
         """
+        with STAGE_SECONDS.time("candidate_search"):
+            if self.candidate_cache is None:
+                return self._find_close_edges(lat, lon, tim, max_dist)
+
+            # the close edges are only valid for the current container
+            self.candidate_cache.bind_container(self.tt)
+            key = self.candidate_cache.make_key(lat, lon, tim, max_dist)
+            close_edges = self.candidate_cache.get(key)
+            if close_edges is None:
+                close_edges = self._find_close_edges(lat, lon, tim, max_dist)
+                self.candidate_cache.put(key, close_edges)
+
+            return close_edges
+
+    def _find_close_edges(self, lat: float, lon: float, tim: int, max_dist: float = 0.05) -> list:
+        """
+        Used by self.get_close_edges, computes the close edges without using the candidate cache.
+        """
         # convert the utc time to local time zone, that the GTFS uses
         tim_local = Utils.convert_utc_to_local_time(tim, self.timezone)
         point = Point(lat, lon)
@@ -0,0 +1,74 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+State of a streaming map matching session (the WebSocket /map-match/ws of AsyncAPI.py).
+Instead of sending its whole GPS history with every /map-match request, the client sends only its new GPS fixes.
+The session keeps the last fixes, the matcher runs on them and the client gets an answer only if it changed.
+"""
+from collections import deque
+from typing import List, Optional
+
+
+class MatchSession:
+    """
+    >>> session = MatchSession(max_points=3)
+    >>> session.add_fixes([[47.9, 7.8, 100], [47.9, 7.8, 100], [47.91, 7.8, 90], [47.92, 7.8, 130]])
+    2
+    >>> session.route, session.dirty
+    ([[47.9, 7.8, 100], [47.92, 7.8, 130]], True)
+    >>> session.add_fixes([[47.93, 7.8, 160], [47.94, 7.8, 190]]), session.route[0]
+    (2, [47.92, 7.8, 130])
+    >>> session.update({"trip_id": "1", "next_stop": "Hbf"})
+    {'trip_id': '1', 'next_stop': 'Hbf'}
+    >>> session.update({"trip_id": "1", "next_stop": "Hbf"}) is None, session.trip_id
+    (True, '1')
+    """
+
+    __slots__ = ["points", "trip_id", "deadline_ms", "dirty", "last_answer"]
+
+    def __init__(self, max_points: int = 100, trip_id: str = ""):
+        """
+        Input:
+            max_points: number of GPS fixes kept, the older ones are dropped
+            trip_id: the trip of the last match, the matcher tries it first
+        """
+        # [lat, lon, unix time in seconds], sorted by the time
+        self.points = deque(maxlen=max_points)
+        self.trip_id = trip_id
+        self.deadline_ms = None
+        # True if fixes were added since the last match started
+        self.dirty = False
+        self.last_answer = None
+
+    @property
+    def route(self) -> List[list]:
+        return list(self.points)
+
+    def add_fixes(self, route: List[list]) -> int:
+        """
+        Adds the new GPS fixes [[lat, lon, unix time in seconds], ...],
+        fixes that are not newer than the last one (resent or out of order) are skipped.
+        Returns the number of added fixes
+        """
+        added = 0
+        for point in route:
+            if self.points and point[2] <= self.points[-1][2]:
+                continue
+            self.points.append(point)
+            added += 1
+        if added:
+            self.dirty = True
+        return added
+
+    def update(self, answer: dict) -> Optional[dict]:
+        """
+        Takes the answer of the matcher for the route of the session.
+        Returns the answer if the client has to be updated, None if it is the same as the last one
+        """
+        if answer.get("trip_id"):
+            self.trip_id = answer["trip_id"]
+        if answer == self.last_answer:
+            return None
+        self.last_answer = answer
+        return answer
@@ -0,0 +1,152 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+Measures where the memory of a loaded GTFSContainer goes, to keep Switzerland under 32GB ram.
+
+python MemoryReport.py ../saved_dictionaries/Freiburg
+"""
+import json
+import sys
+from argparse import ArgumentParser
+from collections import deque
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import List, Tuple
+
+from shapely.geometry.base import BaseGeometry
+from shapely.strtree import STRtree
+
+# the coordinates of shapely geometries are stored by GEOS, sys.getsizeof does not see them.
+# GEOS stores three doubles per coordinate, the sizes of a geometry and a tree node are estimates
+GEOS_COORDINATE_BYTES = 24
+GEOS_GEOMETRY_BYTES = 100
+GEOS_TREE_ITEM_BYTES = 64
+
+# objects that do not reference other objects
+ATOMIC_TYPES = (str, bytes, int, float, complex, bool, type(None), range)
+# shared by everything, not part of the container
+SKIPPED_TYPES = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType)
+
+
+def geos_sizeof(geometry: BaseGeometry) -> int:
+    """
+    Estimated bytes of the GEOS part of a shapely geometry.
+
+    >>> from shapely.geometry import LineString
+    >>> geos_sizeof(LineString([(0, 0), (1, 1), (2, 0)])) == GEOS_GEOMETRY_BYTES + 3 * GEOS_COORDINATE_BYTES
+    True
+    """
+    if geometry.is_empty:
+        return GEOS_GEOMETRY_BYTES
+    if hasattr(geometry, "geoms"):
+        return GEOS_GEOMETRY_BYTES + sum(geos_sizeof(part) for part in geometry.geoms)
+    if geometry.geom_type == "Polygon":
+        return GEOS_GEOMETRY_BYTES + sum(geos_sizeof(ring) for ring in [geometry.exterior, *geometry.interiors])
+    return GEOS_GEOMETRY_BYTES + len(geometry.coords) * GEOS_COORDINATE_BYTES
+
+
+def deep_sizeof(obj, seen: set = None) -> int:
+    """
+    Bytes of obj and every object it references.
+    Objects whose id is in seen are not counted, the ids of the counted objects are added to seen.
+    Sharing seen between calls counts objects that are referenced by multiple structures only once.
+
+    >>> deep_sizeof([]) == sys.getsizeof([])
+    True
+    >>> shared = "x" * 1000
+    >>> seen = set()
+    >>> deep_sizeof([shared], seen) > 1000, deep_sizeof({"a": shared}, seen) < 1000
+    (True, True)
+    """
+    if seen is None:
+        seen = set()
+
+    size = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, SKIPPED_TYPES):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+
+        if isinstance(current, ATOMIC_TYPES):
+            continue
+        if isinstance(current, BaseGeometry):
+            size += geos_sizeof(current)
+            continue
+        if isinstance(current, STRtree):
+            size += len(current._geoms) * GEOS_TREE_ITEM_BYTES
+
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset, deque)):
+            stack.extend(current)
+
+        if hasattr(current, "__dict__"):
+            stack.append(vars(current))
+        for cls in type(current).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                if hasattr(current, slot):
+                    stack.append(getattr(current, slot))
+
+    return size
+
+
+def container_memory_report(container) -> List[Tuple[str, int]]:
+    """
+    Returns [(structure, bytes)] for every structure of the container and ("total", bytes).
+    Objects that are shared by multiple structures (e.g. trip_id strings) count for the first one.
+    The trip segment geometries are counted separately from the rest of the trip segment dict.
+    """
+    seen = set()
+    report = [
+        ("graph", deep_sizeof(container.GTFSGraph, seen)),
+        ("strtree", deep_sizeof(container.EdgesGeoIndex, seen)),
+        ("trip_objects", deep_sizeof(container.trip_id_to_trip_with_stops_dict, seen)),
+    ]
+
+    hash_dict = container.hash_to_edge_id_to_trip_segment_id_dict_dict or {}
+    report.append(("trip_segment_geometries",
+                   sum(deep_sizeof(geometries, seen) for _, geometries in hash_dict.values())))
+    report.append(("trip_segments", deep_sizeof(hash_dict, seen)))
+
+    for name in ["trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict",
+                 "route_id_to_route_information_dict",
+                 "shape_id_to_trip_service_route_ids_dict",
+                 "stop_id_to_stop_information_dict",
+                 "stop_id_to_trips_with_departure_time_dict",
+                 "stop_name_to_list_of_stop_ids_dict",
+                 "service_id_to_service_information_dict",
+                 "stop_search",
+                 "stop_grid",
+                 "gtfs_rt_dict"]:
+        report.append((name, deep_sizeof(getattr(container, name), seen)))
+
+    report.append(("total", sum(size for _, size in report)))
+    return report
+
+
+def format_report(report: List[Tuple[str, int]]) -> str:
+    """
+    >>> print(format_report([("graph", 3 * 1024 ** 2), ("strtree", 1024 ** 2), ("total", 4 * 1024 ** 2)]))
+    graph                                                           3.00 MB   75.0%
+    strtree                                                         1.00 MB   25.0%
+    total                                                           4.00 MB  100.0%
+    """
+    total = dict(report).get("total") or 1
+    return "\n".join(f"{name:60}{size / 1024 ** 2:8.2f} MB {size / total * 100:6.1f}%" for name, size in report)
+
+
+if __name__ == '__main__':
+    from GTFSContainer import GTFSContainer
+
+    parser = ArgumentParser(description="Memory usage of the structures of a GTFSContainer")
+    parser.add_argument("saved", help="directory of the saved dictionaries")
+    parser.add_argument("--gtfs", default="../GTFS/", help="directory of the GTFS files, only used for the path")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    memory_report = container_memory_report(GTFSContainer(path_gtfs=args.gtfs, path_saved_dictionaries=args.saved))
+    print(json.dumps(dict(memory_report), indent=4) if args.json else format_report(memory_report))
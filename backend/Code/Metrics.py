@@ -0,0 +1,337 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+Counters, gauges and histograms that are cheap enough to be recorded on every request.
+Exposed in the Prometheus text format by the /metrics endpoint of the API.
+"""
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+from typing import Callable, List, Tuple
+
+# upper bounds of the histogram buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(labels: List[Tuple[str, str]]) -> str:
+    """
+    Formats labels as {name="value",...}, escapes the values.
+
+    >>> format_labels([])
+    ''
+    >>> format_labels([("stage", 'a"b'), ("le", "0.5")])
+    '{stage="a\\\\"b",le="0.5"}'
+    """
+    if not labels:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+               for name, value in labels]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value: float) -> str:
+    """
+    >>> format_value(3), format_value(0.25), format_value(float("inf")), format_value(float("nan"))
+    ('3', '0.25', '+Inf', 'NaN')
+    """
+    if value == float("inf"):
+        return "+Inf"
+    if value != value:
+        return "NaN"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """
+    Base class of the metrics. A metric has at most one label,
+    the values of every label value are kept in self._values.
+    """
+
+    kind = "untyped"
+
+    __slots__ = ["name", "documentation", "label_name", "_values", "_lock"]
+
+    def __init__(self, name: str, documentation: str, label_name: str = None):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self._values = {}
+        self._lock = Lock()
+
+    def get_labels(self, label) -> List[Tuple[str, str]]:
+        return [(self.label_name, label)] if self.label_name is not None and label is not None else []
+
+    def drain(self) -> dict:
+        """
+        Returns the values of every label and resets them, see Registry.drain
+        """
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values: dict):
+        """
+        Adds the values of drain() of the same metric in another process
+        """
+        raise NotImplementedError(f"{self.kind} {self.name} can not be merged")
+
+    def samples(self) -> List[Tuple[str, List[Tuple[str, str]], float]]:
+        """
+        Returns [(name of the sample, labels, value)]
+        """
+        with self._lock:
+            return [(self.name, self.get_labels(label), value) for label, value in sorted(
+                self._values.items(), key=lambda x: "" if x[0] is None else str(x[0]))]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing count.
+
+    >>> counter = Counter("requests_total", "Number of requests", "endpoint")
+    >>> counter.inc(label="/map-match")
+    >>> counter.inc(2, label="/map-match")
+    >>> counter.inc(label="/shapes")
+    >>> print("\\n".join(counter.render()))
+    # HELP requests_total Number of requests
+    # TYPE requests_total counter
+    requests_total{endpoint="/map-match"} 3
+    requests_total{endpoint="/shapes"} 1
+    """
+
+    kind = "counter"
+
+    __slots__ = []
+
+    def inc(self, amount: float = 1, label=None):
+        with self._lock:
+            self._values[label] = self._values.get(label, 0) + amount
+
+    def get(self, label=None) -> float:
+        return self._values.get(label, 0)
+
+    def merge(self, values: dict):
+        for label, amount in values.items():
+            self.inc(amount, label)
+
+
+class Gauge(Metric):
+    """
+    Value that can go up and down. If a function is given, it is called when the metric is rendered.
+
+    >>> size = [3]
+    >>> gauge = Gauge("cache_size", "Number of cached entries", function=lambda: size[0])
+    >>> size[0] = 5
+    >>> gauge.render()[-1]
+    'cache_size 5'
+    """
+
+    kind = "gauge"
+
+    __slots__ = ["function"]
+
+    def __init__(self, name: str, documentation: str, label_name: str = None, function: Callable = None):
+        super().__init__(name, documentation, label_name)
+        self.function = function
+
+    def set(self, value: float, label=None):
+        with self._lock:
+            self._values[label] = value
+
+    def samples(self) -> List[Tuple[str, List[Tuple[str, str]], float]]:
+        if self.function is not None:
+            return [(self.name, [], self.function())]
+        return super().samples()
+
+
+class Timer:
+    """
+    Context manager that observes the elapsed seconds in a histogram.
+    If print_name is given, the time is also printed, like the old debug prints.
+    """
+
+    __slots__ = ["histogram", "label", "print_name", "start", "elapsed"]
+
+    def __init__(self, histogram, label=None, print_name: str = None):
+        self.histogram = histogram
+        self.label = label
+        self.print_name = print_name
+        self.start = 0.0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.elapsed = perf_counter() - self.start
+        self.histogram.observe(self.elapsed, self.label)
+        if self.print_name:
+            print("Time %s: %.4f" % (self.print_name, self.elapsed), flush=True)
+
+
+class Histogram(Metric):
+    """
+    Counts observations in buckets, e.g. request durations.
+    Buckets are upper bounds, rendered cumulatively as Prometheus expects.
+
+    >>> histogram = Histogram("stage_seconds", "Runtime of a stage", "stage", buckets=(0.1, 1))
+    >>> histogram.observe(0.05, "hmm")
+    >>> histogram.observe(0.5, "hmm")
+    >>> histogram.observe(3, "hmm")
+    >>> print("\\n".join(histogram.render()))
+    # HELP stage_seconds Runtime of a stage
+    # TYPE stage_seconds histogram
+    stage_seconds_bucket{stage="hmm",le="0.1"} 1
+    stage_seconds_bucket{stage="hmm",le="1"} 2
+    stage_seconds_bucket{stage="hmm",le="+Inf"} 3
+    stage_seconds_sum{stage="hmm"} 3.55
+    stage_seconds_count{stage="hmm"} 3
+    >>> with histogram.time("trip_selection") as timer:
+    ...     pass
+    >>> histogram.get_count("trip_selection")
+    1
+    """
+
+    kind = "histogram"
+
+    __slots__ = ["buckets"]
+
+    def __init__(self, name: str, documentation: str, label_name: str = None, buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_name)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, label=None):
+        # value lies in the first bucket, whose upper bound is >= value, the last one is +Inf
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            if label not in self._values:
+                self._values[label] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = self._values[label]
+            counts[0][idx] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def time(self, label=None, print_name: str = None) -> Timer:
+        return Timer(self, label, print_name)
+
+    def get_count(self, label=None) -> int:
+        return self._values[label][2] if label in self._values else 0
+
+    def merge(self, values: dict):
+        with self._lock:
+            for label, (bucket_counts, total, count) in values.items():
+                if label not in self._values:
+                    self._values[label] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                counts = self._values[label]
+                counts[0] = [a + b for a, b in zip(counts[0], bucket_counts)]
+                counts[1] += total
+                counts[2] += count
+
+    def samples(self) -> List[Tuple[str, List[Tuple[str, str]], float]]:
+        ret = []
+        with self._lock:
+            values = sorted(self._values.items(), key=lambda x: "" if x[0] is None else str(x[0]))
+            for label, (bucket_counts, total, count) in values:
+                labels = self.get_labels(label)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                    cumulative += bucket_count
+                    ret.append((self.name + "_bucket", labels + [("le", format_value(bound))], cumulative))
+                ret.append((self.name + "_sum", labels, total))
+                ret.append((self.name + "_count", labels, count))
+        return ret
+
+
+class Registry:
+    """
+    Collects all metrics and renders them in the Prometheus text format.
+    Registering a metric with a name that already exists returns the existing metric.
+
+    >>> registry = Registry()
+    >>> counter = registry.counter("matches_total", "Number of matches")
+    >>> counter is registry.counter("matches_total", "Number of matches")
+    True
+    >>> counter.inc()
+    >>> print(registry.render(), end="")
+    # HELP matches_total Number of matches
+    # TYPE matches_total counter
+    matches_total 1
+    >>> # a worker process sends its metrics to the main process
+    >>> worker = Registry()
+    >>> worker.counter("matches_total", "Number of matches").inc(2)
+    >>> worker.histogram("stage_seconds", "Runtime of a stage", "stage", buckets=(0.1, 1)).observe(0.5, "hmm")
+    >>> drained = worker.drain(["matches_total", "stage_seconds"])
+    >>> worker.drain(["matches_total", "stage_seconds"])
+    {}
+    >>> histogram = registry.histogram("stage_seconds", "Runtime of a stage", "stage", buckets=(0.1, 1))
+    >>> registry.merge(drained)
+    >>> counter.get(), histogram.get_count("hmm")
+    (3, 1)
+    """
+
+    __slots__ = ["_metrics", "_lock"]
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                existing = self._metrics[metric.name]
+                if type(existing) is not type(metric):
+                    raise ValueError(f"metric {metric.name} is already registered as {existing.kind}")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, label_name: str = None) -> Counter:
+        return self.register(Counter(name, documentation, label_name))
+
+    def gauge(self, name: str, documentation: str, label_name: str = None, function: Callable = None) -> Gauge:
+        return self.register(Gauge(name, documentation, label_name, function))
+
+    def histogram(self, name: str, documentation: str, label_name: str = None,
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_name, buckets))
+
+    def drain(self, names) -> dict:
+        """
+        Returns {name: values} of the counters and histograms with the given names and resets them.
+        Used by worker processes to send the metrics they recorded since the last call to the main process,
+        which adds them to its own registry with merge.
+        """
+        with self._lock:
+            metrics = [self._metrics[name] for name in names if name in self._metrics]
+        return {metric.name: values for metric in metrics for values in [metric.drain()] if values}
+
+    def merge(self, drained: dict):
+        """
+        Adds the values of drain() of another process, the metrics have to be registered in both processes
+        """
+        with self._lock:
+            metrics = [(self._metrics[name], values) for name, values in drained.items() if name in self._metrics]
+        for metric, values in metrics:
+            metric.merge(values)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# registry of the running process, rendered by the /metrics endpoint
+REGISTRY = Registry()
@@ -17,9 +17,27 @@ def get_config(file_name: str = r"../config.yml", dev_tools: bool = False) -> di
     """
     # values to check, if they do not exist, but are needed, use given default values
     config_all = {"CITY": "Freiburg", "PREFER_LAST_TRIP": False, "BASELINE": False, "BASELINE_HMM": False,
-                  "TIME_AFTER": False, "SLACK": 0.2, "EARLINESS": 1, "DELAY": 5}
+                  "TIME_AFTER": False, "SLACK": 0.2, "EARLINESS": 1, "DELAY": 5,
+                  "CANDIDATE_CACHE_SIZE": 100000, "CANDIDATE_CACHE_QUANTIZED": False,
+                  "CANDIDATE_CACHE_GRID_SIZE": 10, "CANDIDATE_CACHE_TIME_BUCKET": 1,
+                  "TRIP_LOCK": False, "TRIP_LOCK_POINTS": 3, "CASCADE": False,
+                  "WINDOW_POINTS": 0, "WINDOW_SECONDS": 0, "WINDOW_PRIOR_POINTS": 5,
+                  "MATCH_DEADLINE_MS": 0, "DEGRADED_CANDIDATES": 3}
     config_api = {"UPDATE_DICTS": True, "USE_GTFS_RT": False, "UPDATE_GTFS": False, "UPDATE_GTFS_ON_STARTUP": False,
-                  "UPDATE_TIME": "00:00:00", "UPDATE_FREQUENCY": 7, "DEBUG": False}
+                  "UPDATE_TIME": "00:00:00", "UPDATE_FREQUENCY": 7, "DEBUG": False,
+                  "PROFILE_ON_HEADER": False, "PROFILE_SAMPLE_RATE": 0, "PROFILE_DIRECTORY": "../profiles",
+                  "PROFILE_MAX_FILES": 100, "MEMORY_REPORT_ENDPOINT": False,
+                  "TRACE_SAMPLE_RATE": 0, "TRACE_DIRECTORY": "../traces", "TRACE_MAX_MEGABYTES": 50,
+                  "TRACE_MAX_FILES": 20, "ASYNC_WORKERS": 0, "ASYNC_MAX_PENDING_PER_WORKER": 2,
+                  "MATCH_SESSIONS_MAX": 5000, "MATCH_SESSION_MAX_POINTS": 100, "MATCH_MAX_DEADLINE_MS": 10000,
+                  "CHAT_MAX_MESSAGES": 200, "CHAT_MAX_MESSAGE_LENGTH": 1000, "CHAT_MAX_WAIT_SECONDS": 25,
+                  "ADMISSION_CONTROL": False, "ADMISSION_MAX_CONCURRENT": 8,
+                  "ADMISSION_LIMITS": {"/map-match": 4, "/shapes": 4, "/connections": 4, "/journeys": 2,
+                                       "/search-stops": 4, "/nearby-stops": 4,
+                                       "/chat": 8},
+                  "ADMISSION_QUEUE_SIZE": 64, "ADMISSION_MAX_WAIT_MS": 2000,
+                  "SHAPE_CACHE_SIZE": 1000, "SHAPES_MAX_AGE": 3600, "CONNECTIONS_CACHE_SIZE": 10000,
+                  "JOURNEYS": True, "JOURNEYS_TRANSFER_SECONDS": 120, "JOURNEYS_MAX_TRANSFERS": 5}
     config_dev = {"SERVER_ADDRESS": "localhost", "SERVER_PORT": 5000,
                   "PROXY_ADDRESS": "localhost", "PROXY_PORT": 5001,
                   "DEVTOOL_PORT": 21698, "NEW_GTFS": True}
@@ -0,0 +1,359 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+Round-based public transit routing (RAPTOR, Delling et al. 2012) on the timetable of the GTFSContainer.
+The trips are grouped into route patterns, trips of a route with the same stops that do not overtake each other,
+with the arrival and departure seconds of every stop in compact arrays.
+Round k scans every pattern that serves a stop improved in round k - 1 once and finds the earliest arrivals
+with k - 1 transfers, so a query touches only the reachable part of the timetable.
+
+Answers earliest arrival journeys between two stop names (used by /journeys) and
+the stops that are reachable within a number of minutes and transfers.
+"""
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, date
+from typing import Dict, List, Optional, Tuple
+
+from pytz import timezone as pytz_timezone
+
+import Utilities as Utils
+
+# seconds to change between the platforms (stop_ids) of the same stop name
+TRANSFER_SECONDS = 120
+# trips of the service day before run after midnight (e.g. "25:30:00"), trips of the next day after a late query
+DAY_OFFSETS = (-1, 0, 1)
+DAY_SECONDS = 24 * 60 * 60
+INFINITY = float("inf")
+
+
+class RoutePattern:
+    """
+    Trips of a route that stop at the same stops in the same order and do not overtake each other,
+    so the trips are sorted by their departure at every stop.
+
+    >>> pattern = RoutePattern("route", [0, 1])
+    >>> pattern.append("trip 1", "service", [600, 900], [600, 960])
+    >>> pattern.can_append([1200, 1500], [1200, 1500]), pattern.can_append([660, 840], [660, 840])
+    (True, False)
+    >>> pattern.departures[1]
+    array('l', [960])
+    """
+
+    __slots__ = ["route_id", "stops", "trip_ids", "service_ids", "arrivals", "departures"]
+
+    def __init__(self, route_id: str, stops: List[int]):
+        self.route_id = route_id
+        # stop indices of the Raptor
+        self.stops = stops
+        self.trip_ids = []
+        self.service_ids = []
+        # for every stop of the pattern: array of the seconds of every trip since the start of its service day
+        self.arrivals = [array("l") for _ in stops]
+        self.departures = [array("l") for _ in stops]
+
+    def can_append(self, arrivals: List[int], departures: List[int]) -> bool:
+        """
+        The trip does not overtake the last trip of the pattern
+        """
+        if not self.trip_ids:
+            return True
+        return all(arrival >= self.arrivals[i][-1] and departure >= self.departures[i][-1]
+                   for i, (arrival, departure) in enumerate(zip(arrivals, departures)))
+
+    def append(self, trip_id: str, service_id: str, arrivals: List[int], departures: List[int]):
+        self.trip_ids.append(trip_id)
+        self.service_ids.append(service_id)
+        for i, (arrival, departure) in enumerate(zip(arrivals, departures)):
+            self.arrivals[i].append(arrival)
+            self.departures[i].append(departure)
+
+
+class Raptor:
+    """
+    Timetable of a GTFSContainer for RAPTOR queries.
+    Built once from the container, the queries do not change it and can run in multiple threads.
+    """
+
+    def __init__(self, container, timezone: str = "Europe/Berlin", transfer_seconds: int = TRANSFER_SECONDS):
+        """
+        Input:
+            container: the GTFSContainer with the timetable
+            timezone: timezone of the GTFS times, used for the timestamps of the answers
+            transfer_seconds: time to change between the platforms of a stop name
+        """
+        self.container = container
+        self.timezone = pytz_timezone(timezone)
+        # stop index -> stop_id and back
+        self.stop_ids = []
+        self.stop_index = {}
+        self.patterns = []
+        # for every stop index: [(pattern index, position of the stop in the pattern)]
+        self.stop_patterns = []
+        # for every stop index: [(stop index, seconds)] to the other platforms of the stop name
+        self.transfers = []
+        self._build(transfer_seconds)
+
+    def _get_stop_index(self, stop_id: str) -> int:
+        if stop_id not in self.stop_index:
+            self.stop_index[stop_id] = len(self.stop_ids)
+            self.stop_ids.append(stop_id)
+            self.stop_patterns.append([])
+            self.transfers.append([])
+        return self.stop_index[stop_id]
+
+    def _build(self, transfer_seconds: int):
+        """
+        Groups the trips of the container into route patterns
+        """
+        container = self.container
+        # {(route_id, stop indices): [(first departure, trip_id, arrivals, departures)]}
+        trips_of_stop_sequence = {}
+        stop_times_of_trips = container.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict
+        for trip_id, (route_id, stop_times) in stop_times_of_trips.items():
+            if len(stop_times) < 2:
+                continue
+            stops = tuple(self._get_stop_index(stop_id) for _, _, stop_id in stop_times)
+            arrivals = [Utils.time_tuple_to_seconds(arrival) for arrival, _, _ in stop_times]
+            departures = [Utils.time_tuple_to_seconds(departure) for _, departure, _ in stop_times]
+            trips_of_stop_sequence.setdefault((route_id, stops), []).append(
+                (departures[0], trip_id, arrivals, departures))
+
+        for (route_id, stops), trips in trips_of_stop_sequence.items():
+            trips.sort(key=lambda trip: trip[0])
+            patterns = []
+            for _, trip_id, arrivals, departures in trips:
+                # a trip that overtakes another one starts a new pattern
+                pattern = next((pattern for pattern in patterns if pattern.can_append(arrivals, departures)), None)
+                if pattern is None:
+                    pattern = RoutePattern(route_id, list(stops))
+                    patterns.append(pattern)
+                service_id = container.trip_id_to_trip_with_stops_dict[trip_id].service_id
+                pattern.append(trip_id, service_id, arrivals, departures)
+
+            for pattern in patterns:
+                pattern_index = len(self.patterns)
+                self.patterns.append(pattern)
+                for position, stop in enumerate(pattern.stops):
+                    # a pattern that visits a stop twice is boarded at its first visit
+                    if not self.stop_patterns[stop] or self.stop_patterns[stop][-1][0] != pattern_index:
+                        self.stop_patterns[stop].append((pattern_index, position))
+
+        for stop_ids in container.stop_name_to_list_of_stop_ids_dict.values():
+            platforms = [self.stop_index[stop_id] for stop_id in stop_ids if stop_id in self.stop_index]
+            for stop in platforms:
+                self.transfers[stop] = [(other, transfer_seconds) for other in platforms if other != stop]
+
+    def get_stops(self, stop_name: str) -> List[int]:
+        """
+        Stop indices of the platforms of a stop name, [] if no trip stops there
+        """
+        stop_ids = self.container.stop_name_to_list_of_stop_ids_dict.get(stop_name, [])
+        return [self.stop_index[stop_id] for stop_id in stop_ids if stop_id in self.stop_index]
+
+    def _earliest_trip(self, pattern: RoutePattern, position: int, time: float, day: date,
+                       active: dict) -> Optional[Tuple[int, int]]:
+        """
+        The trip of the pattern that departs first at the stop of the position, at or after time
+        (seconds since the start of day). Only trips whose service runs on their service day.
+        Returns: (trip index, shift of the service day in seconds), None if there is none
+        """
+        best, best_departure = None, INFINITY
+        departures = pattern.departures[position]
+        for offset in DAY_OFFSETS:
+            shift = offset * DAY_SECONDS
+            service_day = day + timedelta(days=offset)
+            # binary search, the departures of the pattern are sorted
+            for trip in range(bisect_left(departures, time - shift), len(departures)):
+                if departures[trip] + shift >= best_departure:
+                    break
+                service_id = pattern.service_ids[trip]
+                if (service_id, service_day) not in active:
+                    active[(service_id, service_day)] = self.container.is_service_active(service_id, service_day)
+                if active[(service_id, service_day)]:
+                    best, best_departure = (trip, shift), departures[trip] + shift
+                    break
+        return best
+
+    def _run(self, sources: Dict[int, float], day: date, max_rounds: int, cutoff: float = INFINITY,
+             targets: List[int] = ()) -> Tuple[List[dict], List[dict]]:
+        """
+        The RAPTOR rounds.
+        Input:
+            sources: {stop index: departure in seconds since the start of day}
+            day: the day of the query
+            max_rounds: number of trips of a journey, max transfers + 1
+            cutoff: arrivals after cutoff seconds are ignored
+            targets: stop indices, arrivals later than the best arrival at a target are ignored
+        Returns: (labels, parents) for every round, cumulative
+            labels: {stop index: earliest arrival in seconds since the start of day}
+            parents: {stop index: None for a source, ("transfer", stop index) or
+                ("trip", pattern index, trip index, shift, board position, alight position)}
+        """
+        labels = dict(sources)
+        parents = {stop: None for stop in sources}
+        for stop, time in sources.items():
+            for other, seconds in self.transfers[stop]:
+                if time + seconds < labels.get(other, INFINITY) and time + seconds <= cutoff:
+                    labels[other] = time + seconds
+                    parents[other] = ("transfer", stop)
+        all_labels, all_parents = [labels], [parents]
+        # earliest arrival at any stop and at a target, over all rounds
+        best = dict(labels)
+        targets = set(targets)
+        best_target = cutoff
+        marked = set(labels)
+        # cache of TripWithStopsAndTimes activity checks of this query
+        active = {}
+
+        for _ in range(max_rounds):
+            previous = all_labels[-1]
+            labels, parents = dict(previous), dict(all_parents[-1])
+
+            # the first position of every pattern that serves a marked stop
+            queue = {}
+            for stop in marked:
+                for pattern_index, position in self.stop_patterns[stop]:
+                    if position < queue.get(pattern_index, len(self.patterns[pattern_index].stops)):
+                        queue[pattern_index] = position
+            improved, marked = marked, set()
+
+            for pattern_index, first_position in queue.items():
+                pattern = self.patterns[pattern_index]
+                # (trip index, shift, board position)
+                trip = None
+                for position in range(first_position, len(pattern.stops)):
+                    stop = pattern.stops[position]
+                    if trip is not None:
+                        arrival = pattern.arrivals[position][trip[0]] + trip[1]
+                        if arrival < best.get(stop, INFINITY) and arrival <= best_target:
+                            labels[stop] = best[stop] = arrival
+                            if stop in targets:
+                                best_target = arrival
+                            parents[stop] = ("trip", pattern_index, trip[0], trip[1], trip[2], position)
+                            marked.add(stop)
+
+                    # board an earlier trip if the stop was reached before it departs,
+                    # the trips from stops that did not improve were boarded in an earlier round already
+                    if stop in improved and previous[stop] < best_target and (
+                            trip is None or previous[stop] < pattern.departures[position][trip[0]] + trip[1]):
+                        earliest = self._earliest_trip(pattern, position, previous[stop], day, active)
+                        if earliest is not None:
+                            trip = earliest + (position,)
+
+            # change the platform
+            for stop in list(marked):
+                for other, seconds in self.transfers[stop]:
+                    time = labels[stop] + seconds
+                    if time < best.get(other, INFINITY) and time <= best_target:
+                        labels[other] = best[other] = time
+                        if other in targets:
+                            best_target = time
+                        parents[other] = ("transfer", stop)
+                        marked.add(other)
+
+            all_labels.append(labels)
+            all_parents.append(parents)
+            if not marked:
+                break
+
+        return all_labels, all_parents
+
+    def _to_timestamp(self, day: date, seconds: float) -> int:
+        """
+        Epoch timestamp in milliseconds of seconds since the start of the local day
+        """
+        local_time = datetime.combine(day, datetime.min.time()) + timedelta(seconds=seconds)
+        return int(self.timezone.localize(local_time).timestamp() * 1000)
+
+    def _legs(self, parents: List[dict], rounds: int, stop: int, day: date) -> List[dict]:
+        """
+        The trips of the journey to the stop, which arrives there in round rounds
+        """
+        container = self.container
+        legs = []
+        parent = parents[rounds][stop]
+        while parent is not None:
+            if parent[0] == "transfer":
+                stop = parent[1]
+            else:
+                _, pattern_index, trip, shift, board, alight = parent
+                pattern = self.patterns[pattern_index]
+                trip_id = pattern.trip_ids[trip]
+                route_short_name, route_type, route_color, route_text_color = \
+                    container.route_id_to_route_information_dict[pattern.route_id]
+                alight_stop, stop = stop, pattern.stops[board]
+                legs.append({
+                    "trip_id": trip_id,
+                    "route_short_name": route_short_name,
+                    "route_type": str(route_type),
+                    "route_color": route_color,
+                    "route_text_color": route_text_color,
+                    "destination": container.get_destination(trip_id),
+                    "from_stop_name": container.stop_id_to_stop_information_dict[self.stop_ids[stop]][0],
+                    "departure": self._to_timestamp(day, pattern.departures[board][trip] + shift),
+                    "to_stop_name": container.stop_id_to_stop_information_dict[self.stop_ids[alight_stop]][0],
+                    "arrival": self._to_timestamp(day, pattern.arrivals[alight][trip] + shift),
+                })
+                rounds -= 1
+            parent = parents[rounds][stop]
+        legs.reverse()
+        return legs
+
+    def earliest_arrival(self, from_stop_name: str, to_stop_name: str, time: datetime,
+                         max_transfers: int = 3) -> List[dict]:
+        """
+        Journeys from a stop name to another one, departing after time (local time of the GTFS feed).
+        Returns one journey for every number of transfers that arrives earlier than the journeys with fewer
+        transfers (Pareto optimal), sorted by the number of transfers:
+            [{"departure": epoch ms, "arrival": epoch ms, "transfers": int, "legs": [trip, ...]}]
+        """
+        sources, targets = self.get_stops(from_stop_name), self.get_stops(to_stop_name)
+        if not sources or not targets or from_stop_name == to_stop_name:
+            return []
+
+        day = time.date()
+        start = (time - datetime.combine(day, datetime.min.time())).total_seconds()
+        labels, parents = self._run({stop: start for stop in sources}, day, max_transfers + 1, targets=targets)
+
+        journeys = []
+        best_arrival = INFINITY
+        for rounds in range(1, len(labels)):
+            arrival, target = min((labels[rounds].get(target, INFINITY), target) for target in targets)
+            if arrival >= best_arrival:
+                continue
+            best_arrival = arrival
+            legs = self._legs(parents, rounds, target, day)
+            journeys.append({"departure": legs[0]["departure"], "arrival": legs[-1]["arrival"],
+                             "transfers": len(legs) - 1, "legs": legs})
+        return journeys
+
+    def reachable_stops(self, from_stop_name: str, time: datetime, max_minutes: int = 30,
+                        max_transfers: int = 1) -> Dict[str, dict]:
+        """
+        The stop names that are reachable from a stop name within max_minutes after time,
+        with at most max_transfers transfers.
+        Returns: {stop_name: {"arrival": epoch ms, "transfers": int, "lat": float, "lon": float}}
+        """
+        sources = self.get_stops(from_stop_name)
+        if not sources:
+            return {}
+
+        day = time.date()
+        start = (time - datetime.combine(day, datetime.min.time())).total_seconds()
+        labels, _ = self._run({stop: start for stop in sources}, day, max_transfers + 1,
+                              cutoff=start + max_minutes * 60)
+
+        reachable = {}
+        for rounds in range(1, len(labels)):
+            for stop, arrival in labels[rounds].items():
+                if stop in sources:
+                    continue
+                stop_name, lat, lon = self.container.stop_id_to_stop_information_dict[self.stop_ids[stop]]
+                if stop_name == from_stop_name:
+                    continue
+                arrival = self._to_timestamp(day, arrival)
+                if stop_name not in reachable or arrival < reachable[stop_name]["arrival"]:
+                    reachable[stop_name] = {"arrival": arrival, "transfers": rounds - 1, "lat": lat, "lon": lon}
+        return reachable
@@ -0,0 +1,114 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+Compact table of the realtime delays of a trip, built from the stop time updates of the GTFS-RT feed.
+The delays are propagated to the following stops when the table is built, as in the GTFS-RT specification:
+a stop without an update has the delay of the stop before it. The matcher reads the delay of a stop from an array,
+instead of going through the updates of the trip on every check.
+"""
+from array import array
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional, Tuple
+
+import Utilities as Utils
+
+
+def delay_of_time(predicted: int, scheduled: Tuple[datetime, bool], service_date: Optional[date] = None,
+                  timezone: str = "Europe/Berlin") -> int:
+    """
+    Delay in seconds of a predicted time at a stop
+    Input:
+        predicted: POSIX time of the feed
+        scheduled: (time on 1900-01-01, True if after midnight of the service day) of the stop times
+        service_date: start_date of the trip, if None the service date closest to the predicted time is used
+
+    >>> scheduled = (datetime(1900, 1, 1, 19, 45), False)
+    >>> delay_of_time(1659030600, scheduled, date(2022, 7, 28))  # 19:50 in Freiburg
+    300
+    >>> delay_of_time(1659030000, scheduled)  # 19:40
+    -300
+    >>> delay_of_time(1659045900, (datetime(1900, 1, 1, 0, 5), True), date(2022, 7, 28))  # 00:05 on the next day
+    0
+    """
+    local = Utils.convert_utc_to_local_time(predicted, timezone)
+    time, after_midnight = scheduled
+    scheduled_seconds = (time - datetime(1900, 1, 1)).total_seconds() + (86400 if after_midnight else 0)
+    dates = [service_date] if service_date else [local.date() + timedelta(days=days) for days in (0, -1, 1)]
+    delays = [(local - datetime.combine(day, datetime.min.time())).total_seconds() - scheduled_seconds
+              for day in dates]
+    return int(min(delays, key=abs))
+
+
+class TripDelays:
+    """
+    Delays in seconds of one trip, by the index of the stop (0 based stop sequence).
+    The trip segment trip_segment_id starts at the stop trip_segment_id and ends at the next stop.
+
+    >>> delays = TripDelays.from_updates([(1, None, 300), (3, 420, 600)], num_stops=6)
+    >>> list(delays.arrival), list(delays.departure)
+    ([0, 0, 300, 420, 600, 600], [0, 300, 300, 600, 600, 600])
+    >>> delays.offset(0), delays.offset(2), delays.offset(9)
+    ((0, 0), (300, 420), (600, 600))
+    >>> delays.distinct_delays
+    (300, 420, 600)
+    """
+
+    __slots__ = ["arrival", "departure", "distinct_delays"]
+
+    def __init__(self, arrival: array, departure: array, distinct_delays: Tuple[int, ...] = None):
+        """
+        Input:
+            arrival, departure: delay in seconds at every stop, the delays are already propagated
+            distinct_delays: the delays of the feed in the order of the stops, by default the delays of the table
+        """
+        self.arrival = arrival
+        self.departure = departure
+        # the delays the trip can have, e.g. to check if it is active
+        if distinct_delays is None:
+            distinct_delays = tuple(dict.fromkeys(delay for pair in zip(arrival, departure) for delay in pair))
+        self.distinct_delays = distinct_delays
+
+    @classmethod
+    def from_updates(cls, updates: Iterable[Tuple[int, Optional[int], Optional[int]]],
+                     num_stops: int = 0) -> "TripDelays":
+        """
+        Input:
+            updates: (index of the stop, arrival delay, departure delay), a delay is None if the feed has none
+            num_stops: number of stops of the trip, the delays are propagated to the last stop
+        The stops before the first update have no delay. A stop without an arrival delay has the departure delay
+        of the stop before it, a stop without a departure delay keeps its arrival delay.
+        """
+        updates = sorted(updates, key=lambda update: update[0])
+        length = max(num_stops, updates[-1][0] + 1 if updates else 0)
+        arrival, departure = array("i", [0]) * length, array("i", [0]) * length
+        current = 0
+        reported = {}
+        updates_iter = iter(updates)
+        update = next(updates_iter, None)
+        for idx in range(length):
+            arrival_delay, departure_delay = None, None
+            # the feed may have several updates for a stop, the last one counts
+            while update is not None and update[0] == idx:
+                arrival_delay = update[1] if update[1] is not None else arrival_delay
+                departure_delay = update[2] if update[2] is not None else departure_delay
+                update = next(updates_iter, None)
+            reported.update((delay, None) for delay in (arrival_delay, departure_delay) if delay is not None)
+            arrival[idx] = current if arrival_delay is None else arrival_delay
+            current = arrival[idx] if departure_delay is None else departure_delay
+            departure[idx] = current
+        return cls(arrival, departure, tuple(reported))
+
+    def __len__(self):
+        return len(self.arrival)
+
+    def offset(self, trip_segment_id: int) -> Tuple[int, int]:
+        """
+        (departure delay at the start, arrival delay at the end of the trip segment) in seconds.
+        The stops after the table have the delay of its last stop.
+        """
+        last = len(self.departure) - 1
+        if last < 0:
+            return 0, 0
+        start = self.departure[min(trip_segment_id, last)]
+        return start, self.arrival[trip_segment_id + 1] if trip_segment_id < last else start
@@ -0,0 +1,353 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+Parses the requests of the frontend and builds the answers, shared by API.py and AsyncAPI.py.
+"""
+from hashlib import sha1
+from typing import List, Optional, Tuple
+
+from Utilities import convert_utc_to_local_time, delta_encode, encode_polyline
+
+# encodings of the coordinates in the answer of /shapes, None are lists of [lat, lon]
+SHAPE_ENCODINGS = (None, "polyline", "delta")
+# first second of the year 10000, later times can not be converted to local times
+MAX_UNIX_TIME = 253402300800
+
+
+def parse_deadline_ms(value, max_deadline_ms: float = 0) -> Optional[float]:
+    """
+    Latency budget of a request in milliseconds, clamped to max_deadline_ms if it is not 0.
+    A budget of 0 means no deadline, it is max_deadline_ms if there is a maximum.
+    Returns: the budget, None if it is not a number or negative
+
+    >>> parse_deadline_ms("250"), parse_deadline_ms(0), parse_deadline_ms(60000, max_deadline_ms=5000)
+    (250.0, 0.0, 5000)
+    >>> parse_deadline_ms(0, max_deadline_ms=5000)
+    5000
+    >>> parse_deadline_ms([]), parse_deadline_ms("fast"), parse_deadline_ms(-1), parse_deadline_ms("nan")
+    (None, None, None, None)
+    """
+    try:
+        deadline_ms = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not deadline_ms >= 0:
+        return None
+    if max_deadline_ms and (deadline_ms == 0 or deadline_ms > max_deadline_ms):
+        return max_deadline_ms
+    return deadline_ms
+
+
+def parse_map_match_request(req: dict, max_deadline_ms: float = 0) -> Optional[Tuple[List[list], str, Optional[float]]]:
+    """
+    Input:
+        max_deadline_ms: maximum of the optional latency budget "deadline_ms" of the request, 0 for no maximum
+    Returns: (route [[lat, lon, unix time in seconds], ...], trip_id, deadline_ms)
+        the route is empty if the request has no coordinates, deadline_ms is None if the request has none
+        None if deadline_ms is invalid
+
+    >>> parse_map_match_request({"coordinates": ["47.9, 7.8, 1663256580000"], "trip_id": "1"})
+    ([[47.9, 7.8, 1663256580]], '1', None)
+    >>> parse_map_match_request({"coordinates": [], "trip_id": "1", "deadline_ms": "100"}, max_deadline_ms=50)
+    ([], '1', 50)
+    >>> parse_map_match_request({"coordinates": [], "trip_id": "1", "deadline_ms": []}) is None
+    True
+    """
+    route = []
+    for coord in req["coordinates"]:
+        coord = coord.split(',')
+        # lat, lon, time, convert from milliseconds to seconds unix time
+        route.append([float(coord[0]), float(coord[1]), int(coord[2]) // 1000])
+
+    # optional latency budget of the request in milliseconds
+    deadline_ms = req.get("deadline_ms")
+    if deadline_ms is not None:
+        deadline_ms = parse_deadline_ms(deadline_ms, max_deadline_ms)
+        if deadline_ms is None:
+            return None
+    return route, req["trip_id"], deadline_ms
+
+
+def parse_match_session_message(
+        message, max_deadline_ms: float = 0) -> Optional[Tuple[List[list], Optional[str], Optional[float]]]:
+    """
+    A message of a /map-match/ws session: {"coordinates": [new GPS fixes], "trip_id": optional, "deadline_ms": optional}
+    The GPS fixes are in the format of /map-match, but only the ones the client has not sent yet.
+    Returns: (new route points, trip_id or None, deadline_ms), None if the message is invalid
+
+    >>> parse_match_session_message({"coordinates": ["47.9, 7.8, 1663256580000"]})
+    ([[47.9, 7.8, 1663256580]], None, None)
+    >>> parse_match_session_message({"coordinates": ["47.9"]}), parse_match_session_message(["47.9, 7.8, 0"])
+    (None, None)
+    >>> parse_match_session_message({"coordinates": [1]}), parse_match_session_message({"coordinates": ["a, b, c"]})
+    (None, None)
+    >>> parse_match_session_message({"coordinates": [], "deadline_ms": "soon"}) is None
+    True
+    >>> parse_match_session_message({"coordinates": [], "trip_id": 7}) is None
+    True
+    >>> parse_match_session_message({"coordinates": ["nan, 7.8, 0"]}) is None
+    True
+    >>> parse_match_session_message({"coordinates": ["47.9, 7.8, 99999999999999999999"]}) is None
+    True
+    """
+    if not isinstance(message, dict) or not isinstance(message.get("coordinates"), list):
+        return None
+    if not isinstance(message.get("trip_id"), (str, type(None))):
+        return None
+    try:
+        parsed = parse_map_match_request(dict(message, trip_id=message.get("trip_id")), max_deadline_ms)
+    except (AttributeError, IndexError, ValueError):
+        return None
+    # the fixes stay in the session, a fix the matcher cannot use would break the following matches
+    if parsed is None or not all(-90 <= lat <= 90 and -180 <= lon <= 180 and 0 <= tim < MAX_UNIX_TIME
+                                 for lat, lon, tim in parsed[0]):
+        return None
+    return parsed
+
+
+def parse_connections_request(req: dict, timezone: str):
+    """
+    Returns: (next_stop_name, local user time as datetime, trip_id)
+        None if the request is invalid, "" if the next stop or the time are not known yet
+
+    >>> parse_connections_request({"next_stop_name": "next stop"}, "Europe/Berlin") is None
+    True
+    >>> parse_connections_request({"next_stop_name": "", "user_time": ""}, "Europe/Berlin")
+    ''
+    >>> parse_connections_request(
+    ...     {"next_stop_name": "Hbf", "user_time": "1663256580000", "trip_id": "1"}, "Europe/Berlin")[1].hour
+    17
+    """
+    if not req or req['next_stop_name'] == 'next stop':
+        return None
+
+    if req['next_stop_name'] == "" or req['user_time'] == "":
+        return ""
+
+    user_time = int(req['user_time']) // 1000
+    return req['next_stop_name'], convert_utc_to_local_time(user_time, timezone_name=timezone), req['trip_id']
+
+
+def parse_journeys_request(req: dict, timezone: str, max_transfers: int = 5, max_minutes: int = 180):
+    """
+    Returns: (from_stop_name, to_stop_name, local user time as datetime, transfers, minutes)
+        to_stop_name is None if the reachable stops are requested
+        None if the request is invalid
+
+    >>> parse_journeys_request({"from_stop_name": "Hbf", "to_stop_name": "Messe", "user_time": "1663256580000"},
+    ...                        "Europe/Berlin")[3:]
+    (3, 30)
+    >>> parse_journeys_request({"from_stop_name": "Hbf", "user_time": "1663256580000", "max_transfers": 9,
+    ...                         "max_minutes": "60"}, "Europe/Berlin")[3:]
+    (5, 60)
+    >>> parse_journeys_request({"from_stop_name": "Hbf", "user_time": ""}, "Europe/Berlin") is None
+    True
+    """
+    if not req or not req.get("from_stop_name") or not req.get("user_time"):
+        return None
+    try:
+        user_time = int(req["user_time"]) // 1000
+        transfers = min(int(req.get("max_transfers", 3)), max_transfers)
+        minutes = min(int(req.get("max_minutes", 30)), max_minutes)
+    except (TypeError, ValueError):
+        return None
+    if transfers < 0 or minutes <= 0:
+        return None
+    return (req["from_stop_name"], req.get("to_stop_name") or None,
+            convert_utc_to_local_time(user_time, timezone_name=timezone), transfers, minutes)
+
+
+def parse_stop_search_request(req, max_limit: int = 50) -> Optional[Tuple[str, int]]:
+    """
+    req: the JSON body or the query parameters of a GET request
+    Returns: (query, limit), None if the request is invalid
+
+    >>> parse_stop_search_request({"query": "Freiburg Hb"})
+    ('Freiburg Hb', 10)
+    >>> parse_stop_search_request({"query": "Messe", "limit": "100"})
+    ('Messe', 50)
+    >>> parse_stop_search_request({"query": " "}) is None, parse_stop_search_request({"query": "a", "limit": "x"})
+    (True, None)
+    """
+    if not req or not str(req.get("query", "")).strip():
+        return None
+    try:
+        limit = min(int(req.get("limit", 10)), max_limit)
+    except (TypeError, ValueError):
+        return None
+    if limit <= 0:
+        return None
+    return str(req["query"]), limit
+
+
+def stops_to_dict(stops: List[Tuple[str, float, float]]) -> dict:
+    """
+    Answer of /search-stops: {"stops": [{"stop_name": ..., "lat": ..., "lon": ...}], "length": number of stops}
+
+    >>> stops_to_dict([("Freiburg, Hauptbahnhof", 47.99, 7.84)])
+    {'stops': [{'stop_name': 'Freiburg, Hauptbahnhof', 'lat': 47.99, 'lon': 7.84}], 'length': 1}
+    """
+    return {"stops": [{"stop_name": name, "lat": lat, "lon": lon} for name, lat, lon in stops],
+            "length": len(stops)}
+
+
+def parse_nearby_stops_request(req, max_limit: int = 50, max_radius: float = 5000) -> Optional[tuple]:
+    """
+    req: the JSON body or the query parameters of a GET request
+    Returns: (lat, lon, limit, radius in meters), None if the request is invalid
+
+    >>> parse_nearby_stops_request({"lat": "47.9957", "lon": "7.8412"})
+    (47.9957, 7.8412, 10, 1000.0)
+    >>> parse_nearby_stops_request({"lat": 47.9957, "lon": 7.8412, "limit": 100, "radius": 10000})
+    (47.9957, 7.8412, 50, 5000)
+    >>> parse_nearby_stops_request({"lat": 91, "lon": 7.8412}) is None, parse_nearby_stops_request({"lat": 47.9})
+    (True, None)
+    >>> parse_nearby_stops_request({"lat": 47.9957, "lon": 7.8412, "radius": "nan"}) is None
+    True
+    """
+    if not req or "lat" not in req or "lon" not in req:
+        return None
+    try:
+        lat, lon = float(req["lat"]), float(req["lon"])
+        limit = min(int(req.get("limit", 10)), max_limit)
+        radius = float(req.get("radius", 1000))
+    except (TypeError, ValueError):
+        return None
+    # NaN is not comparable, so the ranges are checked with "not"
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180 or limit <= 0 or not radius > 0:
+        return None
+    return lat, lon, limit, min(radius, max_radius)
+
+
+def nearby_stops_to_dict(stops: List[Tuple[str, str, float, float, float]]) -> dict:
+    """
+    Answer of /nearby-stops: {"stops": [{"stop_id", "stop_name", "lat", "lon", "distance"}], "length": ...}
+    The distances are rounded to meters.
+
+    >>> nearby_stops_to_dict([("1", "Freiburg, Hauptbahnhof", 47.99, 7.84, 12.3)])["stops"]
+    [{'stop_id': '1', 'stop_name': 'Freiburg, Hauptbahnhof', 'lat': 47.99, 'lon': 7.84, 'distance': 12}]
+    """
+    return {"stops": [{"stop_id": stop_id, "stop_name": name, "lat": lat, "lon": lon, "distance": round(distance)}
+                      for stop_id, name, lat, lon, distance in stops],
+            "length": len(stops)}
+
+
+def parse_shapes_request(req) -> Optional[tuple]:
+    """
+    req: the JSON body or the query parameters of a GET request
+    Returns: (shape_id, trip_id, zoom, tolerance, encoding, precision), None if the request is invalid
+        zoom and tolerance (meters) are None if the full polyline is requested
+
+    >>> parse_shapes_request({"shape_id": "shp_0_573", "trip_id": "1"})
+    ('shp_0_573', '1', None, None, None, 5)
+    >>> parse_shapes_request({"shape_id": "shp_0_573", "trip_id": "1", "zoom": "12", "encoding": "polyline"})
+    ('shp_0_573', '1', 12, None, 'polyline', 5)
+    >>> parse_shapes_request({"shape_id": "shp_0_573", "trip_id": "1", "encoding": "gzip"}) is None
+    True
+    """
+    if not req or "shape_id" not in req or "trip_id" not in req:
+        return None
+    try:
+        zoom = int(req["zoom"]) if req.get("zoom") is not None else None
+        tolerance = float(req["tolerance"]) if req.get("tolerance") is not None else None
+        precision = int(req.get("precision", 5))
+    except ValueError:
+        return None
+    encoding = req.get("encoding")
+    if encoding not in SHAPE_ENCODINGS or not 0 <= precision <= 7:
+        return None
+    return req["shape_id"], req["trip_id"], zoom, tolerance, encoding, precision
+
+
+def shape_to_dict(polyline: list, stops: list, encoding: Optional[str] = None, precision: int = 5) -> dict:
+    """
+    Answer of /shapes: {"polyline": ..., "stops": ...}
+    With an encoding, both are encoded and the answer contains the encoding and the precision.
+
+    >>> shape_to_dict([(38.5, -120.2), (40.7, -120.95)], [(38.5, -120.2)])
+    {'polyline': [(38.5, -120.2), (40.7, -120.95)], 'stops': [(38.5, -120.2)]}
+    >>> shape_to_dict([(38.5, -120.2), (40.7, -120.95)], [(38.5, -120.2)], encoding="polyline")["polyline"]
+    '_p~iF~ps|U_ulLnnqC'
+    >>> shape_to_dict([(38.5, -120.2), (40.7, -120.95)], [], encoding="delta", precision=1)
+    {'polyline': [385, -1202, 22, -8], 'stops': [], 'encoding': 'delta', 'precision': 1}
+    """
+    if encoding is None:
+        return {"polyline": polyline, "stops": stops}
+    encode = encode_polyline if encoding == "polyline" else delta_encode
+    return {"polyline": encode(polyline, precision), "stops": encode(stops, precision),
+            "encoding": encoding, "precision": precision}
+
+
+def shape_etag(version: str, shape_id: str, trip_id: str, *variant) -> str:
+    """
+    ETag of a /shapes answer, changes with the version of the GTFS container
+    variant: e.g. the zoom level and the encoding of the answer
+
+    >>> shape_etag("1663256580", "shp_0_573", "1") == shape_etag("1663256580", "shp_0_573", "1")
+    True
+    >>> shape_etag("1663256580", "shp_0_573", "1") == shape_etag("1663256581", "shp_0_573", "1")
+    False
+    >>> shape_etag("1663256580", "shp_0_573", "1", 12) == shape_etag("1663256580", "shp_0_573", "1", 13)
+    False
+    """
+    key = "/".join(str(part) for part in (version, shape_id, trip_id) + variant)
+    return '"' + sha1(key.encode()).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether the If-None-Match header of a request contains the ETag, i.e. the client can use its cached answer
+
+    >>> etag_matches('"a", W/"b"', '"b"'), etag_matches("*", '"c"'), etag_matches(None, '"a"')
+    (True, True, False)
+    """
+    if not if_none_match:
+        return False
+    # weak comparison, W/"b" matches "b"
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+def parse_chat_poll(req: dict, max_wait: float = 25) -> Optional[Tuple[int, float]]:
+    """
+    The optional long polling fields of a /chat request
+    Returns: (after_id, wait), None if they are invalid
+        after_id: only the messages after this message id are answered, 0 for all messages
+        wait: seconds the request waits for a new message if there is none after after_id, 0 answers at once
+
+    >>> parse_chat_poll({"trip_id": "1"}), parse_chat_poll({"after_id": "12", "wait": 60})
+    ((0, 0.0), (12, 25))
+    >>> parse_chat_poll({"after_id": "x"}) is None, parse_chat_poll({"wait": "nan"}) is None
+    (True, True)
+    """
+    try:
+        after_id = int(req.get("after_id") or 0)
+        wait = float(req.get("wait") or 0)
+    except (TypeError, ValueError):
+        return None
+    # NaN is not comparable, a wait of NaN seconds would never time out
+    if after_id < 0 or not wait >= 0:
+        return None
+    return after_id, min(wait, max_wait)
+
+
+def connections_to_dict(possibilities: list, next_stop_name: str) -> dict:
+    """
+    Answer of /connections: {"0": possibility, ..., "length": number of possibilities}
+    Possibilities that end at the next stop (terminal station) are skipped.
+
+    >>> connections_to_dict([("1", "Hbf", "0", 0, "", ""), ("2", "Messe", "0", 0, "", "")], "Hbf")
+    {'0': ('2', 'Messe', '0', 0, '', ''), 'length': 1}
+    """
+    idx, connections = 0, {}
+    for possibility in possibilities:
+        # Linename: Linedirection: next Times
+        # skip if the destination is the same as next stop (terminal station)
+        if possibility[1] == next_stop_name:
+            continue
+        connections[str(idx)] = possibility
+        idx += 1
+
+    connections['length'] = len(connections)
+    return connections
@@ -0,0 +1,116 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+Profiles single live requests with cProfile, to see where the time of slow trajectories goes.
+"""
+import json
+from cProfile import Profile
+from datetime import datetime
+from io import StringIO
+from os import makedirs, remove
+from os.path import join, isfile, getmtime
+from glob import glob
+from pstats import Stats
+from random import random
+from threading import Lock
+from time import perf_counter
+from uuid import uuid4
+
+
+class RequestProfiler:
+    """
+    A request is profiled, if it asks for it (e.g. with the X-Profile header) or with probability sample_rate.
+    For every profiled request three files are written to directory:
+        <profile_id>.prof: the cProfile stats, e.g. for snakeviz or pstats
+        <profile_id>.txt: the 30 functions with the highest cumulative time
+        <profile_id>.json: the input of the request and the runtime
+    Only the max_profiles newest profiles are kept.
+
+    Non sampled requests only cost a call of random().
+    cProfile can only profile one request at a time, a request that arrives while another one is profiled
+        is not profiled.
+
+    >>> from tempfile import TemporaryDirectory
+    >>> with TemporaryDirectory() as tmp_dir:
+    ...     profiler = RequestProfiler(tmp_dir, sample_rate=0, max_profiles=2)
+    ...     profiler.should_profile(requested=False), profiler.should_profile(requested=True)
+    ...     ids = [profiler.profile(sorted, [3, 1, 2], request_input={"coordinates": []})[1] for _ in range(3)]
+    ...     profiler.profile(sorted, [3, 1, 2])[0]
+    ...     sorted(glob(join(tmp_dir, "*.json"))) == sorted(join(tmp_dir, i + ".json") for i in ids[1:])
+    (False, True)
+    [1, 2, 3]
+    False
+    """
+
+    __slots__ = ["directory", "sample_rate", "max_profiles", "_lock"]
+
+    def __init__(self, directory: str, sample_rate: float = 0, max_profiles: int = 100):
+        """
+        Input:
+            directory: where the profiles are written to, created if it does not exist
+            sample_rate: probability that a request is profiled without asking for it, 0 disables sampling
+            max_profiles: number of profiles that are kept, the oldest ones are removed
+        """
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_profiles = max_profiles
+        self._lock = Lock()
+
+    def should_profile(self, requested: bool = False) -> bool:
+        return requested or (self.sample_rate > 0 and random() < self.sample_rate)
+
+    def profile(self, function, *args, request_input=None, **kwargs):
+        """
+        Calls function(*args, **kwargs) with cProfile.
+
+        Returns: (return value of the function, profile_id)
+            profile_id is "" if another request is profiled at the moment
+        """
+        # only one profiler can be active at a time
+        if not self._lock.acquire(blocking=False):
+            return function(*args, **kwargs), ""
+
+        try:
+            profiler = Profile()
+            start_time = perf_counter()
+            profiler.enable()
+            try:
+                ret = function(*args, **kwargs)
+            finally:
+                profiler.disable()
+            duration = perf_counter() - start_time
+
+            profile_id = datetime.now().strftime("%Y%m%d-%H%M%S-") + uuid4().hex[:8]
+            self.write_profile(profile_id, profiler, duration, request_input)
+        finally:
+            self._lock.release()
+
+        return ret, profile_id
+
+    def write_profile(self, profile_id: str, profiler: Profile, duration: float, request_input):
+        """
+        Used by self.profile. Writes the files of a profile and removes the oldest profiles.
+        """
+        makedirs(self.directory, exist_ok=True)
+        path = join(self.directory, profile_id)
+
+        profiler.dump_stats(path + ".prof")
+
+        stream = StringIO()
+        Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(30)
+        with open(path + ".txt", "w") as f:
+            f.write(stream.getvalue())
+
+        with open(path + ".json", "w") as f:
+            json.dump({"profile_id": profile_id, "duration": duration, "input": request_input}, f, default=str)
+
+        self.remove_old_profiles()
+
+    def remove_old_profiles(self):
+        profiles = sorted(glob(join(self.directory, "*.json")), key=getmtime)
+        for old_profile in profiles[:max(0, len(profiles) - self.max_profiles)]:
+            for ending in (".json", ".prof", ".txt"):
+                file_name = old_profile[:-len(".json")] + ending
+                if isfile(file_name):
+                    remove(file_name)
@@ -0,0 +1,174 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+Uniform grid over points (e.g. the stops of a GTFS feed), built once when the GTFSContainer is loaded.
+Answers k nearest and within radius queries by looking only at the grid cells around the position,
+instead of computing the distance to every stop of the feed.
+"""
+from array import array
+from math import ceil, cos, floor, inf, radians
+from typing import Callable, Hashable, Iterable, List, Optional, Tuple
+
+import Utilities as Utils
+
+# size of a grid cell in meters, about the walking distance to a stop
+CELL_SIZE_METERS = 250
+# 0.00001° ~ 1.112m => meters of one degree latitude
+METERS_PER_DEGREE = 111200
+
+
+class GridIndex:
+    """
+    The cells are CELL_SIZE_METERS high, their width in degrees longitude is chosen at the mean latitude of the points.
+    The distances are great circle distances in meters.
+
+    >>> index = GridIndex([("a", 47.9957, 7.8412), ("b", 47.9975, 7.8430), ("c", 47.9960, 7.8420),
+    ...                    ("d", 47.5596, 7.5886)])
+    >>> [(round(distance), item) for distance, item in index.nearest(47.9957, 7.8413, k=2)]
+    [(7, 'a'), (62, 'c')]
+    >>> [item for _, item in index.within(47.9957, 7.8413, 300)]
+    ['a', 'c', 'b']
+    >>> index.nearest(47.9957, 7.8413, k=1, max_distance=5)
+    []
+    >>> [item for _, item in index.nearest(47.9957, 7.8413, k=1, accept=lambda item: item == "d")]
+    ['d']
+    >>> index.nearest(89.0, 7.8413, k=10, max_distance=5000), index.within(47.9957, -120.0, 1000)
+    ([], [])
+    >>> [item for _, item in index.nearest(89.0, 7.8413, k=1)]
+    ['b']
+    """
+
+    def __init__(self, points: Iterable[Tuple[Hashable, float, float]], cell_size: float = CELL_SIZE_METERS):
+        """
+        Input:
+            points: (item, lat, lon), e.g. (stop_id, stop_lat, stop_lon)
+            cell_size: height of a grid cell in meters
+        """
+        self.items, self.lats, self.lons = [], array("d"), array("d")
+        for item, lat, lon in points:
+            self.items.append(item)
+            self.lats.append(lat)
+            self.lons.append(lon)
+
+        self.cell_size = cell_size
+        self.lat_step = cell_size / METERS_PER_DEGREE
+        mean_lat = sum(self.lats) / len(self.lats) if self.lats else 0
+        self.lon_step = self.lat_step / max(cos(radians(mean_lat)), 0.01)
+
+        # {(row, column): [index of the point]}
+        self.cells = {}
+        for i, (lat, lon) in enumerate(zip(self.lats, self.lons)):
+            self.cells.setdefault(self._cell(lat, lon), []).append(i)
+        # the rows and columns of the cells, the searches only look at cells within them
+        rows = [row for row, _ in self.cells] or [0]
+        columns = [column for _, column in self.cells] or [0]
+        self._bounds = (min(rows), max(rows), min(columns), max(columns))
+        # bounding box of the points
+        self._box = (min(self.lats), max(self.lats), min(self.lons), max(self.lons)) if self.lats else None
+        # the narrowest cell width within the points, the cells get narrower towards the poles
+        self._min_column_width = self._column_width(
+            max(abs(self._box[0]), abs(self._box[1])) + self.lat_step) if self.lats else cell_size
+
+    def __len__(self):
+        return len(self.items)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return floor(lat / self.lat_step), floor(lon / self.lon_step)
+
+    def _column_width(self, lat: float) -> float:
+        """
+        Width of a grid cell in meters at the latitude
+        """
+        return self.lon_step * METERS_PER_DEGREE * cos(radians(min(abs(lat), 89.9)))
+
+    def _distance_to_box(self, lat: float, lon: float) -> float:
+        """
+        Distance in meters from the position to the bounding box of the points, 0 if it is inside.
+        A lower bound of the distance to every point.
+        """
+        if self._box is None:
+            return inf
+        min_lat, max_lat, min_lon, max_lon = self._box
+        box_lat, box_lon = min(max(lat, min_lat), max_lat), min(max(lon, min_lon), max_lon)
+        # the latitude difference alone is a lower bound, the longitude difference shrinks towards the poles
+        return max(abs(lat - box_lat) * METERS_PER_DEGREE,
+                   abs(lon - box_lon) * METERS_PER_DEGREE * cos(radians(min(max(abs(lat), abs(box_lat)), 89.9))))
+
+    def _clipped_cells(self, rows: range, columns: range) -> Iterable[Tuple[int, int]]:
+        """
+        The cells of the rows and columns that lie within the bounds of the grid
+        """
+        min_row, max_row, min_column, max_column = self._bounds
+        return ((r, c) for r in range(max(rows.start, min_row), min(rows.stop, max_row + 1))
+                for c in range(max(columns.start, min_column), min(columns.stop, max_column + 1)))
+
+    def _distances(self, lat: float, lon: float, cells: Iterable[Tuple[int, int]],
+                   accept: Optional[Callable]) -> List[Tuple[float, Hashable]]:
+        found = []
+        for cell in cells:
+            for i in self.cells.get(cell, ()):
+                if accept is None or accept(self.items[i]):
+                    found.append((Utils.great_circle_distance(lat, lon, self.lats[i], self.lons[i]), self.items[i]))
+        return found
+
+    def within(self, lat: float, lon: float, radius: float,
+               accept: Optional[Callable] = None) -> List[Tuple[float, Hashable]]:
+        """
+        Input:
+            lat, lon: the position
+            radius: in meters
+            accept: optional filter of the items, e.g. only the stops of a trip
+        Returns: [(distance in meters, item)] of the points within the radius, the closest first
+        """
+        if self._distance_to_box(lat, lon) > radius:
+            return []
+        row, column = self._cell(lat, lon)
+        rows = ceil(radius / self.cell_size)
+        # the points lie within the box, the narrowest cell width there bounds the number of columns
+        columns = ceil(radius / self._min_column_width)
+        cells = self._clipped_cells(range(row - rows, row + rows + 1), range(column - columns, column + columns + 1))
+        return sorted(match for match in self._distances(lat, lon, cells, accept) if match[0] <= radius)
+
+    def nearest(self, lat: float, lon: float, k: int = 1, max_distance: float = inf,
+                accept: Optional[Callable] = None) -> List[Tuple[float, Hashable]]:
+        """
+        Input:
+            lat, lon: the position
+            k: number of points
+            max_distance: in meters, points further away are not returned
+            accept: optional filter of the items, e.g. only the stops of a trip
+        Returns: [(distance in meters, item)] of the k closest points, the closest first
+        With a filter that accepts few items, give a max_distance, else the rings may cover the whole feed.
+        """
+        if k <= 0 or self._distance_to_box(lat, lon) > max_distance:
+            return []
+        row, column = self._cell(lat, lon)
+        min_row, max_row, min_column, max_column = self._bounds
+        # rings of cells around the cell of the position, every ring is one cell further away
+        # the rings before the first one that reaches the grid are empty, the rings after the last one
+        # that reaches a cell of the grid or a point within max_distance are not needed
+        first_ring = max(min_row - row, row - max_row, min_column - column, column - max_column, 0)
+        last_ring = max(row - min_row, max_row - row, column - min_column, max_column - column, 0)
+        if max_distance < inf:
+            last_ring = min(last_ring, max(ceil(max_distance / self.cell_size),
+                                           ceil(max_distance / self._min_column_width)) + 1)
+        found = []
+        for ring in range(first_ring, last_ring + 1):
+            if ring == 0:
+                cells = [(row, column)]
+            else:
+                columns, inner_rows = range(column - ring, column + ring + 1), range(row - ring + 1, row + ring)
+                # the top and bottom row and the left and right column of the ring
+                cells = [cell for rows, ring_columns in ((range(row - ring, row - ring + 1), columns),
+                                                         (range(row + ring, row + ring + 1), columns),
+                                                         (inner_rows, range(column - ring, column - ring + 1)),
+                                                         (inner_rows, range(column + ring, column + ring + 1)))
+                         for cell in self._clipped_cells(rows, ring_columns)]
+            found += self._distances(lat, lon, cells, accept)
+
+            # every point outside of the rings is further away than the width of the rings
+            covered = ring * min(self.cell_size, self._min_column_width)
+            if covered >= max_distance or (len(found) >= k and sorted(found)[k - 1][0] <= covered):
+                break
+        return [match for match in sorted(found)[:k] if match[0] <= max_distance]
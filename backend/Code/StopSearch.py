@@ -0,0 +1,207 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+Search index over the stop names of a GTFS feed, built once when the GTFSContainer is loaded.
+Autocomplete by prefix of the normalized names and of every word in them (binary search in sorted keys),
+fuzzy matches by shared trigrams ranked by the edit distance.
+Used by /search-stops and to resolve stop names of requests that differ slightly from the feed.
+"""
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+from typing import Iterable, List, Optional, Tuple
+
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+ABBREVIATIONS = {"hbf": "hauptbahnhof", "bf": "bahnhof", "bhf": "bahnhof", "pl": "platz"}
+# a fuzzy match needs at least this similarity (1 - edit distance / length) to resolve a stop name
+MIN_SIMILARITY = 0.75
+# number of trigram candidates that are ranked by the edit distance
+FUZZY_CANDIDATES = 50
+
+
+def normalize_stop_name(name: str) -> str:
+    """
+    Lower case, umlauts and accents replaced, punctuation removed, common abbreviations expanded
+
+    >>> normalize_stop_name("Freiburg, Hbf.")
+    'freiburg hauptbahnhof'
+    >>> normalize_stop_name("Zürich  Stadelhofen/Süd"), normalize_stop_name("Genève-Cornavin")
+    ('zuerich stadelhofen sued', 'geneve cornavin')
+    >>> normalize_stop_name("Basel, Schifflände (Rheinstr.)")
+    'basel schifflaende rheinstrasse'
+    """
+    name = name.lower().translate(UMLAUTS)
+    # remove the accents of the remaining characters, e.g. "è" -> "e"
+    name = "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c))
+    words = []
+    for word in "".join(c if c.isalnum() else " " for c in name).split():
+        word = ABBREVIATIONS.get(word, word)
+        if word.endswith("str") and len(word) > 3:
+            word += "asse"
+        words.append(word)
+    return " ".join(words)
+
+
+def without_city(name: str) -> str:
+    """
+    The stop name without the city prefix, if the feed writes stops as "city, stop"
+
+    >>> without_city("Ettingen, Bahnhof"), without_city("Hauptbahnhof")
+    ('Bahnhof', 'Hauptbahnhof')
+    """
+    return name.split(",", 1)[1].strip() if "," in name else name
+
+
+def trigrams(normalized: str) -> set:
+    """
+    >>> sorted(trigrams("hbf"))
+    ['  h', ' hb', 'bf ', 'hbf']
+    """
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, max_distance: Optional[int] = None) -> int:
+    """
+    Levenshtein distance
+    max_distance: stop early if the distance is larger, then returns max_distance + 1
+
+    >>> edit_distance("bahnhof", "banhof"), edit_distance("", "abc"), edit_distance("messe", "messe")
+    (1, 3, 0)
+    >>> edit_distance("hauptbahnhof", "messeplatz", max_distance=2)
+    3
+    """
+    if max_distance is not None and abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        # the distance is at least the minimum of the row
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class StopSearchIndex:
+    """
+    >>> index = StopSearchIndex(["Freiburg, Hauptbahnhof", "Freiburg, Bertoldsbrunnen", "Basel, Messeplatz",
+    ...                          "Basel, Bahnhof SBB"])
+    >>> index.autocomplete("frei")
+    ['Freiburg, Bertoldsbrunnen', 'Freiburg, Hauptbahnhof']
+    >>> index.autocomplete("hbf"), index.autocomplete("bahn")
+    (['Freiburg, Hauptbahnhof'], ['Basel, Bahnhof SBB'])
+    >>> index.resolve("Freiburg Hbf"), index.resolve("Messeplatz"), index.resolve("Bertholdsbrunnen")
+    ('Freiburg, Hauptbahnhof', 'Basel, Messeplatz', 'Freiburg, Bertoldsbrunnen')
+    >>> index.resolve("Zürich") is None
+    True
+    """
+
+    def __init__(self, stop_names: Iterable[str]):
+        self.stop_names = sorted(set(stop_names))
+        self._stop_name_set = set(self.stop_names)
+        normalized_names = [normalize_stop_name(name) for name in self.stop_names]
+        # sorted (key, index of the stop name): the normalized names and the normalized names from every word on
+        self._names = sorted((normalized, i) for i, normalized in enumerate(normalized_names))
+        self._words = sorted((" ".join(normalized.split()[start:]), i)
+                             for i, normalized in enumerate(normalized_names)
+                             for start in range(1, len(normalized.split())))
+        # {normalized name: [index]}, also without the city prefix
+        short_names = [normalize_stop_name(without_city(name)) for name in self.stop_names]
+        self._exact = {}
+        for i, (normalized, short) in enumerate(zip(normalized_names, short_names)):
+            self._exact.setdefault(normalized, []).append(i)
+            if short != normalized:
+                self._exact.setdefault(short, []).append(i)
+        # {trigram: [index]}
+        self._trigrams = {}
+        for i, normalized in enumerate(normalized_names):
+            for trigram in trigrams(normalized):
+                self._trigrams.setdefault(trigram, []).append(i)
+        self._normalized_names = normalized_names
+        self._short_names = short_names
+
+    def __len__(self):
+        return len(self.stop_names)
+
+    @staticmethod
+    def _prefix_matches(keys: List[Tuple[str, int]], prefix: str) -> Iterable[int]:
+        # binary search for the first key with the prefix, the keys with the prefix follow it
+        for position in range(bisect_left(keys, (prefix, -1)), len(keys)):
+            key, i = keys[position]
+            if not key.startswith(prefix):
+                break
+            yield i
+
+    def autocomplete(self, query: str, limit: int = 10) -> List[str]:
+        """
+        Stop names that start with the query, then stop names with a word that starts with the query.
+        Both in alphabetical order of the normalized names.
+        """
+        prefix = normalize_stop_name(query)
+        if not prefix:
+            return []
+        found = []
+        for keys in (self._names, self._words):
+            for i in self._prefix_matches(keys, prefix):
+                if i not in found:
+                    found.append(i)
+                    if len(found) == limit:
+                        return [self.stop_names[i] for i in found]
+        return [self.stop_names[i] for i in found]
+
+    def fuzzy(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """
+        Stop names similar to the query: the names with the most shared trigrams,
+        ranked by the similarity 1 - edit distance / length
+        Returns: [(stop_name, similarity)], the most similar first
+        """
+        normalized = normalize_stop_name(query)
+        if not normalized:
+            return []
+        # number of shared trigrams of every stop name
+        shared = Counter(chain.from_iterable(self._trigrams.get(trigram, ()) for trigram in trigrams(normalized)))
+
+        ranked = []
+        for i, _ in shared.most_common(FUZZY_CANDIDATES):
+            # only the similarity of the worst of the limit best matches is needed to be better
+            worst = ranked[limit - 1][0] if len(ranked) >= limit else 0
+            similarity = 0
+            # compare with the whole name and with the name without the city
+            for name in (self._normalized_names[i], self._short_names[i]):
+                length = max(len(normalized), len(name))
+                distance = edit_distance(normalized, name, max_distance=int((1 - worst) * length))
+                similarity = max(similarity, 1 - distance / length)
+            if similarity > worst:
+                ranked.append((similarity, self.stop_names[i]))
+                ranked.sort(key=lambda match: (-match[0], match[1]))
+        return [(name, round(similarity, 3)) for similarity, name in ranked[:limit]]
+
+    def search(self, query: str, limit: int = 10) -> List[str]:
+        """
+        Autocomplete, filled up with fuzzy matches, e.g. for typos
+        """
+        found = self.autocomplete(query, limit)
+        if len(found) < limit:
+            found += [name for name, _ in self.fuzzy(query, limit) if name not in found][:limit - len(found)]
+        return found
+
+    def resolve(self, stop_name: str, min_similarity: float = MIN_SIMILARITY) -> Optional[str]:
+        """
+        The stop name of the feed for a stop name that may differ slightly, e.g. in umlauts,
+        punctuation, abbreviations, the city prefix or a typo. None if no stop name is similar enough.
+        """
+        if stop_name in self._stop_name_set:
+            return stop_name
+        exact = self._exact.get(normalize_stop_name(stop_name), [])
+        if exact:
+            # e.g. "Bahnhof" without the city is ambiguous
+            return self.stop_names[exact[0]] if len(exact) == 1 else None
+        matches = self.fuzzy(stop_name, limit=1)
+        if matches and matches[0][1] >= min_similarity:
+            return matches[0][0]
+        return None
@@ -0,0 +1,152 @@
+"""
+Copyright 2022
+Bachelor's thesis by Gerrit Freiwald and Robin Wu
+
+Records sampled requests of the API, to replay them offline, e.g. with Benchmark/LoadTest.py --log.
+"""
+import gzip
+import json
+from datetime import datetime
+from glob import glob
+from os import makedirs, remove
+from os.path import join, getmtime
+from queue import Queue, Full, Empty
+from random import random
+from threading import Thread
+
+# strings in the summary of an answer are cut after this many characters
+MAX_SUMMARY_STRING = 100
+
+
+def summarize_answer(answer) -> dict:
+    """
+    Short version of an answer: scalar values are kept, lists and dicts are replaced by their length.
+
+    >>> summarize_answer({"trip_id": "1.TA", "location": [47.9, 7.8], "length": 0, "degraded": True})
+    {'trip_id': '1.TA', 'location': {'length': 2}, 'length': 0, 'degraded': True}
+    >>> summarize_answer(None)
+    {}
+    """
+    if not isinstance(answer, dict):
+        return {}
+    ret = {}
+    for key, value in answer.items():
+        if isinstance(value, str):
+            ret[key] = value[:MAX_SUMMARY_STRING]
+        elif isinstance(value, (int, float, bool)) or value is None:
+            ret[key] = value
+        elif isinstance(value, (list, tuple, dict)):
+            ret[key] = {"length": len(value)}
+    return ret
+
+
+class TraceRecorder:
+    """
+    Appends requests as JSON lines to gzip compressed files in directory:
+        {"time": unix time, "endpoint": "/map-match", "body": request, "status": 200, "duration": seconds,
+         "response": summary of the answer}
+    The files are rotated after max_bytes (uncompressed), only the max_files newest files are kept.
+
+    record() only puts the request into a queue, a background thread serializes and writes it.
+    If the queue is full, the request is dropped instead of slowing the API down.
+
+    >>> from tempfile import TemporaryDirectory
+    >>> with TemporaryDirectory() as tmp_dir:
+    ...     recorder = TraceRecorder(tmp_dir, sample_rate=1)
+    ...     recorder.should_record()
+    ...     recorder.record("/shapes", {"shape_id": "1"}, 200, 0.01, {"polyline": [], "stops": []})
+    ...     recorder.close()
+    ...     with gzip.open(glob(join(tmp_dir, "*.jsonl.gz"))[0], "rt") as f:
+    ...         trace = json.loads(f.readline())
+    True
+    >>> trace["endpoint"], trace["body"], trace["response"]
+    ('/shapes', {'shape_id': '1'}, {'polyline': {'length': 0}, 'stops': {'length': 0}})
+    """
+
+    def __init__(self, directory: str, sample_rate: float = 0, max_bytes: int = 50 * 1024 ** 2,
+                 max_files: int = 20, queue_size: int = 10000, flush_seconds: float = 5):
+        """
+        Input:
+            directory: where the traces are written to, created if it does not exist
+            sample_rate: probability that a request is recorded, 0 disables recording
+            max_bytes: uncompressed size after which a new file is started
+            max_files: number of files that are kept, the oldest ones are removed
+            queue_size: number of requests that can wait to be written
+            flush_seconds: the file is flushed after this many seconds without requests
+        """
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.flush_seconds = flush_seconds
+        self.dropped = 0
+        self.recorded = 0
+        self._queue = Queue(maxsize=queue_size)
+        self._thread = None
+        if sample_rate > 0:
+            self._thread = Thread(target=self._write_traces, daemon=True)
+            self._thread.start()
+
+    def should_record(self) -> bool:
+        return self.sample_rate > 0 and (self.sample_rate >= 1 or random() < self.sample_rate)
+
+    def record(self, endpoint: str, body, status: int, duration: float, answer=None):
+        """
+        Called on the request thread, only puts the request into the queue.
+        The answer is summarized by the background thread, so it must not be changed afterwards.
+        """
+        try:
+            self._queue.put_nowait((datetime.now().timestamp(), endpoint, body, status, duration, answer))
+        except Full:
+            self.dropped += 1
+
+    def close(self):
+        """
+        Writes the waiting requests and stops the background thread
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _open_file(self):
+        makedirs(self.directory, exist_ok=True)
+        file_name = join(self.directory, datetime.now().strftime("trace-%Y%m%d-%H%M%S-%f.jsonl.gz"))
+        self._remove_old_files(keep=self.max_files - 1)
+        return gzip.open(file_name, "wt")
+
+    def _remove_old_files(self, keep: int):
+        files = sorted(glob(join(self.directory, "trace-*.jsonl.gz")), key=getmtime)
+        for old_file in files[:max(0, len(files) - keep)]:
+            remove(old_file)
+
+    def _write_traces(self):
+        """
+        Runs in the background thread
+        """
+        f, written = None, 0
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_seconds)
+            except Empty:
+                if f is not None:
+                    f.flush()
+                continue
+
+            if item is None:
+                break
+
+            timestamp, endpoint, body, status, duration, answer = item
+            line = json.dumps({"time": timestamp, "endpoint": endpoint, "body": body, "status": status,
+                               "duration": duration, "response": summarize_answer(answer)}, default=str) + "\n"
+
+            if f is None or written + len(line) > self.max_bytes:
+                if f is not None:
+                    f.close()
+                f, written = self._open_file(), 0
+            f.write(line)
+            written += len(line)
+            self.recorded += 1
+
+        if f is not None:
+            f.close()
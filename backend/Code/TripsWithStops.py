@@ -176,8 +176,8 @@ class TripWithStopsAndTimes:
         >>> day3 = datetime(2022, 7, 29, 19, 45, 0)  # is a friday (4)
         >>> test_trip.is_trip_active(day3, test_tt) == (False, False)
         True
-        >>> test_realtime = [(0, None, (86400, False), None),
-        ...                  (2, None, (86400, False), None)]
+        >>> from RealtimeDelays import TripDelays
+        >>> test_realtime = TripDelays.from_updates([(0, None, 86400), (2, None, 86400)])
         >>> day1 = datetime(2022, 7, 28, 18, 20, 0)  # is a thursday (3)
         >>> test_trip.is_trip_active(day1, test_tt, test_realtime) == (False, False)
         True
@@ -192,9 +192,7 @@ class TripWithStopsAndTimes:
         # we do not know the trip segment yet, thus go through all possible delays,
         # break if any of them is true
         if realtime:
-            delays_to_check = Utils.get_delays_to_check(
-                user_datetime, realtime,
-                tt.trip_id_to_route_id_and_list_of_stop_times_and_stop_id_dict[self.trip_id][1])
+            delays_to_check = Utils.get_delays_to_check(realtime)
 
             extra_dates, removed_dates = tt.service_id_to_service_information_dict[self.service_id][3:5]
 
@@ -307,12 +305,11 @@ class TripWithStopsAndTimes:
         True
         >>> test_id = 27
         >>> test_time = datetime(2022, 7, 28, 19, 46, 0)  # is a thursday (3)
-        >>> test_realtime = [(1, None, (datetime(2022, 7, 28, 19, 46), True), None),
-        ...                  (2, (datetime(2022, 7, 28, 19, 46), True), None, None)]
+        >>> from RealtimeDelays import TripDelays
+        >>> test_realtime = TripDelays.from_updates([(1, None, 60), (2, 60, None)])
         >>> test_trip.get_active_trip_segment_ids(test_time, test_id, test_tt, test_realtime) == [1, 2]
         True
-        >>> test_realtime = [(1, None, (datetime(2022, 7, 28, 19, 46), True), None),
-        ...                  (2, None, (-600, False), None)]
+        >>> test_realtime = TripDelays.from_updates([(1, None, 60), (2, None, -600)])
         >>> test_trip.get_active_trip_segment_ids(test_time, test_id, test_tt, test_realtime) == [1]
         True
         """
@@ -367,8 +364,7 @@ class TripWithStopsAndTimes:
                     td_end = timedelta(days=1)
 
             # get delay from the realtime data/dict
-            start_delay, stop_delay = Utils.get_rt_offset(
-                realtime_data, trip_segment_id, start_tuple, end_tuple, difference)
+            start_delay, stop_delay = Utils.get_rt_offset(realtime_data, trip_segment_id)
 
             start_with_offset = start_time - earliness + difference + td_start + start_delay
             end_with_offset = end_time + delay + difference + td_end + stop_delay
@@ -3,15 +3,14 @@ Copyright 2022
 Bachelor's thesis by Gerrit Freiwald and Robin Wu
 """
 import pandas as pd
+from array import array
 from typing import List, Tuple, Any
 from math import radians, sin, cos, atan2, sqrt
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta
 from networkx.algorithms.shortest_paths.weighted import _weight_function
 from heapq import heappush as push, heappop as pop
 from itertools import count
 from pytz import timezone as pytz_timezone, utc as pytz_utc
-import threading
-from functools import wraps
 
 
 def get_multiple_max_values(lst: List[Tuple[Any, int]]) -> List[Tuple[Any, int]]:
@@ -98,141 +97,52 @@ def get_colors(color: str, text_color: str, route_type: int) -> (str, str):
     return color, text_color  # default: return (white, black)
 
 
-def get_delay_single_tuple(delay, time_tuple, difference=timedelta(0)):
-    """
-    Get the delay for a single option
-
-    >>> test_delay = (datetime(2022, 8, 30, 23,00), True)
-    >>> test_time_tuple = (datetime(1900, 1, 1, 22, 00), False)
-    >>> test_difference = timedelta(days=44801)
-    >>> get_delay_single_tuple(test_delay, test_time_tuple, test_difference) == timedelta(hours=1)
-    True
-    >>> test_delay = (datetime(2022, 8, 30, 22,00), True)
-    >>> test_time_tuple = (datetime(1900, 1, 1, 23, 00), False)
-    >>> test_difference = timedelta(days=44801)
-    >>> get_delay_single_tuple(test_delay, test_time_tuple, test_difference) == timedelta(hours=-1)
-    True
-    >>> test_delay = (datetime(2022, 8, 31, 2 ,00), True)
-    >>> test_time_tuple = (datetime(1900, 1, 1, 1, 00), True)
-    >>> test_difference = timedelta(days=44801)
-    >>> get_delay_single_tuple(test_delay, test_time_tuple, test_difference) == timedelta(hours=1)
-    True
-    >>> test_delay = (datetime(2022, 8, 30, 23 ,00), True)
-    >>> test_time_tuple = (datetime(1900, 1, 1, 1, 00), True)
-    >>> test_difference = timedelta(days=44801)
-    >>> get_delay_single_tuple(test_delay, test_time_tuple, test_difference) == timedelta(hours=-2)
-    True
-    >>> test_delay = (86400, False)
-    >>> test_time_tuple = (datetime(1900, 1, 1, 1, 00), True)
-    >>> test_difference = timedelta(days=44801)
-    >>> get_delay_single_tuple(test_delay, test_time_tuple, test_difference) == timedelta(days=1)
-    True
-    """
-    # in case of true it is a timestamp, convert to timedelta
-    if delay[1]:
-        time, overflow = time_tuple
-        time_overflow = time + difference + (timedelta(days=1) if overflow else timedelta(0))
-        delta = delay[0] - time_overflow
-        return delta
-    # in the other case it is just the delay in seconds
-    return timedelta(seconds=delay[0])
-
-
-def get_rt_offset(realtime, trip_segment_id, start_time, end_time, difference=timedelta(0)):
+def get_rt_offset(realtime, trip_segment_id: int) -> Tuple[timedelta, timedelta]:
     """
     If realtime data is present for a stop,
     then all following stops have the same delay,
     until a stop has new realtime information.
+    The delays are propagated when the realtime data is fetched, see RealtimeDelays.TripDelays.
 
     If stop 1 has a delay of 5 minutes and stop 3 has a delay of 2 minutes,
     then stop 0 has no delay
     stop 1, 2 have a delay of 5 minutes
     stop 3 and all following stops have 2 mintues delay.
 
-    >>> test_ts_id = 0
-    >>> test_start_time, test_end_time = (datetime(1900, 1, 1, 18, 30), False), (datetime(1900, 1, 1, 19, 30), False)
-    >>> test_realtime = [(0, None, (300, False), None),
-    ...                  (2, None, (600, False), None)]
-    >>> get_rt_offset(test_realtime, test_ts_id, test_start_time, test_end_time) == (
-    ...     timedelta(minutes=5), timedelta(minutes=5))
-    True
-    >>> test_start_time, test_end_time = (datetime(1900, 1, 1, 18, 30), False), (datetime(1900, 1, 1, 19, 30), False)
-    >>> test_diff = datetime(2022, 8, 31) - datetime(1900, 1, 1)
-    >>> test_realtime = [(0, None, (datetime(2022, 8, 31, 18, 35), True), None),
-    ...                  (2, None, (datetime(2022, 8, 31, 19, 40), True), None)]
-    >>> get_rt_offset(test_realtime, test_ts_id, test_start_time, test_end_time, test_diff) == (
-    ...     timedelta(minutes=5), timedelta(minutes=5))
-    True
-    >>> test_ts_id = 1
-    >>> test_start_time, test_end_time = (datetime(1900, 1, 1, 18, 30), False), (datetime(1900, 1, 1, 19, 30), False)
-    >>> test_diff = datetime(2022, 8, 31) - datetime(1900, 1, 1)
-    >>> test_realtime = [(0, None, (datetime(2022, 8, 31, 18, 35), True), None),
-    ...                  (2, (datetime(2022, 8, 31, 19, 40), True), None, None)]
-    >>> get_rt_offset(test_realtime, test_ts_id, test_start_time, test_end_time, test_diff) == (
-    ...     timedelta(minutes=5), timedelta(minutes=10))
-    True
-    >>> test_start_time, test_end_time = (datetime(1900, 1, 1, 18, 30), False), (datetime(1900, 1, 1, 19, 30), False)
-    >>> test_realtime = [(0, None, (300, False), None),
-    ...                  (3, (420, False), (600, False), None)]
-    >>> get_rt_offset(test_realtime, test_ts_id, test_start_time, test_end_time) == (
-    ...     timedelta(minutes=5), timedelta(minutes=5))
-    True
-    >>> test_ts_id = 3
-    >>> test_start_time, test_end_time = (datetime(1900, 1, 1, 18, 30), False), (datetime(1900, 1, 1, 19, 30), False)
-    >>> test_realtime = [(0, None, (300, False), None),
-    ...                  (2, (420, False), (600, False), None)]
-    >>> get_rt_offset(test_realtime, test_ts_id, test_start_time, test_end_time) == (
-    ...     timedelta(minutes=10), timedelta(minutes=10))
-    True
-    >>> test_ts_id = 0
-    >>> test_start_time, test_end_time = (datetime(1900, 1, 1, 18, 30), False), (datetime(1900, 1, 1, 19, 30), False)
-    >>> test_realtime = [(1, None, (300, False), None),
-    ...                  (2, None, (600, False), None)]
-    >>> get_rt_offset(test_realtime, test_ts_id, test_start_time, test_end_time) == (
-    ...     timedelta(0), timedelta(0))
-    True
-    """
-    start_delay, stop_delay = timedelta(0), timedelta(0)
-    # find realtime info for the trip segment
-    if realtime is not None:
-        for ts_id, arrival_delay, departure_delay, _ in realtime:
-            if ts_id >= trip_segment_id + 1:
-                if ts_id == trip_segment_id + 1 and arrival_delay:
-                    stop_delay = get_delay_single_tuple(arrival_delay, end_time, difference)
-                else:
-                    stop_delay = start_delay
-                break
-
-            if departure_delay:
-                delay = get_delay_single_tuple(departure_delay, start_time, difference)
-                start_delay, stop_delay = delay, delay
+    Returns (delay at the start, delay at the end of the trip segment)
 
-    return start_delay, stop_delay
+    >>> from RealtimeDelays import TripDelays
+    >>> test_realtime = TripDelays.from_updates([(0, None, 300), (2, None, 600)])
+    >>> get_rt_offset(test_realtime, 0) == (timedelta(minutes=5), timedelta(minutes=5))
+    True
+    >>> test_realtime = TripDelays.from_updates([(0, None, 300), (2, 600, None)])
+    >>> get_rt_offset(test_realtime, 1) == (timedelta(minutes=5), timedelta(minutes=10))
+    True
+    >>> test_realtime = TripDelays.from_updates([(0, None, 300), (2, 420, 600)])
+    >>> get_rt_offset(test_realtime, 3) == (timedelta(minutes=10), timedelta(minutes=10))
+    True
+    >>> test_realtime = TripDelays.from_updates([(1, None, 300), (2, None, 600)])
+    >>> get_rt_offset(test_realtime, 0) == (timedelta(0), timedelta(0))
+    True
+    >>> get_rt_offset(None, 0) == (timedelta(0), timedelta(0))
+    True
+    """
+    if realtime is None:
+        return timedelta(0), timedelta(0)
+    start_delay, stop_delay = realtime.offset(trip_segment_id)
+    return timedelta(seconds=start_delay), timedelta(seconds=stop_delay)
 
 
-def get_delays_to_check(user_datetime, realtime_data, list_stop_times_ids):
+def get_delays_to_check(realtime) -> List[timedelta]:
     """
-    Take a list of delays, convert to a list of delays with second
+    The delays the trip can have at its stops
 
-    >>> test_ut = datetime(2022, 8, 30, 22, 30)
-    >>> test_rt = [(0, None, (30, False), None),
-    ...            (1, (-86400, False), (datetime(2022, 9, 2, 0), True), None)]
-    >>> test_st = [((datetime(1900, 1, 1, 22), False), (datetime(1900, 1, 1, 23), False), None),
-    ...            ((datetime(1900, 1, 1, 23), False), (datetime(1900, 1, 1, 0), True), None)]
-    >>> get_delays_to_check(test_ut, test_rt, test_st) == [timedelta(seconds=30),timedelta(days=-1), timedelta(days=2)]
+    >>> from RealtimeDelays import TripDelays
+    >>> test_rt = TripDelays.from_updates([(0, None, 30), (1, -86400, 172800)])
+    >>> get_delays_to_check(test_rt) == [timedelta(seconds=30), timedelta(days=-1), timedelta(days=2)]
     True
     """
-    delays_to_check = []
-    for stop_sequence, arrival_delay, departure_delay, _ in realtime_data:
-        arrival_tuple, departure_tuple, _ = list_stop_times_ids[stop_sequence]
-        difference = user_datetime.date() - date(1900, 1, 1)
-        if arrival_delay:
-            to_add = get_delay_single_tuple(arrival_delay, arrival_tuple, difference)
-            delays_to_check.append(to_add)
-        if departure_delay:
-            to_add = get_delay_single_tuple(departure_delay, departure_tuple, difference)
-            delays_to_check.append(to_add)
-    return delays_to_check
+    return [timedelta(seconds=delay) for delay in realtime.distinct_delays]
 
 
 def is_within_active_hours(active_hours: set, current_time: datetime) -> bool:
@@ -263,21 +173,6 @@ def is_within_active_hours(active_hours: set, current_time: datetime) -> bool:
            (current_time.weekday(), current_time.hour, True) in active_hours
 
 
-def repeat_every_n_minutes(n: float):
-    """
-    Repeats a given function once every n minutes.
-
-    no doctest for this function
-    """
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            threading.Timer(n * 60, wrapper, args, kwargs).start()
-            return func(*args, **kwargs)
-        return wrapper
-    return decorator
-
-
 def date_span_hour(start_date, end_date):
     """
     Yield once for every hour between two datetime objects.
@@ -505,6 +400,166 @@ def are_last_n_coordinates_timewise_too_far_apart(
     return False
 
 
+def split_route_window(
+        coords_with_timestamps: List[Tuple[float, float, float]], n_points: int = 0, n_seconds: int = 0
+) -> (List[Tuple[float, float, float]], List[Tuple[float, float, float]]):
+    """
+    Splits the coordinates into the older history and the window of the last n_points coordinates,
+    that are at most n_seconds older than the last coordinate. The last coordinate is always in the window.
+    0 disables the limit.
+
+    >>> coords_w_timestamps = [(1, 2, 100), (1, 2, 130), (1, 2, 160), (1, 2, 190)]
+    >>> split_route_window(coords_w_timestamps, n_points=2)
+    ([(1, 2, 100), (1, 2, 130)], [(1, 2, 160), (1, 2, 190)])
+    >>> split_route_window(coords_w_timestamps, n_seconds=60)
+    ([(1, 2, 100)], [(1, 2, 130), (1, 2, 160), (1, 2, 190)])
+    >>> split_route_window(coords_w_timestamps, n_points=3, n_seconds=30)
+    ([(1, 2, 100), (1, 2, 130)], [(1, 2, 160), (1, 2, 190)])
+    >>> split_route_window(coords_w_timestamps) == ([], coords_w_timestamps)
+    True
+    >>> split_route_window([], n_points=2)
+    ([], [])
+    """
+    start = 0
+    if n_points > 0:
+        start = max(0, len(coords_with_timestamps) - n_points)
+    if n_seconds > 0 and coords_with_timestamps:
+        last_time = coords_with_timestamps[-1][2]
+        while start < len(coords_with_timestamps) - 1 and last_time - coords_with_timestamps[start][2] > n_seconds:
+            start += 1
+    return coords_with_timestamps[:start], coords_with_timestamps[start:]
+
+
+def pack_coordinates(coordinates: List[Tuple[float, float]]) -> array:
+    """
+    Stores (lat, lon) tuples as one array of doubles [lat0, lon0, lat1, lon1, ...],
+    16 bytes per point instead of a tuple and two floats.
+
+    >>> pack_coordinates([(47.9, 7.8), (48.0, 7.9)])
+    array('d', [47.9, 7.8, 48.0, 7.9])
+    """
+    return array("d", [value for point in coordinates for value in point[:2]])
+
+
+def unpack_coordinates(packed: array) -> List[Tuple[float, float]]:
+    """
+    >>> unpack_coordinates(pack_coordinates([(47.9, 7.8), (48.0, 7.9)]))
+    [(47.9, 7.8), (48.0, 7.9)]
+    """
+    return list(zip(packed[::2], packed[1::2]))
+
+
+# meters per pixel of a 256 pixel web mercator tile at the equator and zoom level 0
+METERS_PER_PIXEL_ZOOM_0 = 156543.03392
+
+
+def zoom_to_tolerance(zoom: int, lat: float) -> float:
+    """
+    Meters per pixel of a web map at the zoom level and latitude,
+    details smaller than that are not visible
+
+    >>> round(zoom_to_tolerance(12, 47.99), 1)
+    25.6
+    """
+    return METERS_PER_PIXEL_ZOOM_0 * cos(radians(lat)) / 2 ** zoom
+
+
+def tolerance_to_zoom(tolerance: float, lat: float, max_zoom: int) -> int:
+    """
+    The lowest zoom level whose pixels are at most tolerance meters large, at most max_zoom
+
+    >>> tolerance_to_zoom(25.6, 47.99, 18), tolerance_to_zoom(25.5, 47.99, 18), tolerance_to_zoom(0, 47.99, 18)
+    (12, 13, 18)
+    """
+    if tolerance <= 0:
+        return max_zoom
+    zoom = 0
+    while zoom < max_zoom and zoom_to_tolerance(zoom, lat) > tolerance:
+        zoom += 1
+    return zoom
+
+
+def simplify_polyline(coordinates: List[Tuple[float, float]], tolerance: float) -> List[Tuple[float, float]]:
+    """
+    Douglas-Peucker simplification of a (lat, lon) polyline, removes the points
+    that are less than tolerance meters away from the simplified line. Keeps the first and the last point.
+
+    >>> simplify_polyline([(48.0, 7.8), (48.00001, 7.81), (48.0, 7.82), (48.01, 7.83)], tolerance=5)
+    [(48.0, 7.8), (48.0, 7.82), (48.01, 7.83)]
+    >>> simplify_polyline([(48.0, 7.8), (48.00001, 7.81), (48.0, 7.82), (48.01, 7.83)], tolerance=0.5)
+    [(48.0, 7.8), (48.00001, 7.81), (48.0, 7.82), (48.01, 7.83)]
+    """
+    if len(coordinates) < 3:
+        return list(coordinates)
+
+    # equirectangular projection in meters around the first point, precise enough for the length of a shape
+    lat_scale = 111320.0
+    lon_scale = lat_scale * cos(radians(coordinates[0][0]))
+    points = [(lat * lat_scale, lon * lon_scale) for lat, lon in coordinates]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    # iterative to avoid the recursion limit on long shapes
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = sqrt(dx * dx + dy * dy)
+        max_distance, index = 0.0, first
+        for i in range(first + 1, last):
+            x, y = points[i]
+            if length == 0:
+                distance = sqrt((x - x1) ** 2 + (y - y1) ** 2)
+            else:
+                distance = abs(dy * (x - x1) - dx * (y - y1)) / length
+            if distance > max_distance:
+                max_distance, index = distance, i
+        if max_distance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [point for point, kept in zip(coordinates, keep) if kept]
+
+
+def delta_encode(coordinates: List[Tuple[float, float]], precision: int = 5) -> List[int]:
+    """
+    Coordinates as integers with precision decimals, every point relative to the previous one:
+    [lat0, lon0, lat1 - lat0, lon1 - lon0, ...]
+
+    >>> delta_encode([(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)])
+    [3850000, -12020000, 220000, -75000, 255200, -550300]
+    """
+    factor = 10 ** precision
+    encoded = []
+    previous_lat, previous_lon = 0, 0
+    for lat, lon in coordinates:
+        lat, lon = round(lat * factor), round(lon * factor)
+        encoded.append(lat - previous_lat)
+        encoded.append(lon - previous_lon)
+        previous_lat, previous_lon = lat, lon
+    return encoded
+
+
+def encode_polyline(coordinates: List[Tuple[float, float]], precision: int = 5) -> str:
+    """
+    Google encoded polyline algorithm format, the deltas of delta_encode as base64-like characters
+
+    >>> encode_polyline([(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)])
+    '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+    """
+    characters = []
+    for value in delta_encode(coordinates, precision):
+        # zigzag, the sign is the lowest bit
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            characters.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        characters.append(chr(value + 63))
+    return "".join(characters)
+
+
 def distance_wrapper(point1, point2):
     """
     Calculate the distance between two points.
@@ -659,6 +714,34 @@ def convert_gtfs_date_to_datetime(s: str) -> (datetime, bool):
     return date, overflow
 
 
+def gtfs_time_to_seconds(gtfs_time: str) -> int:
+    """
+    Converts a GTFS time string to the seconds since the start of the service day.
+    Times after midnight of the next day (e.g. "25:30:00") are larger than 24 * 60 * 60.
+
+    >>> gtfs_time_to_seconds("00:01:05")
+    65
+    >>> gtfs_time_to_seconds("25:30:00")
+    91800
+    """
+    hours, minutes, seconds = gtfs_time.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def time_tuple_to_seconds(time_tuple: Tuple[datetime, bool]) -> int:
+    """
+    Converts a (time, overtime) tuple, as used in the stop lists of the GTFSContainer,
+        to the seconds since the start of the service day.
+
+    >>> time_tuple_to_seconds((datetime(1900, 1, 1, 0, 1, 5), False))
+    65
+    >>> time_tuple_to_seconds((datetime(1900, 1, 1, 1, 30), True))
+    91800
+    """
+    time, overtime = time_tuple
+    return time.hour * 3600 + time.minute * 60 + time.second + (86400 if overtime else 0)
+
+
 def bidirectional_dijkstra_modified(g, source, target, weight="weight", penalty=1000000000, thresh=500):
     """
     Modified version of bidirectional_dijkstra from networkx